@@ -1,32 +1,246 @@
-"""
-Convert Clang C Abstract Syntax Tree to GML Format
-"""
-import argparse
-import json
-import typing
-
-import pygml.ast
-
-
-def main() -> None:
-    cfg = parse_args()
-    file = typing.cast(str, cfg.FILE)
-
-    with open(file, "r") as f:
-        data = json.load(f)
-    prog = pygml.ast.convert_program(data)
-    conv = pygml.ast.encode_program(prog)
-
-    with open(file + ".conv", "w") as f:
-        json.dump(conv, f)
-
-def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(description=__doc__)
-    parser.add_argument("FILE", type=str,
-                        help="File to convert. Expects .json format!")
-    cfg = parser.parse_args()
-    return cfg
-
-
-if __name__ == "__main__":
-    main()
+"""
+Convert Clang C Abstract Syntax Tree to GML Format
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import typing
+
+import pygml.batch
+import pygml.cache
+import pygml.convert
+import pygml.incremental
+import pygml.jsonio
+import pygml.memory
+
+if typing.TYPE_CHECKING:
+    # imported only where it is used: building the node classes and codecs of
+    # pygml.ast is most of what starting up costs, and a conversion served
+    # from the cache never needs them
+    import pygml.ast
+
+
+def main() -> None:
+    cfg = parse_args()
+    files = typing.cast(typing.List[str], cfg.FILE)
+    stream = not cfg.no_stream
+    if cfg.json_backend is not None:
+        # the environment reaches worker processes however they are started
+        os.environ[pygml.jsonio.JSON_BACKEND_ENV] = cfg.json_backend
+    cache = None
+    if not cfg.no_cache or cfg.cache_stats:
+        cache = pygml.cache.ConversionCache(cfg.cache_dir, cfg.cache_size << 20)
+
+    if cfg.cache_stats:
+        print(json.dumps(cache.summary(), indent=2))
+        return
+
+    max_memory = None if cfg.max_memory is None else cfg.max_memory << 20
+
+    if not is_batch(cfg):
+        file = files[0]
+        function_jobs = cfg.function_jobs or os.cpu_count() or 1
+        dst = pygml.batch.output_path(file, None, cfg.format, cfg.compress)
+        if is_reporting_memory(cfg):
+            # measure a real conversion, not a cache hit, in this process
+            memory = pygml.memory.MemoryReport()
+            try:
+                pygml.convert.convert_file(file, dst, stream, None, cfg.format, 1,
+                                           cfg.skip_unsupported, max_memory=max_memory,
+                                           memory=memory)
+            finally:
+                report_memory(memory, cfg)
+            return
+        if is_profiling(cfg):
+            # profile a real conversion, not a cache hit, in this process
+            profile_conversion(file, dst, stream, cfg)
+            return
+        pygml.convert.convert_file(file, dst, stream, cache, cfg.format,
+                                   function_jobs, cfg.skip_unsupported, cfg.incremental,
+                                   max_memory)
+        if cache is not None:
+            cache.flush_stats()
+        return
+
+    try:
+        counts = pygml.batch.run_batch(
+            files,
+            jobs=cfg.jobs,
+            out_dir=cfg.out_dir,
+            manifest=cfg.manifest,
+            stream=stream,
+            cache=cache,
+            fmt=cfg.format,
+            skip_unsupported=cfg.skip_unsupported,
+            incremental=cfg.incremental,
+            compress=cfg.compress,
+            max_memory=max_memory,
+        )
+    except pygml.batch.OutputCollision as e:
+        sys.exit(str(e))
+    print(", ".join(f"{n} {status}" for status, n in counts.items()))
+    if counts["error"]:
+        sys.exit(1)
+
+def is_batch(cfg: argparse.Namespace) -> bool:
+    if cfg.batch or len(cfg.FILE) > 1:
+        return True
+    return any(opt is not None for opt in (cfg.jobs, cfg.out_dir, cfg.manifest))
+
+def is_profiling(cfg: argparse.Namespace) -> bool:
+    return cfg.profile or cfg.profile_json is not None
+
+def is_reporting_memory(cfg: argparse.Namespace) -> bool:
+    return cfg.memory_report or cfg.memory_json is not None
+
+def report_memory(memory: pygml.memory.MemoryReport, cfg: argparse.Namespace) -> None:
+    if cfg.memory_json is not None:
+        with open(cfg.memory_json, "w") as f:
+            json.dump(memory.report(), f, indent=2)
+    if cfg.memory_report:
+        print(memory.format(), file=sys.stderr)
+
+def profile_conversion(file: str, dst: str, stream: bool, cfg: argparse.Namespace) -> None:
+    import pygml.ast
+    with pygml.ast.profiling() as profile:
+        try:
+            pygml.convert.convert_file(file, dst, stream, None, cfg.format,
+                                       1, cfg.skip_unsupported)
+        finally:
+            report_profile(profile, cfg)
+
+def report_profile(profile: pygml.ast.Profile, cfg: argparse.Namespace) -> None:
+    if cfg.profile_json is not None:
+        with open(cfg.profile_json, "w") as f:
+            json.dump(profile.report(), f, indent=2)
+    if cfg.profile:
+        print(profile.format(cfg.profile_sort), file=sys.stderr)
+
+class LazyChoices:
+    """Choices for argparse, read only when it checks a value against them
+    or prints them."""
+
+    def __init__(self, get: typing.Callable[[], typing.Sequence[str]]) -> None:
+        self.get = get
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.get()
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self.get())
+
+def profile_sort_keys() -> typing.List[str]:
+    import pygml.ast
+    return sorted(pygml.ast.PROFILE_SORT_KEYS)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("FILE", type=str, nargs="*",
+                        help="File to convert. Expects .json format! "
+                             "In batch mode, also directories and glob patterns")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Decode the whole dump at once, memory-mapped, instead "
+                             "of reading only its function declarations")
+    parser.add_argument("--format", choices=sorted(pygml.convert.SUFFIXES), default="json",
+                        help="Output format: json writes FILE.conv for the checker, "
+                             "binary writes the compact FILE.convb. Default: json")
+    parser.add_argument("--compress", choices=sorted(pygml.jsonio.COMPRESSIONS), default=None,
+                        help="Compress the output, adding .gz or .zst to its name. "
+                             "Compressed inputs are recognized by their contents")
+    parser.add_argument("--json-backend", choices=sorted(pygml.jsonio.BACKENDS), default=None,
+                        help="JSON library for decoding whole dumps; the output is "
+                             "the same whichever is used. "
+                             f"Default: ${pygml.jsonio.JSON_BACKEND_ENV} or the fastest installed")
+    skip = parser.add_mutually_exclusive_group()
+    skip.add_argument("--skip-unsupported", action="store_true",
+                      help="Leave out, with a warning, functions the converter "
+                           "cannot handle instead of failing")
+    skip.add_argument("--skip-drivers", action="store_const", dest="skip_unsupported",
+                      const=pygml.convert.DRIVERS,
+                      help="As --skip-unsupported, but only for drivers: main and "
+                           "functions starting an OpenMP parallel region")
+    parser.add_argument("--function-jobs", type=int, default=1,
+                        help="Worker processes converting the functions of a single "
+                             "whole-translation-unit dump; 0 means the CPU count. "
+                             "Default: 1")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Convert only the functions that changed since the last "
+                             "--incremental run and reuse the rest, which are kept "
+                             f"in the output file name plus {pygml.incremental.STATE_SUFFIX}")
+
+    profile = parser.add_argument_group(
+        "profiling",
+        "Per clang node kind (and per expression tag when encoding), count "
+        "nodes and stack items and time them. Single-file mode only; the "
+        "cache is bypassed.")
+    profile.add_argument("--profile", action="store_true",
+                         help="Print the profile to stderr")
+    profile.add_argument("--profile-json", type=str, default=None,
+                         help="Write the profile to this file as JSON")
+    profile.add_argument("--profile-sort", default="self",
+                         choices=LazyChoices(profile_sort_keys),
+                         help="Column the printed profile is sorted by. Default: self")
+
+    memory = parser.add_argument_group(
+        "memory",
+        "Resident memory per stage: load, convert, encode and dump, or a "
+        "single stream stage when converting one function at a time.")
+    memory.add_argument("--max-memory", type=int, default=None, metavar="MIB",
+                        help="Memory budget per conversion in MiB. A dump predicted to "
+                             "need more is converted a leaner way: streamed and pruned, "
+                             "or failing that one function at a time")
+    memory.add_argument("--memory-report", action="store_true",
+                        help="Print the peak memory of each stage to stderr. Single-file "
+                             "mode only; the cache is bypassed")
+    memory.add_argument("--memory-json", type=str, default=None,
+                        help="Write the memory report to this file as JSON")
+
+    cache = parser.add_argument_group(
+        "conversion cache",
+        "Unchanged inputs are served from an on-disk cache keyed by their "
+        "contents and the converter version, repeating any warnings about "
+        "skipped functions.")
+    cache.add_argument("--no-cache", action="store_true",
+                       help="Neither read nor fill the cache")
+    cache.add_argument("--cache-dir", type=str, default=None,
+                       help=f"Cache location. Default: ${pygml.cache.CACHE_DIR_ENV} "
+                            "or ~/.cache/pygml")
+    cache.add_argument("--cache-size", type=int,
+                       default=pygml.cache.DEFAULT_SIZE >> 20,
+                       help="Cache size cap in MiB; least recently used entries "
+                            f"are evicted beyond it. Default: {pygml.cache.DEFAULT_SIZE >> 20}")
+    cache.add_argument("--cache-stats", action="store_true",
+                       help="Print cache hit/miss statistics and exit")
+
+    batch = parser.add_argument_group(
+        "batch mode",
+        "Used when several inputs or any of these options are given.")
+    batch.add_argument("--batch", action="store_true",
+                       help="Force batch mode for a single input")
+    batch.add_argument("-j", "--jobs", type=int, default=None,
+                       help="Number of worker processes. Default: CPU count")
+    batch.add_argument("--out-dir", type=str, default=None,
+                       help="Directory for .conv files, which keep each input's path below "
+                            "the directory or glob root it was found under. "
+                            "Default: next to each input")
+    batch.add_argument("--manifest", type=str, default=None,
+                       help="JSON Lines manifest of finished files, used to resume. "
+                            f"Default: {pygml.batch.MANIFEST_NAME} in the output directory")
+    cfg = parser.parse_args()
+    if not cfg.FILE and not cfg.cache_stats:
+        parser.error("the following arguments are required: FILE")
+    if cfg.function_jobs != 1 and is_batch(cfg):
+        parser.error("--function-jobs takes a single file; batch mode spreads files instead")
+    if is_profiling(cfg) and is_batch(cfg):
+        parser.error("--profile and --profile-json take a single file")
+    if is_reporting_memory(cfg) and (is_batch(cfg) or cfg.incremental or is_profiling(cfg)):
+        parser.error("--memory-report and --memory-json take a single file, "
+                     "without --incremental or profiling")
+    return cfg
+
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,193 @@
-"""
-Util for cleaning up clang ast - make more readable for developement
-"""
-import json
-import sys
-from typing import Any
-
-FORBIDDEN = ("id", "loc", "range", "mangledname", "isused", "type", "valueCategory", "castKind")
-
-
-def filter_node(node: Any) -> Any:
-    """Recursively filter forbidden keys from json structures."""
-
-    if isinstance(node, dict):
-        new = {}
-        for k, v in node.items():
-            # remove any key containing any forbidden substring
-            if any(f in k.lower() for f in FORBIDDEN):
-                continue
-            new[k] = filter_node(v)
-        return new
-
-    elif isinstance(node, list):
-        return [filter_node(v) for v in node]
-
-    else:
-        return node
-
-
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: filter_ast.py input.json output.json")
-        sys.exit(1)
-
-    inp, out = sys.argv[1], sys.argv[2]
-
-    with open(inp, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    cleaned = filter_node(data)
-
-    with open(out, "w", encoding="utf-8") as f:
-        json.dump(cleaned, f, indent=2)
-
-    print(f"Filtered JSON written to {out}")
-
-
-if __name__ == "__main__":
-    main()
+"""
+Util for cleaning up clang ast - make more readable for developement
+
+Reads clang -ast-dump=json output from files or stdin and writes it back
+without location, type and id noise.  Input is filtered as it is read, so
+dumps of any size are handled in bounded memory.  Files may be gzip or zstd
+compressed; output is compressed when its name ends in .gz or .zst.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import typing
+from typing import Any
+
+from pygml.ast import CHUNK_SIZE, SKIP, iter_events
+from pygml.jsonio import open_file
+
+# Lowercase substrings; a key containing any of them is removed.
+FORBIDDEN = ("id", "loc", "range", "mangledname", "isused", "type", "valuecategory", "castkind")
+
+# Output is handed to the file in pieces of about this many strings.
+_FLUSH_PIECES = 1 << 12
+
+_encode_string = json.encoder.encode_basestring_ascii  # type: ignore[attr-defined]
+
+
+class _KeyDecisions(dict):
+    """Maps a key to its encoded form followed by ": ", or to None if the key
+    is forbidden.  Dumps reuse a few dozen key names, so each is checked
+    against FORBIDDEN only the first time it is seen.
+    """
+
+    def __missing__(self, key: str) -> typing.Optional[str]:
+        lower = key.lower()
+        if any(f in lower for f in FORBIDDEN):
+            decision = None
+        else:
+            decision = _encode_string(key) + ": "
+        self[key] = decision
+        return decision
+
+
+_KEYS = _KeyDecisions()
+
+
+def filter_node(node: Any) -> Any:
+    """Recursively filter forbidden keys from json structures."""
+
+    if isinstance(node, dict):
+        new = {}
+        for k, v in node.items():
+            # remove any key containing any forbidden substring
+            if _KEYS[k] is None:
+                continue
+            new[k] = filter_node(v)
+        return new
+
+    elif isinstance(node, list):
+        return [filter_node(v) for v in node]
+
+    else:
+        return node
+
+
+def _scalar(value: Any) -> str:
+    if type(value) is str:
+        return _encode_string(value)
+    if value is None:
+        return "null"
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    return repr(value)
+
+
+def filter_stream(fin: typing.TextIO, fout: typing.TextIO, chunk_size: int = CHUNK_SIZE) -> int:
+    """Filter the JSON documents read from ``fin`` into ``fout``.
+
+    The output is what ``json.dump(filter_node(doc), fout, indent=2)`` writes
+    for each document, followed by a newline, but no document is ever built.
+    Returns the number of documents written.
+    """
+    keys = _KEYS
+    events = iter_events(fin, chunk_size)
+    out: typing.List[str] = []
+    # per open container: whether it is an object, and whether anything has
+    # been written into it yet
+    in_map: typing.List[bool] = []
+    nonempty: typing.List[bool] = []
+    indent = "\n"
+    after_key = False
+    docs = 0
+    for event, value in events:
+        if event == "map_key":
+            key = keys[value]
+            if key is None:
+                if next(events)[0] != "value":
+                    events.send(SKIP)
+                continue
+            out.append(("," + indent + key) if nonempty[-1] else (indent + key))
+            nonempty[-1] = True
+            after_key = True
+            continue
+
+        if event == "end_map" or event == "end_array":
+            in_map.pop()
+            indent = indent[:-2]
+            close = "}" if event == "end_map" else "]"
+            out.append(indent + close if nonempty.pop() else close)
+            if not in_map:
+                out.append("\n")
+                docs += 1
+            if len(out) > _FLUSH_PIECES:
+                fout.write("".join(out))
+                out.clear()
+            continue
+
+        if after_key:
+            after_key = False
+        elif in_map:
+            out.append(("," + indent) if nonempty[-1] else indent)
+            nonempty[-1] = True
+        if event == "value":
+            out.append(_scalar(value))
+            if not in_map:
+                out.append("\n")
+                docs += 1
+            continue
+        is_map = event == "start_map"
+        out.append("{" if is_map else "[")
+        in_map.append(is_map)
+        nonempty.append(False)
+        indent += "  "
+
+    fout.write("".join(out))
+    return docs
+
+
+def _input(path: str) -> typing.ContextManager[typing.TextIO]:
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    return open_file(path, "r")
+
+
+def _output(path: typing.Optional[str]) -> typing.ContextManager[typing.TextIO]:
+    if path is None or path == "-":
+        return contextlib.nullcontext(sys.stdout)
+    return open_file(path, "w")
+
+
+def main():
+    cfg = parse_args()
+    files = cfg.FILE or ["-"]
+
+    for file in files:
+        out = cfg.output
+        if cfg.out_dir is not None:
+            name = "stdin.json" if file == "-" else os.path.basename(file)
+            out = os.path.join(cfg.out_dir, name)
+        with _input(file) as fin, _output(out) as fout:
+            filter_stream(fin, fout)
+        if out is not None and out != "-":
+            print(f"Filtered JSON written to {out}", file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("FILE", type=str, nargs="*",
+                        help="Clang JSON dump to filter; - or none reads stdin. "
+                             "Of two, a second that does not exist yet is the output")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Output file. Default: stdout, with several inputs "
+                             "written one document after another")
+    parser.add_argument("--out-dir", type=str, default=None,
+                        help="Write each input to a file of the same name in this directory")
+    cfg = parser.parse_args()
+    if (len(cfg.FILE) == 2 and cfg.output is None and cfg.out_dir is None
+            and not os.path.exists(cfg.FILE[1])):
+        # the older "filter_ast.py input.json output.json" form
+        cfg.FILE, cfg.output = cfg.FILE[:1], cfg.FILE[1]
+    if cfg.output is not None and cfg.out_dir is not None:
+        parser.error("--output and --out-dir are mutually exclusive")
+    if cfg.output is not None and len(cfg.FILE) > 1:
+        parser.error("--output takes a single input; use --out-dir for several")
+    return cfg
+
+
+if __name__ == "__main__":
+    main()
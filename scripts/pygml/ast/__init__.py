@@ -1,3 +1,9 @@
 from ._codec import *
 from ._conv import *
+from ._hashcons import *
+from ._index import *
+from ._jsonwriter import *
+from ._profile import *
+from ._traverse import *
 from ._types import *
+from ._stream import *
@@ -1,441 +1,936 @@
-from ._types import *
-
-
-"""
-LONG IDENTIFIERS
-"""
-
-def decode_longid(data) -> LongId:
-    tag = data[0]
-    if tag == "Id":
-        return Id(data[1])
-    elif tag == "Modid":
-        return ModId(data[1], decode_longid(data[2]))
-    else:
-        raise ValueError("bad longid", data)
-
-
-def encode_longid(x):
-    if isinstance(x, Id):
-        return ["Id", x.name]
-    if isinstance(x, ModId):
-        return ["Modid", x.module, encode_longid(x.rest)]
-    raise TypeError(x)
-
-
-"""
-CONSTANTS
-"""
-
-def decode_const(data):
-    tag = data[0]
-    if tag == "Num":
-        return Num(data[1])
-    raise ValueError("bad const", data)
-
-
-def encode_const(c):
-    if isinstance(c, Num):
-        return ["Num", c.value]
-    raise TypeError(c)
-
-
-"""
-EXPRESSIONS
-"""
-
-def decode_expr(data) -> Expr:
-    edesc = data["edesc"]
-    tag = edesc[0]
-
-    def E(x):
-        return decode_expr(x)
-
-    # --------------------------------------------------
-    # Basic
-    # --------------------------------------------------
-    if tag == "EVar":
-        node = EVar(decode_longid(edesc[1]))
-
-    elif tag == "EConst":
-        node = EConst(decode_const(edesc[1]))
-
-    elif tag == "EInfixop":
-        node = EInfixop(
-            edesc[1][0],
-            E(edesc[2]),
-            E(edesc[3])
-        )
-
-    # --------------------------------------------------
-    # Functions & flow
-    # --------------------------------------------------
-    elif tag == "EFunc":
-        node = EFunc(
-            edesc[1][0] if edesc[1] else None,
-            edesc[2],
-            edesc[3],
-            edesc[4],
-            edesc[5],
-            edesc[6],
-            edesc[7],
-            E(edesc[8])
-        )
-
-    elif tag == "EIf":
-        node = EIf(E(edesc[1]), E(edesc[2]), E(edesc[3]))
-
-    elif tag == "ELet":
-        node = ELet(
-            edesc[1],
-            edesc[2],
-            E(edesc[3]),
-            E(edesc[4])
-        )
-
-    elif tag == "ELetTuple":
-        node = ELetTuple(
-            edesc[1],          # tuple pattern
-            edesc[2],          # annotation
-            E(edesc[3]),      # bound expression
-            E(edesc[4])       # body
-        )
-
-    elif tag == "ELetRecord":
-        node = ELetRecord(
-            edesc[1],          # fields
-            edesc[2],          # annotation
-            E(edesc[3]),      # expr
-            E(edesc[4])       # body
-        )
-
-    # --------------------------------------------------
-    # Application
-    # --------------------------------------------------
-    elif tag == "EApp":
-        node = EApp(
-            E(edesc[1]),
-            edesc[2],
-            edesc[3],
-            E(edesc[4])
-        )
-
-    # --------------------------------------------------
-    # Matching
-    # --------------------------------------------------
-    elif tag == "EMatch":
-        node = EMatch(
-            E(edesc[1]),
-            [(pat, E(rhs)) for pat, rhs in edesc[2]]
-        )
-
-    # --------------------------------------------------
-    # Data
-    # --------------------------------------------------
-    elif tag == "ETuple":
-        node = ETuple([E(x) for x in edesc[1]])
-
-    elif tag == "ERef":
-        node = ERef(E(edesc[1]))
-
-    elif tag == "EDeref":
-        node = EDeref(E(edesc[1]))
-
-    elif tag == "EUpdate":
-        node = EUpdate(
-            E(edesc[1]),
-            E(edesc[2])
-        )
-
-    # --------------------------------------------------
-    # Concurrency / effects
-    # --------------------------------------------------
-    elif tag == "EFuture":
-        node = EFuture(edesc[1], E(edesc[2]))
-
-    elif tag == "EForce":
-        node = EForce(E(edesc[1]))
-
-    # --------------------------------------------------
-    # Other
-    # --------------------------------------------------
-    elif tag == "EPar":
-        node = EPar([E(x) for x in edesc[1]])
-
-    elif tag == "ETry":
-        node = ETry(
-            E(edesc[1]),
-            E(edesc[2])
-        )
-
-    elif tag == "EAnnot":
-        node = EAnnot(
-            E(edesc[1]),
-            edesc[2]
-        )
-
-    elif tag == "ENewVert":
-        node = ENewVert(E(edesc[1]))
-
-    else:
-        raise ValueError("unknown expr tag", tag)
-
-    return Expr(
-        node,
-        data.get("eloc"),
-        data.get("etyp"),
-        data.get("egr")
-    )
-
-
-def encode_expr(e: Expr):
-    d = e.edesc
-    if isinstance(d, Unit):
-        return None
-
-    # Basic
-    if isinstance(d, EVar):
-        ed = ["EVar", encode_longid(d.id)]
-
-    elif isinstance(d, EConst):
-        ed = ["EConst", encode_const(d.value)]
-
-    elif isinstance(d, EInfixop):
-        ed = ["EInfixop", [d.op], encode_expr(d.left), encode_expr(d.right)]
-
-    # Functions & flow
-    elif isinstance(d, EFunc):
-        ed = [
-            "EFunc",
-            [d.recursive] if d.recursive else None,
-            d.name,
-            d.arg,
-            d.arg_ty,
-            d.ret_ty,
-            d.uf,
-            d.ut,
-            encode_expr(d.body)
-        ]
-
-    elif isinstance(d, EIf):
-        ed = ["EIf",
-            encode_expr(d.cond),
-            encode_expr(d.then),
-            None if d.els is None else encode_expr(d.els)
-        ]
-
-    elif isinstance(d, ELet):
-        ed = ["ELet",
-            d.name,
-            d.ann,
-            None if d.value is None else encode_expr(d.value),
-            encode_expr(d.body)
-        ]
-
-    elif isinstance(d, ELetTuple):
-        ed = ["ELetTuple",
-            d.pat,
-            d.ann,
-            encode_expr(d.value),
-            encode_expr(d.body)
-        ]
-
-    elif isinstance(d, ELetRecord):
-        ed = ["ELetRecord",
-            d.fields,
-            d.ann,
-            encode_expr(d.value),
-            encode_expr(d.body)
-        ]
-
-    # App
-    elif isinstance(d, EApp):
-        ed = ["EApp",
-            encode_expr(d.fn),
-            d.v1,
-            d.v2,
-            encode_expr(d.arg)
-        ]
-
-    # Match
-    elif isinstance(d, EMatch):
-        ed = ["EMatch",
-            encode_expr(d.scrutinee),
-            [(pat, encode_expr(rhs)) for pat, rhs in d.cases]
-        ]
-
-    # Data
-    elif isinstance(d, ETuple):
-        ed = ["ETuple", [encode_expr(x) for x in d.values]]
-
-    elif isinstance(d, ERef):
-        ed = ["ERef", encode_expr(d.value)]
-
-    elif isinstance(d, EDeref):
-        ed = ["EDeref", encode_expr(d.value)]
-
-    elif isinstance(d, EUpdate):
-        ed = ["EUpdate",
-            encode_expr(d.target),
-            encode_expr(d.value)
-        ]
-
-    # Effects
-    elif isinstance(d, EFuture):
-        ed = ["EFuture", d.v, encode_expr(d.expr)]
-
-    elif isinstance(d, EForce):
-        ed = ["EForce", encode_expr(d.expr)]
-
-    # Other
-    elif isinstance(d, EPar):
-        ed = ["EPar", [encode_expr(x) for x in d.values]]
-
-    elif isinstance(d, ETry):
-        ed = ["ETry",
-            encode_expr(d.try_expr),
-            encode_expr(d.catch_expr)
-        ]
-
-    elif isinstance(d, EAnnot):
-        ed = ["EAnnot",
-            encode_expr(d.expr),
-            d.ann
-        ]
-
-    elif isinstance(d, ENewVert):
-        ed = ["ENewVert", encode_expr(d.expr)]
-
-    else:
-        raise TypeError("unhandled expr", d)
-
-    return {
-        "edesc": ed,
-        "eloc": e.eloc,
-        "etyp": e.etyp,
-        "egr": e.egr
-    }
-
-
-"""
-DECLARATIONS
-"""
-
-def decode_decl(data) -> Decl:
-    desc = data["ddesc"]
-    tag = desc[0]
-
-    if tag == "DVal":
-        node = DVal(
-            desc[1],
-            desc[2],
-            decode_expr(desc[3])
-        )
-
-    elif tag == "DExp":
-        node = DExp(
-            decode_expr(desc[1])
-        )
-
-    elif tag == "DExtType":
-        node = DExtType(desc[1])
-
-    elif tag == "DExtRecType":
-        # desc[2] is list[(longid, typ)]
-        fields = [
-            (decode_longid(fid), ftyp)
-            for (fid, ftyp) in desc[2]
-        ]
-        node = DExtRecType(desc[1], fields)
-
-    elif tag == "DExternal":
-        node = DExternal(
-            decode_longid(desc[1]),
-            desc[2]
-        )
-
-    elif tag == "DTypeDef":
-        node = DTypeDef(
-            desc[1],   # params : list[str]
-            desc[2],   # type name
-            desc[3]    # constructors
-        )
-
-    else:
-        raise ValueError("unsupported decl", tag)
-
-    return Decl(
-        node,
-        data.get("dloc"),
-        data.get("dinfo")
-    )
-
-
-def encode_decl(d: Decl):
-    desc = d.ddesc
-
-    if isinstance(desc, DVal):
-        dd = [
-            "DVal",
-            desc.name,
-            desc.typ,
-            encode_expr(desc.expr)
-        ]
-
-    elif isinstance(desc, DExp):
-        dd = [
-            "DExp",
-            encode_expr(desc.expr)
-        ]
-
-    elif isinstance(desc, DExtType):
-        dd = [
-            "DExtType",
-            desc.name
-        ]
-
-    elif isinstance(desc, DExtRecType):
-        dd = [
-            "DExtRecType",
-            desc.name,
-            [
-                (encode_longid(fid), ftyp)
-                for (fid, ftyp) in desc.fields
-            ]
-        ]
-
-    elif isinstance(desc, DExternal):
-        dd = [
-            "DExternal",
-            encode_longid(desc.id),
-            desc.typ
-        ]
-
-    elif isinstance(desc, DTypeDef):
-        dd = [
-            "DTypeDef",
-            desc.params,
-            desc.name,
-            desc.ctors
-        ]
-
-    else:
-        raise TypeError("unhandled decl", desc)
-
-    return {
-        "ddesc": dd,
-        "dloc": d.dloc,
-        "dinfo": d.dinfo
-    }
-
-
-"""
-PROGRAM
-"""
-
-def decode_program(js) -> typing.List[Decl]:
-    return [decode_decl(d) for d in js]
-
-
-def encode_program(prog):
-    return [encode_decl(d) for d in prog]
+import dataclasses
+import enum
+
+from . import _gencache, _profile, _schema
+from ._hashcons import HashCons
+from ._types import *
+from ._types import _NO_ANNOTATION
+
+
+"""
+CODE GENERATION
+"""
+
+# The codec is generated from the field annotations in _types (see _schema):
+# one decode and one encode function per variant class, found through tables
+# keyed by wire tag and by class, so encoder and decoder always agree on the
+# layout.  The wire format is the one ppx_deriving_yojson gives the OCaml
+# side: a variant is a list of its tag and arguments, a constant constructor
+# a one-element list, and an absent option is null.
+#
+# Expressions are decoded and encoded with an explicit stack instead of
+# recursion, so deeply nested programs are handled without hitting the
+# recursion limit.  The generated function for an expression builds its node
+# with the expression fields left as None and pushes each child together with
+# the slot it fills (a list index, or a field name for dataclasses).
+#
+# The compiled code is cached on disk (see _gencache), so only the first
+# import after the classes change pays for generating it.
+
+# Unions of variant classes, with the name of their codec functions.
+_UNIONS = {LongId: "longid", Const: "const"}
+
+
+class _Source:
+    def __init__(self) -> None:
+        self.lines: typing.List[str] = []
+        self.names = 0
+
+    def fresh(self, prefix: str) -> str:
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def add(self, indent: int, line: str) -> None:
+        self.lines.append("    " * indent + line)
+
+
+def _optional_arg(hint):
+    args = typing.get_args(hint)
+    if typing.get_origin(hint) is typing.Union and type(None) in args and len(args) == 2:
+        return args[0] if args[1] is type(None) else args[1]
+    return None
+
+
+def _value(src: _Source, hint, x: str, decode: bool) -> str:
+    """Python expression converting the value ``x`` of type ``hint``."""
+    direction = "decode" if decode else "encode"
+    if isinstance(hint, type) and issubclass(hint, enum.Enum):
+        return f"{x}[0]" if decode else f"[{x}]"
+    if hint in _UNIONS:
+        # the first variant, by far the most common, is built inline
+        first = _schema.variants(hint)[0]
+        fields = _schema.fields_of(first)
+        general = f"{direction}_{_UNIONS[hint]}({x})"
+        if decode:
+            args = [_value(src, f.hint, f"{x}[{i}]", True) for i, f in enumerate(fields, 1)]
+            return f"({first.__name__}({', '.join(args)}) if {x}[0] == {_schema.tag_of(first)!r} else {general})"
+        items = [repr(_schema.tag_of(first))]
+        items += [_value(src, f.hint, f"{x}.{f.name}", False) for f in fields]
+        return f"([{', '.join(items)}] if type({x}) is {first.__name__} else {general})"
+    inner = _optional_arg(hint)
+    if inner is not None:
+        conv = _value(src, inner, x, decode)
+        return x if conv == x else f"(None if {x} is None else {conv})"
+    origin = typing.get_origin(hint)
+    if origin is list:
+        v = src.fresh("v")
+        conv = _value(src, typing.get_args(hint)[0], v, decode)
+        return x if conv == v else f"[{conv} for {v} in {x}]"
+    if origin is tuple:
+        items = [f"{x}[{i}]" for i in range(len(typing.get_args(hint)))]
+        convs = [_value(src, h, v, decode) for h, v in zip(typing.get_args(hint), items)]
+        if not decode:
+            if convs == items:
+                return x
+            return "[" + ", ".join(convs) + "]"
+        if convs == items:
+            return f"tuple({x})"
+        return "(" + ", ".join(convs) + ("," if len(convs) == 1 else "") + ")"
+    if dataclasses.is_dataclass(hint):
+        raise TypeError("variant outside a union", hint)
+    return x
+
+
+def _gen_variant(src: _Source, cls: type) -> None:
+    """Codec of a variant without expression fields, e.g. Id or Num."""
+    fields = _schema.fields_of(cls)
+    args = [_value(src, f.hint, f"data[{i}]", True) for i, f in enumerate(fields, 1)]
+    src.add(0, f"def _decode_{cls.__name__}(data):")
+    src.add(1, f"return {cls.__name__}({', '.join(args)})")
+    items = [repr(_schema.tag_of(cls))]
+    items += [_value(src, f.hint, f"x.{f.name}", False) for f in fields]
+    src.add(0, f"def _encode_{cls.__name__}(x):")
+    src.add(1, f"return [{', '.join(items)}]")
+
+
+def _case_items(src: _Source, x: str, decode: bool) -> typing.Tuple[str, int]:
+    """List display for one match case with its expression left as None."""
+    hints = typing.get_args(MatchCase)
+    slot = hints.index(Expr)
+    items = [
+        "None" if h is Expr else _value(src, h, f"{x}[{i}]", decode)
+        for i, h in enumerate(hints)
+    ]
+    return "[" + ", ".join(items) + "]", slot
+
+
+def _gen_expr(src: _Source, cls: type, decode: bool) -> None:
+    """Codec of one expression description, e.g. EIf."""
+    fields = _schema.fields_of(cls)
+    name = cls.__name__
+    if decode:
+        src.add(0, f"def _decode_{name}(edesc, todo):")
+        get = [f"edesc[{i}]" for i in range(1, len(fields) + 1)]
+    else:
+        src.add(0, f"def _encode_{name}(d, todo):")
+        get = [f"d.{f.name}" for f in fields]
+
+    items = []
+    pushes = []
+    for i, (f, x) in enumerate(zip(fields, get), 1):
+        slot = repr(f.name) if decode else str(i)
+        if f.kind in (_schema.EXPR, _schema.OPT_EXPR):
+            items.append("None")
+            push = [f"todo.append(({x}, node, {slot}))"]
+            if f.kind == _schema.OPT_EXPR:
+                push = [f"if {x} is not None:", "    " + push[0]]
+            pushes.append(push)
+        elif f.kind == _schema.EXPRS:
+            v, xs = src.fresh("items"), src.fresh("x")
+            src.add(1, f"{xs} = {x}")
+            src.add(1, f"{v} = [None] * len({xs})")
+            items.append(v)
+            pushes.append([
+                f"for j in range(len({xs}) - 1, -1, -1):",
+                f"    todo.append(({xs}[j], {v}, j))",
+            ])
+        elif f.kind == _schema.CASES:
+            v, xs = src.fresh("cases"), src.fresh("x")
+            case, k = _case_items(src, "c", decode)
+            src.add(1, f"{xs} = {x}")
+            src.add(1, f"{v} = [{case} for c in {xs}]")
+            items.append(v)
+            pushes.append([
+                f"for case, c in zip(reversed({v}), reversed({xs})):",
+                f"    todo.append((c[{k}], case, {k}))",
+            ])
+        else:
+            items.append(_value(src, f.hint, x, decode))
+
+    if decode:
+        src.add(1, f"node = {name}({', '.join(items)})")
+    else:
+        src.add(1, f"node = [{', '.join([repr(_schema.tag_of(cls))] + items)}]")
+    # pushed last to first, so children are visited in field order
+    for push in reversed(pushes):
+        for line in push:
+            src.add(1, line)
+    src.add(1, "return node")
+
+
+def _gen_decl(src: _Source, cls: type) -> None:
+    """Codec of one declaration description, e.g. DVal."""
+    fields = _schema.fields_of(cls)
+    args, items = [], [repr(_schema.tag_of(cls))]
+    for i, f in enumerate(fields, 1):
+        if f.kind == _schema.EXPR:
+            args.append(f"decode_expr(desc[{i}], hashcons, lazy)")
+            items.append(f"encode_expr(d.{f.name})")
+        elif f.kind == _schema.VALUE:
+            args.append(_value(src, f.hint, f"desc[{i}]", True))
+            items.append(_value(src, f.hint, f"d.{f.name}", False))
+        else:
+            raise TypeError("unsupported declaration field", cls, f)
+    src.add(0, f"def _decode_{cls.__name__}(desc, hashcons, lazy):")
+    src.add(1, f"return {cls.__name__}({', '.join(args)})")
+    src.add(0, f"def _encode_{cls.__name__}(d):")
+    src.add(1, f"return [{', '.join(items)}]")
+
+
+def _generate() -> str:
+    src = _Source()
+    for union in _UNIONS:
+        for cls in _schema.variants(union):
+            _gen_variant(src, cls)
+    for cls in _schema.variants(ExprDesc):
+        _gen_expr(src, cls, True)
+        _gen_expr(src, cls, False)
+    for cls in _schema.variants(DeclDesc):
+        _gen_decl(src, cls)
+    return "\n".join(src.lines) + "\n"
+
+
+exec(_gencache.generated_code("_codec.py", "codec", _generate, "<pygml.ast generated codec>"))
+
+
+def _tables(union) -> typing.Tuple[dict, dict]:
+    classes = _schema.variants(union)
+    decoders = {_schema.tag_of(cls): globals()[f"_decode_{cls.__name__}"] for cls in classes}
+    encoders = {cls: globals()[f"_encode_{cls.__name__}"] for cls in classes}
+    return decoders, encoders
+
+
+_LONGID_DECODERS, _LONGID_ENCODERS = _tables(LongId)
+_CONST_DECODERS, _CONST_ENCODERS = _tables(Const)
+_EXPR_DECODERS, _EXPR_ENCODERS = _tables(ExprDesc)
+_DECL_DECODERS, _DECL_ENCODERS = _tables(DeclDesc)
+
+
+"""
+LONG IDENTIFIERS
+"""
+
+def decode_longid(data) -> LongId:
+    try:
+        decode = _LONGID_DECODERS[data[0]]
+    except KeyError:
+        raise ValueError("bad longid", data) from None
+    return decode(data)
+
+
+def encode_longid(x):
+    try:
+        encode = _LONGID_ENCODERS[type(x)]
+    except KeyError:
+        raise TypeError(x) from None
+    return encode(x)
+
+
+"""
+CONSTANTS
+"""
+
+def decode_const(data):
+    try:
+        decode = _CONST_DECODERS[data[0]]
+    except KeyError:
+        raise ValueError("bad const", data) from None
+    return decode(data)
+
+
+def encode_const(c):
+    try:
+        encode = _CONST_ENCODERS[type(c)]
+    except KeyError:
+        raise TypeError(c) from None
+    return encode(c)
+
+
+"""
+EXPRESSIONS
+"""
+
+def _decode_label(item) -> typing.Tuple[str, bool]:
+    return item[0]["edesc"][0], True
+
+
+def _encode_label(item) -> typing.Tuple[str, bool]:
+    return _schema.tag_of(type(item[0].edesc)), True
+
+
+def decode_expr(data, hashcons: typing.Optional[HashCons] = None, lazy: bool = False) -> Expr:
+    """Decode the expression ``data``; with ``lazy``, as a :class:`LazyExpr`."""
+    if lazy:
+        if hashcons is not None:
+            raise ValueError("lazy decoding cannot share subtrees")
+        return LazyExpr(data)
+    decoders = _EXPR_DECODERS
+    root = [None]
+    todo: list = [(data, root, 0)]
+    if _profile._active is not None:
+        todo = _profile._active.stack("decode_expr", todo, _decode_label)
+    while todo:
+        data, parent, slot = todo.pop()
+        edesc = data["edesc"]
+        try:
+            decode = decoders[edesc[0]]
+        except KeyError:
+            raise ValueError("unknown expr tag", edesc[0]) from None
+        expr = Expr(
+            decode(edesc, todo),
+            data.get("eloc"),
+            data.get("etyp"),
+            data.get("egr")
+        )
+        if type(slot) is int:
+            parent[slot] = expr
+        else:
+            setattr(parent, slot, expr)
+
+    if hashcons is not None:
+        return hashcons.share(root[0])
+    return root[0]
+
+
+def encode_expr(e: Expr):
+    encoders = _EXPR_ENCODERS
+    root = [None]
+    todo: list = [(e, root, 0)]
+    if _profile._active is not None:
+        todo = _profile._active.stack("encode_expr", todo, _encode_label)
+    while todo:
+        e, parent, slot = todo.pop()
+        eloc, etyp, egr = e._annotation
+        if e.__class__ is LazyExpr and e._data is not None:
+            # never decoded, so the JSON it came from is still current
+            parent[slot] = {"edesc": e._data["edesc"], "eloc": eloc, "etyp": etyp, "egr": egr}
+            continue
+        d = e.edesc
+        try:
+            encode = encoders[type(d)]
+        except KeyError:
+            raise TypeError("unhandled expr", d) from None
+        parent[slot] = {
+            "edesc": encode(d, todo),
+            "eloc": eloc,
+            "etyp": etyp,
+            "egr": egr
+        }
+
+    return root[0]
+
+
+"""
+LAZY DECODING
+"""
+
+_edesc_slot = Expr.edesc
+
+
+class LazyExpr(Expr):
+    """An :class:`Expr` decoded from its JSON on demand.
+
+    The annotations are read up front, but ``edesc`` is decoded only when it
+    is first read, and only one level deep: the expressions inside it are
+    LazyExprs in turn.  Anything that walks the tree sees what the eager
+    decoder would have built.  Encoding a LazyExpr whose ``edesc`` was never
+    read hands back its JSON unchanged.
+    """
+    __slots__ = ("_data",)
+
+    def __init__(self, data) -> None:
+        self._data = data
+        eloc, etyp, egr = data.get("eloc"), data.get("etyp"), data.get("egr")
+        if eloc is None and etyp is None and egr is None:
+            self._annotation = _NO_ANNOTATION
+        else:
+            self._annotation = (eloc, etyp, egr)
+
+    @property
+    def edesc(self) -> ExprDesc:
+        data = self._data
+        if data is None:
+            return _edesc_slot.__get__(self)
+        edesc = data["edesc"]
+        try:
+            decode = _EXPR_DECODERS[edesc[0]]
+        except KeyError:
+            raise ValueError("unknown expr tag", edesc[0]) from None
+        children: list = []
+        d = decode(edesc, children)
+        for child, parent, slot in children:
+            if type(slot) is int:
+                parent[slot] = LazyExpr(child)
+            else:
+                setattr(parent, slot, LazyExpr(child))
+        _edesc_slot.__set__(self, d)
+        self._data = None
+        return d
+
+    @edesc.setter
+    def edesc(self, value: ExprDesc) -> None:
+        _edesc_slot.__set__(self, value)
+        self._data = None
+
+    @property
+    def decoded(self) -> bool:
+        """Whether ``edesc`` has been decoded."""
+        return self._data is None
+
+
+"""
+DECLARATIONS
+"""
+
+def decode_decl(data, hashcons: typing.Optional[HashCons] = None, lazy: bool = False) -> Decl:
+    """Decode the declaration ``data``; with ``lazy``, its expression is a
+    :class:`LazyExpr`."""
+    desc = data["ddesc"]
+    try:
+        decode = _DECL_DECODERS[desc[0]]
+    except KeyError:
+        raise ValueError("unsupported decl", desc[0]) from None
+    return Decl(
+        decode(desc, hashcons, lazy),
+        data.get("dloc"),
+        data.get("dinfo")
+    )
+
+
+def encode_decl(d: Decl):
+    desc = d.ddesc
+    try:
+        encode = _DECL_ENCODERS[type(desc)]
+    except KeyError:
+        raise TypeError("unhandled decl", desc) from None
+    return {
+        "ddesc": encode(desc),
+        "dloc": d.dloc,
+        "dinfo": d.dinfo
+    }
+
+
+"""
+PROGRAM
+"""
+
+def decode_program(
+    js,
+    hashcons: typing.Optional[HashCons] = None,
+    lazy: bool = False,
+) -> typing.List[Decl]:
+    return [decode_decl(d, hashcons, lazy) for d in js]
+
+
+def encode_program(prog):
+    return [encode_decl(d) for d in prog]
+
+
+"""
+BINARY FORMAT
+"""
+
+# A compact alternative to the JSON wire format for Python consumers:
+#
+#     b"GMLB" version  nstrings (length utf-8)*  token*
+#
+# Every number is an unsigned LEB128 varint, and the body is a flat run of
+# varint tokens written in pre-order.  Strings are stored once in the table
+# and referred to by index.  An expression starts with one token holding its
+# class index in the low bits and a mask of its non-null annotations above
+# them, so an unannotated node costs a single byte.  Then come the present
+# annotations, the other fields in order (lists and optional expressions
+# contribute their length or presence), and last the subexpressions.  Fields
+# typed str hold a string index shifted left, or 1 and an untyped value when
+# the string is something else.  Values the schema does not pin down are
+# written as a type token and a payload, see _put_any.
+
+BINARY_MAGIC = b"GMLB"
+BINARY_VERSION = 1
+
+_EXPR_BITS = 5
+_DECL_BITS = 3
+_ANNOTATION_BITS = 3
+
+_EXPR_CLASSES = _schema.variants(ExprDesc)
+_DECL_CLASSES = _schema.variants(DeclDesc)
+assert len(_EXPR_CLASSES) <= 1 << _EXPR_BITS and len(_DECL_CLASSES) <= 1 << _DECL_BITS
+
+_ANY_NONE = 0
+_ANY_FALSE = 1
+_ANY_TRUE = 2
+_ANY_INT = 3
+_ANY_NEG = 4
+_ANY_FLOAT = 5
+_ANY_STR = 6
+_ANY_LIST = 7
+_ANY_TUPLE = 8
+_ANY_DICT = 9
+
+
+def _put_any(v, put, string) -> None:
+    t = type(v)
+    if t is str:
+        put(_ANY_STR)
+        put(string(v))
+    elif v is None:
+        put(_ANY_NONE)
+    elif v is True or v is False:
+        put(_ANY_TRUE if v else _ANY_FALSE)
+    elif t is int:
+        if v >= 0:
+            put(_ANY_INT)
+            put(v)
+        else:
+            put(_ANY_NEG)
+            put(~v)
+    elif t is list or t is tuple:
+        put(_ANY_LIST if t is list else _ANY_TUPLE)
+        put(len(v))
+        for x in v:
+            _put_any(x, put, string)
+    elif t is dict:
+        put(_ANY_DICT)
+        put(len(v))
+        for k, x in v.items():
+            _put_any(k, put, string)
+            _put_any(x, put, string)
+    elif t is float:
+        put(_ANY_FLOAT)
+        put(string(repr(v)))
+    elif isinstance(v, str):
+        _put_any(str(v), put, string)
+    elif isinstance(v, int):
+        _put_any(int(v), put, string)
+    else:
+        raise TypeError("cannot encode value", v)
+
+
+def _get_any(nxt, strings):
+    t = nxt()
+    if t == _ANY_STR:
+        return strings[nxt()]
+    if t == _ANY_NONE:
+        return None
+    if t == _ANY_FALSE or t == _ANY_TRUE:
+        return t == _ANY_TRUE
+    if t == _ANY_INT:
+        return nxt()
+    if t == _ANY_NEG:
+        return ~nxt()
+    if t == _ANY_LIST:
+        return [_get_any(nxt, strings) for _ in range(nxt())]
+    if t == _ANY_TUPLE:
+        return tuple(_get_any(nxt, strings) for _ in range(nxt()))
+    if t == _ANY_DICT:
+        d = {}
+        for _ in range(nxt()):
+            k = _get_any(nxt, strings)
+            d[k] = _get_any(nxt, strings)
+        return d
+    if t == _ANY_FLOAT:
+        return float(strings[nxt()])
+    raise ValueError("bad value token", t)
+
+
+def _put_other(v, put, string) -> None:
+    put(1)
+    _put_any(v, put, string)
+
+
+def _put_value(src: _Source, indent: int, hint, x: str) -> None:
+    """Statements writing the value ``x`` of type ``hint``."""
+    if isinstance(hint, type) and issubclass(hint, enum.Enum):
+        src.add(indent, f"put(_{hint.__name__.upper()}_INDEX[{x}])")
+        return
+    if hint in _UNIONS:
+        src.add(indent, f"_bput_{_UNIONS[hint]}({x}, put, string)")
+        return
+    if hint is str:
+        src.add(indent, f"put(string({x}) << 1) if type({x}) is str else _put_other({x}, put, string)")
+        return
+    inner = _optional_arg(hint)
+    origin = typing.get_origin(hint)
+    if inner is not None:
+        if isinstance(inner, type) and issubclass(inner, enum.Enum):
+            src.add(indent, f"put(0 if {x} is None else _{inner.__name__.upper()}_INDEX[{x}] + 1)")
+            return
+        if inner is object:
+            src.add(indent, f"_put_any({x}, put, string)")
+            return
+        src.add(indent, f"if {x} is None:")
+        src.add(indent + 1, "put(0)")
+        src.add(indent, "else:")
+        src.add(indent + 1, "put(1)")
+        _put_value(src, indent + 1, inner, x)
+    elif origin is list:
+        v = src.fresh("v")
+        src.add(indent, f"put(len({x}))")
+        src.add(indent, f"for {v} in {x}:")
+        _put_value(src, indent + 1, typing.get_args(hint)[0], v)
+    elif origin is tuple:
+        for i, h in enumerate(typing.get_args(hint)):
+            _put_value(src, indent, h, f"{x}[{i}]")
+    else:
+        src.add(indent, f"_put_any({x}, put, string)")
+
+
+def _get_value(hint) -> str:
+    """Python expression reading a value of type ``hint``."""
+    if isinstance(hint, type) and issubclass(hint, enum.Enum):
+        return f"_{hint.__name__.upper()}_VALUES[nxt()]"
+    if hint in _UNIONS:
+        return f"_bget_{_UNIONS[hint]}(nxt, strings)"
+    if hint is str:
+        return "(strings[t >> 1] if not (t := nxt()) & 1 else _get_any(nxt, strings))"
+    inner = _optional_arg(hint)
+    origin = typing.get_origin(hint)
+    if inner is not None:
+        if isinstance(inner, type) and issubclass(inner, enum.Enum):
+            return f"(None if (t := nxt()) == 0 else _{inner.__name__.upper()}_VALUES[t - 1])"
+        if inner is object:
+            return "_get_any(nxt, strings)"
+        return f"(None if nxt() == 0 else {_get_value(inner)})"
+    if origin is list:
+        return f"[{_get_value(typing.get_args(hint)[0])} for _ in range(nxt())]"
+    if origin is tuple:
+        items = [_get_value(h) for h in typing.get_args(hint)]
+        return "(" + ", ".join(items) + ("," if len(items) == 1 else "") + ")"
+    return "_get_any(nxt, strings)"
+
+
+def _gen_binary_union(src: _Source, union) -> None:
+    name = _UNIONS[union]
+    src.add(0, f"def _bput_{name}(x, put, string):")
+    src.add(1, "cls = type(x)")
+    for index, cls in enumerate(_schema.variants(union)):
+        src.add(1, f"if cls is {cls.__name__}:")
+        src.add(2, f"put({index})")
+        for f in _schema.fields_of(cls):
+            _put_value(src, 2, f.hint, f"x.{f.name}")
+        src.add(2, "return")
+    src.add(1, "raise TypeError(x)")
+    src.add(0, f"def _bget_{name}(nxt, strings):")
+    src.add(1, "index = nxt()")
+    for index, cls in enumerate(_schema.variants(union)):
+        args = [_get_value(f.hint) for f in _schema.fields_of(cls)]
+        src.add(1, f"if index == {index}:")
+        src.add(2, f"return {cls.__name__}({', '.join(args)})")
+    src.add(1, f"raise ValueError('bad {name} index', index)")
+
+
+def _gen_binary_expr(src: _Source, cls: type) -> None:
+    fields = _schema.fields_of(cls)
+    name = cls.__name__
+
+    src.add(0, f"def _bput_{name}(d, put, string, todo):")
+    pushes = []
+    for f in fields:
+        x = f"d.{f.name}"
+        if f.kind == _schema.EXPR:
+            pushes.append([f"todo.append({x})"])
+        elif f.kind == _schema.OPT_EXPR:
+            src.add(1, f"put(0 if {x} is None else 1)")
+            pushes.append([f"if {x} is not None:", f"    todo.append({x})"])
+        elif f.kind == _schema.EXPRS:
+            src.add(1, f"put(len({x}))")
+            pushes.append([f"todo.extend(reversed({x}))"])
+        elif f.kind == _schema.CASES:
+            hints = typing.get_args(MatchCase)
+            k = hints.index(Expr)
+            src.add(1, f"put(len({x}))")
+            src.add(1, f"for c in {x}:")
+            for i, h in enumerate(hints):
+                if i != k:
+                    _put_value(src, 2, h, f"c[{i}]")
+            pushes.append([f"todo.extend([c[{k}] for c in reversed({x})])"])
+        else:
+            _put_value(src, 1, f.hint, x)
+    for push in reversed(pushes):
+        for line in push:
+            src.add(1, line)
+    if not fields:
+        src.add(1, "pass")
+
+    src.add(0, f"def _bget_{name}(nxt, strings, todo):")
+    args = []
+    pushes = []
+    for i, f in enumerate(fields):
+        slot = repr(f.name)
+        if f.kind == _schema.EXPR:
+            args.append("None")
+            pushes.append([f"todo.append((node, {slot}))"])
+        elif f.kind == _schema.OPT_EXPR:
+            src.add(1, f"present{i} = nxt()")
+            args.append("None")
+            pushes.append([f"if present{i}:", f"    todo.append((node, {slot}))"])
+        elif f.kind == _schema.EXPRS:
+            src.add(1, f"items{i} = [None] * nxt()")
+            args.append(f"items{i}")
+            pushes.append([
+                f"for j in range(len(items{i}) - 1, -1, -1):",
+                f"    todo.append((items{i}, j))",
+            ])
+        elif f.kind == _schema.CASES:
+            hints = typing.get_args(MatchCase)
+            k = hints.index(Expr)
+            case = ["None" if h is Expr else _get_value(h) for h in hints]
+            src.add(1, f"cases{i} = [[{', '.join(case)}] for _ in range(nxt())]")
+            args.append(f"cases{i}")
+            pushes.append([
+                f"for case in reversed(cases{i}):",
+                f"    todo.append((case, {k}))",
+            ])
+        else:
+            src.add(1, f"a{i} = {_get_value(f.hint)}")
+            args.append(f"a{i}")
+    src.add(1, f"node = {name}({', '.join(args)})")
+    for push in reversed(pushes):
+        for line in push:
+            src.add(1, line)
+    src.add(1, "return node")
+
+
+def _gen_binary_decl(src: _Source, cls: type) -> None:
+    fields = _schema.fields_of(cls)
+    name = cls.__name__
+    src.add(0, f"def _bput_{name}(d, put, string):")
+    for f in fields:
+        if f.kind == _schema.EXPR:
+            src.add(1, f"_bput_expr(d.{f.name}, put, string)")
+        elif f.kind == _schema.VALUE:
+            _put_value(src, 1, f.hint, f"d.{f.name}")
+        else:
+            raise TypeError("unsupported declaration field", cls, f)
+    src.add(0, f"def _bget_{name}(nxt, strings):")
+    args = []
+    for i, f in enumerate(fields):
+        if f.kind == _schema.EXPR:
+            src.add(1, f"a{i} = _bget_expr(nxt, strings)")
+        else:
+            src.add(1, f"a{i} = {_get_value(f.hint)}")
+        args.append(f"a{i}")
+    src.add(1, f"return {name}({', '.join(args)})")
+
+
+def _generate_binary() -> str:
+    src = _Source()
+    for union in _UNIONS:
+        _gen_binary_union(src, union)
+    for cls in _EXPR_CLASSES:
+        _gen_binary_expr(src, cls)
+    for cls in _DECL_CLASSES:
+        _gen_binary_decl(src, cls)
+    return "\n".join(src.lines) + "\n"
+
+
+_INFIXOP_VALUES = tuple(m.value for m in InfixOp)
+_INFIXOP_INDEX = {v: i for i, v in enumerate(_INFIXOP_VALUES)}
+_ISRECURSIVE_VALUES = tuple(m.value for m in IsRecursive)
+_ISRECURSIVE_INDEX = {v: i for i, v in enumerate(_ISRECURSIVE_VALUES)}
+
+exec(_gencache.generated_code("_codec.py", "binary", _generate_binary,
+                              "<pygml.ast generated binary codec>"))
+
+_EXPR_WRITERS = {
+    cls: (index, globals()[f"_bput_{cls.__name__}"])
+    for index, cls in enumerate(_EXPR_CLASSES)
+}
+_EXPR_READERS = [globals()[f"_bget_{cls.__name__}"] for cls in _EXPR_CLASSES]
+_DECL_WRITERS = {
+    cls: (index, globals()[f"_bput_{cls.__name__}"])
+    for index, cls in enumerate(_DECL_CLASSES)
+}
+_DECL_READERS = [globals()[f"_bget_{cls.__name__}"] for cls in _DECL_CLASSES]
+
+
+def _bput_expr(e: Expr, put, string) -> None:
+    writers = _EXPR_WRITERS
+    todo = [e]
+    while todo:
+        e = todo.pop()
+        d = e.edesc
+        try:
+            index, write = writers[type(d)]
+        except KeyError:
+            raise TypeError("unhandled expr", d) from None
+        annotation = e._annotation
+        if annotation is _NO_ANNOTATION:
+            put(index)
+        else:
+            _put_annotation(index, _EXPR_BITS, annotation, put, string)
+        write(d, put, string, todo)
+
+
+def _bget_expr(nxt, strings) -> Expr:
+    readers = _EXPR_READERS
+    root = [None]
+    todo: list = [(root, 0)]
+    while todo:
+        parent, slot = todo.pop()
+        token = nxt()
+        try:
+            read = readers[token & ((1 << _EXPR_BITS) - 1)]
+        except IndexError:
+            raise ValueError("bad expr index", token) from None
+        if token >> _EXPR_BITS:
+            annotation = _get_annotation(token >> _EXPR_BITS, nxt, strings)
+            expr = Expr(read(nxt, strings, todo), *annotation)
+        else:
+            expr = Expr(read(nxt, strings, todo))
+        if type(slot) is int:
+            parent[slot] = expr
+        else:
+            setattr(parent, slot, expr)
+    return root[0]
+
+
+def _put_annotation(index: int, bits: int, values: typing.Sequence, put, string) -> None:
+    mask = 0
+    for bit, v in enumerate(values):
+        if v is not None:
+            mask |= 1 << bit
+    put(index | mask << bits)
+    for v in values:
+        if v is not None:
+            _put_any(v, put, string)
+
+
+def _get_annotation(mask: int, nxt, strings) -> list:
+    return [
+        _get_any(nxt, strings) if mask >> bit & 1 else None
+        for bit in range(_ANNOTATION_BITS)
+    ]
+
+
+def _bput_decl(d: Decl, put, string) -> None:
+    desc = d.ddesc
+    try:
+        index, write = _DECL_WRITERS[type(desc)]
+    except KeyError:
+        raise TypeError("unhandled decl", desc) from None
+    _put_annotation(index, _DECL_BITS, (d.dloc, d.dinfo), put, string)
+    write(desc, put, string)
+
+
+def _bget_decl(nxt, strings) -> Decl:
+    token = nxt()
+    try:
+        read = _DECL_READERS[token & ((1 << _DECL_BITS) - 1)]
+    except IndexError:
+        raise ValueError("bad decl index", token) from None
+    dloc, dinfo, _ = _get_annotation(token >> _DECL_BITS, nxt, strings)
+    return Decl(read(nxt, strings), dloc, dinfo)
+
+
+def _put_varint(out: bytearray, n: int) -> None:
+    while n >= 0x80:
+        out.append(n & 0x7F | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data: bytes, pos: int) -> typing.Tuple[int, int]:
+    n = shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, pos
+        shift += 7
+
+
+def _pack_tokens(tokens: typing.List[int]) -> bytes:
+    if not tokens or max(tokens) < 0x80:
+        return bytes(tokens)
+    out = bytearray()
+    put = out.append
+    for n in tokens:
+        while n >= 0x80:
+            put(n & 0x7F | 0x80)
+            n >>= 7
+        put(n)
+    return bytes(out)
+
+
+def _unpack_tokens(body: bytes) -> typing.List[int]:
+    if body.isascii():
+        # every token fits in one byte
+        return list(body)
+    tokens = []
+    put = tokens.append
+    n = shift = 0
+    for b in body:
+        if b < 0x80:
+            put(n | b << shift)
+            n = shift = 0
+        else:
+            n |= (b & 0x7F) << shift
+            shift += 7
+    return tokens
+
+
+def encode_program_binary(prog) -> bytes:
+    tokens: typing.List[int] = []
+    put = tokens.append
+    table: typing.Dict[str, int] = {}
+
+    def string(s: str) -> int:
+        index = table.get(s)
+        if index is None:
+            index = table[s] = len(table)
+        return index
+
+    put(len(prog))
+    for d in prog:
+        _bput_decl(d, put, string)
+
+    out = bytearray(BINARY_MAGIC)
+    out.append(BINARY_VERSION)
+    _put_varint(out, len(table))
+    for s in table:
+        b = s.encode("utf-8", "surrogatepass")
+        _put_varint(out, len(b))
+        out += b
+    out += _pack_tokens(tokens)
+    return bytes(out)
+
+
+def decode_program_binary(
+    data: bytes,
+    hashcons: typing.Optional[HashCons] = None,
+) -> typing.List[Decl]:
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError("not a binary program")
+    pos = len(BINARY_MAGIC)
+    if data[pos] != BINARY_VERSION:
+        raise ValueError("unsupported binary version", data[pos])
+    n, pos = _get_varint(data, pos + 1)
+    strings = []
+    for _ in range(n):
+        length, pos = _get_varint(data, pos)
+        strings.append(data[pos:pos + length].decode("utf-8", "surrogatepass"))
+        pos += length
+
+    it = iter(_unpack_tokens(data[pos:]))
+    nxt = it.__next__
+    try:
+        prog = [_bget_decl(nxt, strings) for _ in range(nxt())]
+    except (StopIteration, IndexError):
+        raise ValueError("truncated binary program") from None
+    if next(it, None) is not None:
+        raise ValueError("trailing data after binary program")
+    if hashcons is not None:
+        prog = [hashcons.share(d) for d in prog]
+    return prog
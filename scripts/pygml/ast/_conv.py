@@ -1,198 +1,240 @@
-import typing
-
-from ._types import *
-
-
-class Task:
-    def __init__(self, name: str) -> None:
-        self.name = name
-        self.captured_decl: EVar = None
-
-    def set_captured_decl(self, expr: Expr):
-        edesc = expr.edesc
-        assert isinstance(edesc, EVar)
-        self.captured_decl = edesc
-
-active_task: Task | None = None
-
-CONVERT_OPCODE = {
-    "+": InfixOp.Plus,
-    "Add": InfixOp.Plus,
-
-    "-": InfixOp.Minus,
-    "Sub": InfixOp.Minus,
-
-    "*": InfixOp.Times,
-    "Mul": InfixOp.Times,
-
-    "/": InfixOp.Div,
-    "Div": InfixOp.Div,
-
-    "<": InfixOp.Lt,
-    "Less": InfixOp.Lt,
-
-    "<=": InfixOp.Le,
-    "LessEqual": InfixOp.Le,
-
-    ">": InfixOp.Gt,
-    "Greater": InfixOp.Gt,
-
-    ">=": InfixOp.Ge,
-    "GreaterEqual": InfixOp.Ge,
-
-    "==": InfixOp.Eq,
-    "Equal": InfixOp.Eq,
-
-    "!=": InfixOp.Ne,
-    "NotEqual": InfixOp.Ne,
-
-    "&&": InfixOp.And,
-    "LAnd": InfixOp.And,
-
-    "||": InfixOp.Or,
-    "LOr": InfixOp.Or,
-
-    "^": InfixOp.Concat,
-}
-
-
-def collapse(data):
-    global active_task
-    assert data["kind"] == "CompoundStmt"
-    if len(data["inner"]) == 1:
-        return convert(data["inner"][0])
-    else:
-        node = data["inner"].pop(0)
-        if node["kind"] == "OMPTaskDirective":
-            active_task = Task("fa")
-            return Expr(
-                ELet(
-                    active_task.name,
-                    None,
-                    convert(node),
-                    collapse(data),
-                )
-            )
-        if node["kind"] == "BinaryOperator":
-            op = node["opcode"]
-            assert op == "="
-            decl, assignment = node["inner"]
-            return Expr(
-                ELet(
-                    decl["referencedDecl"]["name"],
-                    None,
-                    convert(assignment),
-                    collapse(data),
-                )
-            )
-        if node["kind"] == "OMPTaskwaitDirective":
-            return Expr(
-                ELet(
-                    active_task.captured_decl.id.name,
-                    None,
-                    convert(node),
-                    collapse(data),
-                )
-            )
-        return Expr(
-            ELet(
-                "_",
-                None,
-                convert(node),
-                collapse(data),
-            )
-        )
-
-
-def convert(data: typing.MutableMapping):
-    global active_task
-    kind = data["kind"]
-
-    if kind == "IntegerLiteral":
-        return Expr(EConst(Num(int(data["value"]))))
-    if kind == "StringLiteral":
-        return Expr(EConst(String(data["value"])))
-    if kind == "CharacterLiteral":
-        return Expr(EConst(Char(data["value"])))
-    if kind == "CXXBoolLiteralExpr":
-        return Expr(EConst(Bool(data["value"])))
-
-    if kind == "FunctionDecl":
-        name = data["name"]
-        return Decl(
-            DVal(
-                name,
-                None,
-                Expr(
-                    EFunc(
-                        'Recursive',
-                        name,
-                        data["inner"][0]["name"],
-                        None, None, None, None,
-                        convert(data["inner"][1]),
-                    )
-                )
-            )
-        )
-    if kind == "CompoundStmt":
-        data["inner"] = [node for node in data["inner"] if node["kind"] != "DeclStmt"]
-        return collapse(data)
-    if kind == "IfStmt":
-        return Expr(
-            EIf(
-                convert(data["inner"][0]),
-                convert(data["inner"][1]),
-                None if not data.get("hasElse", False) else convert(data["inner"][2]),
-            )
-        )
-    if kind == "ImplicitCastExpr":
-        return convert(data["inner"][0])
-    if kind == "DeclRefExpr":
-        return Expr(EVar(Id(data["referencedDecl"]["name"])))
-    if kind == "BinaryOperator":
-        op = data["opcode"]
-        if op == "=":
-            raise ValueError
-        return Expr(
-            EInfixop(
-                CONVERT_OPCODE[op].value,
-                convert(data["inner"][0]),
-                convert(data["inner"][1]),
-            )   
-        )
-    if kind == "OMPTaskDirective":
-        captured_stmt = data["inner"][-1]
-        var_decl, body = captured_stmt["inner"][0]["inner"][0]["inner"]
-        active_task.set_captured_decl(convert(var_decl))
-        return Expr(
-            EFuture(
-                None,
-                convert(body)
-            )
-        )
-    if kind == "OMPTaskwaitDirective":
-        task_name = active_task.name
-        active_task = None
-        return Expr(
-            EForce(
-                Expr(
-                    EVar(Id(task_name))
-                )
-            )
-        )
-    if kind == "CallExpr":
-        return Expr(
-            EApp(
-                convert(data["inner"][0]),
-                None,
-                None,
-                convert(data["inner"][1]),
-            )
-        )
-    if kind == "ReturnStmt":
-        return convert(data["inner"][0])
-    raise ValueError(kind)
-
-
-def convert_program(data: typing.MutableMapping):
-    return [convert(data)]
+import typing
+
+from . import _profile
+from ._hashcons import HashCons
+from ._stream import CONTAINER_KINDS, function_decls
+from ._types import *
+
+
+class Task:
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.captured_decl: EVar = None
+
+    def set_captured_decl(self, expr: Expr):
+        edesc = expr.edesc
+        assert isinstance(edesc, EVar)
+        self.captured_decl = edesc
+
+active_task: Task | None = None
+
+CONVERT_OPCODE = {
+    "+": InfixOp.Plus,
+    "Add": InfixOp.Plus,
+
+    "-": InfixOp.Minus,
+    "Sub": InfixOp.Minus,
+
+    "*": InfixOp.Times,
+    "Mul": InfixOp.Times,
+
+    "/": InfixOp.Div,
+    "Div": InfixOp.Div,
+
+    "<": InfixOp.Lt,
+    "Less": InfixOp.Lt,
+
+    "<=": InfixOp.Le,
+    "LessEqual": InfixOp.Le,
+
+    ">": InfixOp.Gt,
+    "Greater": InfixOp.Gt,
+
+    ">=": InfixOp.Ge,
+    "GreaterEqual": InfixOp.Ge,
+
+    "==": InfixOp.Eq,
+    "Equal": InfixOp.Eq,
+
+    "!=": InfixOp.Ne,
+    "NotEqual": InfixOp.Ne,
+
+    "&&": InfixOp.And,
+    "LAnd": InfixOp.And,
+
+    "||": InfixOp.Or,
+    "LOr": InfixOp.Or,
+
+    "^": InfixOp.Concat,
+}
+
+
+"""
+The clang tree is lowered with an explicit work stack rather than recursion,
+so arbitrarily deep expressions and long statement lists convert without
+hitting the recursion limit.  The stack holds clang nodes still to convert
+and build steps, tuples whose first item is one of the opcodes below; a build
+step pops the converted children off the output stack and pushes the node
+made from them.  Children are pushed in reverse, so they are converted
+left to right, in the same order the recursive lowering used.
+"""
+
+_FUNC = "func"
+_IF = "if"
+_INFIX = "infix"
+_APP = "app"
+_CAPTURE = "capture"
+_FUTURE = "future"
+_COLLAPSE = "collapse"
+_LET = "let"
+
+# The node kind whose branch each build step belongs to, for profiles.
+_STEP_KINDS = {
+    _FUNC: "FunctionDecl",
+    _IF: "IfStmt",
+    _INFIX: "BinaryOperator",
+    _APP: "CallExpr",
+    _CAPTURE: "OMPTaskDirective",
+    _FUTURE: "OMPTaskDirective",
+    _COLLAPSE: "CompoundStmt",
+    _LET: "CompoundStmt",
+}
+
+
+def _profile_label(item) -> typing.Tuple[str, bool]:
+    if type(item) is tuple:
+        return _STEP_KINDS[item[0]], False
+    return item["kind"], True
+
+
+def _run(todo: list):
+    global active_task
+    out: list = []
+    while todo:
+        item = todo.pop()
+
+        if type(item) is tuple:
+            # build steps
+            op = item[0]
+            if op == _LET:
+                body = out.pop()
+                out[-1] = Expr(ELet(item[1], None, out[-1], body))
+            elif op == _COLLAPSE:
+                # statement i of a CompoundStmt: let-bind it around the rest
+                _, stmts, i = item
+                node = stmts[i]
+                if i == len(stmts) - 1:
+                    todo.append(node)
+                    continue
+                if node["kind"] == "OMPTaskDirective":
+                    active_task = Task("fa")
+                    name = active_task.name
+                elif node["kind"] == "BinaryOperator":
+                    op = node["opcode"]
+                    assert op == "="
+                    decl, node = node["inner"]
+                    name = decl["referencedDecl"]["name"]
+                elif node["kind"] == "OMPTaskwaitDirective":
+                    name = active_task.captured_decl.id.name
+                else:
+                    name = "_"
+                todo.append((_LET, name))
+                todo.append((_COLLAPSE, stmts, i + 1))
+                todo.append(node)
+            elif op == _INFIX:
+                right = out.pop()
+                out[-1] = Expr(EInfixop(item[1], out[-1], right))
+            elif op == _APP:
+                arg = out.pop()
+                out[-1] = Expr(EApp(out[-1], None, None, arg))
+            elif op == _IF:
+                els = out.pop() if item[1] else None
+                then = out.pop()
+                out[-1] = Expr(EIf(out[-1], then, els))
+            elif op == _CAPTURE:
+                active_task.set_captured_decl(out.pop())
+            elif op == _FUTURE:
+                out[-1] = Expr(EFuture(None, out[-1]))
+            elif op == _FUNC:
+                _, name, arg = item
+                out[-1] = Decl(
+                    DVal(
+                        name,
+                        None,
+                        Expr(EFunc('Recursive', name, arg, None, None, None, None, out[-1]))
+                    )
+                )
+            else:
+                raise AssertionError(op)
+            continue
+
+        # clang nodes, most frequent kinds first
+        data = item
+        kind = data["kind"]
+        if kind == "ImplicitCastExpr":
+            todo.append(data["inner"][0])
+        elif kind == "DeclRefExpr":
+            out.append(Expr(EVar(Id(data["referencedDecl"]["name"]))))
+        elif kind == "IntegerLiteral":
+            out.append(Expr(EConst(Num(int(data["value"])))))
+        elif kind == "BinaryOperator":
+            op = data["opcode"]
+            if op == "=":
+                raise ValueError
+            todo.append((_INFIX, CONVERT_OPCODE[op].value))
+            todo.append(data["inner"][1])
+            todo.append(data["inner"][0])
+        elif kind == "CallExpr":
+            todo.append((_APP,))
+            todo.append(data["inner"][1])
+            todo.append(data["inner"][0])
+        elif kind == "ReturnStmt":
+            todo.append(data["inner"][0])
+        elif kind == "CompoundStmt":
+            stmts = [node for node in data["inner"] if node["kind"] != "DeclStmt"]
+            todo.append((_COLLAPSE, stmts, 0))
+        elif kind == "IfStmt":
+            has_else = data.get("hasElse", False)
+            todo.append((_IF, has_else))
+            if has_else:
+                todo.append(data["inner"][2])
+            todo.append(data["inner"][1])
+            todo.append(data["inner"][0])
+        elif kind == "OMPTaskDirective":
+            captured_stmt = data["inner"][-1]
+            var_decl, body = captured_stmt["inner"][0]["inner"][0]["inner"]
+            todo.append((_FUTURE,))
+            todo.append(body)
+            todo.append((_CAPTURE,))
+            todo.append(var_decl)
+        elif kind == "OMPTaskwaitDirective":
+            task_name = active_task.name
+            active_task = None
+            out.append(Expr(EForce(Expr(EVar(Id(task_name))))))
+        elif kind == "StringLiteral":
+            out.append(Expr(EConst(String(data["value"]))))
+        elif kind == "CharacterLiteral":
+            out.append(Expr(EConst(Char(data["value"]))))
+        elif kind == "CXXBoolLiteralExpr":
+            out.append(Expr(EConst(Bool(data["value"]))))
+        elif kind == "FunctionDecl":
+            todo.append((_FUNC, data["name"], data["inner"][0]["name"]))
+            todo.append(data["inner"][1])
+        else:
+            raise ValueError(kind)
+
+    result, = out
+    return result
+
+
+def collapse(data):
+    assert data["kind"] == "CompoundStmt"
+    return _run([(_COLLAPSE, data["inner"], 0)])
+
+
+def convert(data: typing.MutableMapping, hashcons: typing.Optional[HashCons] = None):
+    todo = [data]
+    if _profile._active is not None:
+        todo = _profile._active.stack("convert", todo, _profile_label)
+    result = _run(todo)
+    if hashcons is not None:
+        return hashcons.share(result)
+    return result
+
+
+def convert_program(data: typing.MutableMapping, hashcons: typing.Optional[HashCons] = None):
+    """Convert a FunctionDecl, or each user function of a TranslationUnitDecl,
+    into one Decl apiece."""
+    if data["kind"] in CONTAINER_KINDS:
+        return [convert(fn, hashcons) for fn in function_decls(data)]
+    return [convert(data, hashcons)]
@@ -0,0 +1,129 @@
+"""
+On-disk cache of the generated code.
+
+The codec, the traversal and the JSON writers are generated from the node
+classes on import or on first use, and generating and compiling them is most
+of what importing pygml.ast costs.  The compiled code is kept next to the
+modules' bytecode, e.g. __pycache__/_codec.cpython-311.codec.gen (under
+sys.pycache_prefix if one is set), so later imports only unmarshal it.
+
+An entry is keyed by the interpreter's bytecode magic number, the sources
+the generators read (:data:`_SOURCES`) and whatever else the caller says the
+code depends on, and is regenerated when any of them changes.  The cache
+is written as bytecode is: not at all under ``sys.dont_write_bytecode``,
+and never failing an import when the directory is read-only.  Inside an
+archive, such as a bundle from pygml.bundle, it is read from the __pycache__
+the archive ships.
+"""
+import hashlib
+import importlib.util
+import marshal
+import os
+import sys
+import types
+import typing
+
+
+# Sources, in this package, that decide what any generated code is.
+_SOURCES = ("_codec.py", "_jsonwriter.py", "_schema.py", "_traverse.py", "_types.py")
+
+_PACKAGE_DIR = os.path.dirname(__file__)
+
+_HEADER = len(importlib.util.MAGIC_NUMBER) + hashlib.sha256().digest_size
+
+# Entries this process generated or read: file name -> contents.  pygml.bundle
+# ships them.
+GENERATED: typing.Dict[str, bytes] = {}
+
+_digest: typing.Optional[bytes] = None
+
+
+def _sources_digest() -> typing.Optional[bytes]:
+    """Hash of :data:`_SOURCES`, or None if they cannot be read."""
+    global _digest
+    if _digest is None:
+        h = hashlib.sha256(importlib.util.MAGIC_NUMBER)
+        try:
+            for name in _SOURCES:
+                h.update(name.encode() + b"\0")
+                h.update(__loader__.get_data(os.path.join(_PACKAGE_DIR, name)))
+        except OSError:
+            return None
+        _digest = h.digest()
+    return _digest
+
+
+def _cache_path(module: str, label: str) -> typing.Optional[str]:
+    """Where the entry ``label`` of ``module`` (a file name in this package)
+    is kept, or None where there is no bytecode cache."""
+    source = os.path.join(_PACKAGE_DIR, module)
+    try:
+        cached = importlib.util.cache_from_source(source)
+    except NotImplementedError:
+        return None
+    name = os.path.basename(cached)[:-len(".pyc")] + f".{label}.gen"
+    if not os.path.isfile(source):
+        # in an archive
+        return os.path.join(_PACKAGE_DIR, "__pycache__", name)
+    return os.path.join(os.path.dirname(cached), name)
+
+
+def _read(path: str, key: bytes) -> typing.Optional[types.CodeType]:
+    try:
+        data = __loader__.get_data(path)
+    except OSError:
+        return None
+    if data[:_HEADER] != key:
+        return None
+    try:
+        code = marshal.loads(data[_HEADER:])
+    except (EOFError, ValueError, TypeError):
+        return None
+    GENERATED[os.path.basename(path)] = data
+    return code
+
+
+def _write(path: str, data: bytes) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+def generated_code(
+    module: str,
+    label: str,
+    generate: typing.Callable[[], str],
+    filename: str,
+    extra: str = "",
+) -> types.CodeType:
+    """The code of ``generate()`` compiled as ``filename``, from the cache if
+    it holds it for the same sources and ``extra``.
+
+    ``module`` is the file name of the generating module and ``label`` names
+    the entry among its others; entries with a different ``extra`` are kept
+    side by side.
+    """
+    digest = _sources_digest()
+    if extra:
+        label += "-" + hashlib.sha256(extra.encode()).hexdigest()[:12]
+    path = None if digest is None else _cache_path(module, label)
+    if path is not None:
+        key = importlib.util.MAGIC_NUMBER + hashlib.sha256(digest + extra.encode()).digest()
+        code = _read(path, key)
+        if code is not None:
+            return code
+    code = compile(generate(), filename, "exec")
+    if path is not None:
+        data = key + marshal.dumps(code)
+        GENERATED[os.path.basename(path)] = data
+        if not sys.dont_write_bytecode:
+            _write(path, data)
+    return code
@@ -0,0 +1,145 @@
+import dataclasses
+import typing
+
+from ._types import *
+
+
+"""
+HASH-CONSING
+"""
+
+def _node_fields(cls: type) -> typing.Tuple[str, ...]:
+    if cls is Expr:
+        return ("edesc", "_annotation")
+    return tuple(f.name for f in dataclasses.fields(cls))
+
+
+# Every node class, with its fields in constructor order.
+_FIELDS: typing.Dict[type, typing.Tuple[str, ...]] = {
+    cls: _node_fields(cls)
+    for cls in (
+        Unhandled, Id, ModId,
+        Num, String, Char, Bool, Unit, Futref,
+        EVar, EConst, EInfixop, EFunc, EIf,
+        ELet, ELetTuple, ELetRecord,
+        EApp, EMatch, ETuple,
+        ERef, EDeref, EUpdate,
+        EFuture, EForce, EPar,
+        ETry, EAnnot, ENewVert,
+        Expr,
+        DVal, DExp, DExtType, DExtRecType, DExternal, DTypeDef,
+        Decl,
+    )
+}
+
+
+class HashCons:
+    """Factory handing out one shared instance per distinct subtree.
+
+    A node is shared when all its fields are nodes or hashable values; nodes
+    holding lists (tuples, match cases, ...) are rebuilt around shared
+    children but never shared themselves.  Every shared node has a cached
+    structural hash, and two shared nodes from the same factory are equal
+    exactly when they are the same object.  Shared nodes must not be
+    mutated.
+    """
+
+    def __init__(self) -> None:
+        self._table: typing.Dict[tuple, object] = {}
+        # id of a shared node -> its structural hash; the table keeps the
+        # nodes alive, so the ids stay valid
+        self._hashes: typing.Dict[int, int] = {}
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+    def make(self, cls: type, *args):
+        """Return the shared ``cls(*args)``; ``args`` should already be shared."""
+        key = [cls]
+        h = [cls.__name__]
+        for arg in args:
+            if type(arg) in _FIELDS:
+                ah = self._hashes.get(id(arg))
+                if ah is None:
+                    return _construct(cls, args)
+                key.append(id(arg))
+                h.append(ah)
+            else:
+                try:
+                    h.append(hash(arg))
+                except TypeError:
+                    return _construct(cls, args)
+                if type(arg) is not str:
+                    # 1, 1.0 and True are equal keys but encode differently
+                    key.append(type(arg))
+                key.append(arg)
+        self.lookups += 1
+        key_t = tuple(key)
+        node = self._table.get(key_t)
+        if node is not None:
+            self.hits += 1
+            return node
+        node = _construct(cls, args)
+        self._table[key_t] = node
+        self._hashes[id(node)] = hash(tuple(h))
+        return node
+
+    def share(self, node):
+        """Rebuild ``node`` bottom up so that its subtrees are shared."""
+        done: typing.Dict[int, object] = {}
+        todo: list = [(node, False)]
+        while todo:
+            x, ready = todo.pop()
+            if id(x) in done:
+                continue
+            cls = type(x)
+            if cls not in _FIELDS and isinstance(x, Expr):
+                # a lazily decoded expression is shared as the Expr it stands for
+                cls = Expr
+            if cls in _FIELDS:
+                values = [getattr(x, f) for f in _FIELDS[cls]]
+            elif cls is list or cls is tuple:
+                values = x
+            else:
+                done[id(x)] = x
+                continue
+            if not ready:
+                todo.append((x, True))
+                todo.extend((v, False) for v in reversed(values) if id(v) not in done)
+                continue
+            args = [done[id(v)] for v in values]
+            if cls is list or cls is tuple:
+                done[id(x)] = cls(args)
+            else:
+                done[id(x)] = self.make(cls, *args)
+        return done[id(node)]
+
+    def clear(self) -> None:
+        """Forget every shared node, keeping only the trees already built."""
+        self._table.clear()
+        self._hashes.clear()
+
+    def hash_of(self, node) -> typing.Optional[int]:
+        """Cached structural hash of a shared node, or None."""
+        return self._hashes.get(id(node))
+
+    def equal(self, a, b) -> bool:
+        """Structural equality; O(1) when both nodes are shared."""
+        if a is b:
+            return True
+        ha, hb = self.hash_of(a), self.hash_of(b)
+        if ha is not None and hb is not None:
+            return False
+        return a == b
+
+    def stats(self) -> typing.Dict[str, int]:
+        return {"unique": len(self._table), "lookups": self.lookups, "hits": self.hits}
+
+
+def _construct(cls: type, args: typing.Sequence):
+    if cls is Expr:
+        edesc, annotation = args
+        return Expr(edesc, *annotation)
+    return cls(*args)
@@ -0,0 +1,131 @@
+"""
+Query index over a decoded program.
+
+One pass over a Prog records every expression under its kind (the wire tag
+of its edesc, e.g. "EFuture"), and the expressions that name something under
+that name as well:
+
+    var   EVar, by its identifier ("M.x" for a module path)
+    let   ELet, by the name it binds
+    func  EFunc, by the function's name
+
+Each entry is an :class:`pygml.ast.ExprSite`: the expression, the index of
+its Decl, and the way down to it from that Decl.  Sites are kept per Decl,
+so replacing a Decl reindexes only that Decl.
+"""
+import typing
+
+from . import _schema
+from ._traverse import _DECL_EXPRS, ExprSite, _walk_sites
+from ._types import *
+
+
+INDEX_CATEGORIES = ("kind", "var", "let", "func")
+
+_TAGS = {cls: _schema.tag_of(cls) for cls in _schema.variants(ExprDesc)}
+
+
+def _longid_name(x: LongId) -> str:
+    parts = []
+    while type(x) is ModId:
+        parts.append(x.module)
+        x = x.rest
+    parts.append(x.name)
+    return ".".join(parts)
+
+
+class ProgIndex:
+    """Index of the expressions in ``prog`` by kind and by name.
+
+    The index goes stale when a Decl is changed in place; :meth:`replace`
+    reindexes one.
+    """
+
+    def __init__(self, prog: Prog) -> None:
+        self.prog = prog
+        # category -> key -> Decl index -> sites in walk order
+        self._tables: typing.Dict[str, typing.Dict[str, typing.Dict[int, typing.List[ExprSite]]]] = {
+            category: {} for category in INDEX_CATEGORIES
+        }
+        # Decl index -> the (category, key) pairs it has sites under
+        self._keys: typing.List[typing.Set[typing.Tuple[str, str]]] = []
+        for i, decl in enumerate(prog):
+            self._keys.append(set())
+            self._add(i, decl)
+
+    def _add(self, i: int, decl: Decl) -> None:
+        kinds, var, let, func = (self._tables[c] for c in INDEX_CATEGORIES)
+        keys = self._keys[i]
+        roots = [
+            ExprSite(getattr(decl.ddesc, name), i, None, ("ddesc", name))
+            for name in _DECL_EXPRS[type(decl.ddesc)]
+        ]
+        for site in _walk_sites(roots, "pre"):
+            d = site.expr.edesc
+            cls = type(d)
+            entries = [(kinds, "kind", _TAGS[cls])]
+            if cls is EVar:
+                entries.append((var, "var", _longid_name(d.id)))
+            elif cls is ELet:
+                entries.append((let, "let", d.name))
+            elif cls is EFunc:
+                entries.append((func, "func", d.name))
+            for table, category, key in entries:
+                by_decl = table.get(key)
+                if by_decl is None:
+                    by_decl = table[key] = {}
+                sites = by_decl.get(i)
+                if sites is None:
+                    sites = by_decl[i] = []
+                    keys.add((category, key))
+                sites.append(site)
+
+    def _remove(self, i: int) -> None:
+        for category, key in self._keys[i]:
+            table = self._tables[category]
+            del table[key][i]
+            if not table[key]:
+                del table[key]
+        self._keys[i] = set()
+
+    def replace(self, i: int, decl: typing.Optional[Decl] = None) -> None:
+        """Put ``decl`` in place of Decl ``i`` and reindex it; without
+        ``decl``, reindex Decl ``i`` as it is now."""
+        if decl is not None:
+            self.prog[i] = decl
+        self._remove(i)
+        self._add(i, self.prog[i])
+
+    def append(self, decl: Decl) -> None:
+        self.prog.append(decl)
+        self._keys.append(set())
+        self._add(len(self.prog) - 1, decl)
+
+    def find(self, category: str, key: str) -> typing.List[ExprSite]:
+        """The sites under ``key`` in ``category``, in program order."""
+        by_decl = self._tables[category].get(key)
+        if not by_decl:
+            return []
+        return [site for i in sorted(by_decl) for site in by_decl[i]]
+
+    def kind(self, tag: str) -> typing.List[ExprSite]:
+        """Expressions whose edesc has the wire tag ``tag``, e.g. "EForce"."""
+        return self.find("kind", tag)
+
+    def uses(self, name: str) -> typing.List[ExprSite]:
+        """EVar expressions naming ``name``."""
+        return self.find("var", name)
+
+    def lets(self, name: str) -> typing.List[ExprSite]:
+        """ELet expressions binding ``name``."""
+        return self.find("let", name)
+
+    def functions(self, name: str) -> typing.List[ExprSite]:
+        """EFunc expressions of the function ``name``."""
+        return self.find("func", name)
+
+    def keys(self, category: str) -> typing.List[str]:
+        return sorted(self._tables[category])
+
+    def count(self, category: str, key: str) -> int:
+        return sum(len(sites) for sites in self._tables[category].get(key, {}).values())
@@ -0,0 +1,396 @@
+"""
+Streaming JSON text of declarations.
+
+:func:`iter_decl_json` hands out the JSON text of a Decl piece by piece as it
+walks the Decl, without first building the dicts and lists that
+:func:`encode_decl` returns.  The text is byte for byte what a JSON library
+writes for the encoded Decl, whitespace and escaping included.  The walk
+keeps an explicit stack, so Decls of any depth are fine, even where the
+library itself would hit the recursion limit.
+
+The library is described by a *style*, for which a pygml.jsonio.Backend
+will do.  A style is anything with these attributes, saying how its
+``dumps`` formats a document:
+
+    separator     what goes between the items of a list, e.g. ", "
+    colon         what goes between a key and its value, e.g. ": "
+    ensure_ascii  whether characters outside ASCII are escaped
+    max_depth     the deepest nesting of lists and dicts it writes, or None
+    dumps         value -> bytes, for values the schema leaves open
+    errors        what dumps raises for a value it cannot write
+
+Like the codec, the text comes from per-class functions generated from
+_schema, one set per style.  Strings, small ints and None are written
+directly.  Other values the schema leaves open, such as annotations, go
+through ``dumps``.
+
+A Decl the style cannot write raises :class:`JsonStyleError`.  That
+happens when the Decl nests deeper than ``max_depth``, or holds a value
+``dumps`` rejects.  Some pieces may have been handed out by then, so a
+caller that falls back to another style should collect a Decl's pieces
+before writing them.
+"""
+import dataclasses
+import enum
+import json.encoder
+import typing
+
+from . import _gencache, _schema
+from ._codec import _UNIONS, LazyExpr, _optional_arg, _Source
+from ._types import *
+from ._types import _NO_ANNOTATION
+
+
+class JsonStyleError(ValueError):
+    """The style cannot write a Decl the way its ``dumps`` would."""
+
+
+# Pieces gathered before they are joined and handed out as one.
+_CHUNK_PIECES = 4096
+
+# ints below this in magnitude are written directly by every style; larger
+# ones go through dumps, which may not take them
+_INT_BOUND = 1 << 63
+
+
+def _nesting(value) -> int:
+    """How many lists and dicts deep ``value`` goes."""
+    deepest = 0
+    todo = [(value, 1)]
+    while todo:
+        v, depth = todo.pop()
+        if isinstance(v, dict):
+            v = v.values()
+        elif not isinstance(v, (list, tuple)):
+            continue
+        deepest = max(deepest, depth)
+        todo.extend((x, depth + 1) for x in v)
+    return deepest
+
+
+"""
+CODE GENERATION
+"""
+
+# Levels are counted down from a node's dict (or a Decl's): its desc list is
+# one level down, and a list among the desc's fields two.  The generated
+# function of a node gets the depth of its dict; its children's dicts go on
+# the stack with theirs.
+
+class _Lit(str):
+    """A constant piece of the generated text, as opposed to Python code."""
+
+
+class _Gen:
+    """Source of the writer functions for one style."""
+
+    def __init__(self, style) -> None:
+        self.src = _Source()
+        self.sep = style.separator
+        self.colon = style.colon
+        self.ascii = style.ensure_ascii
+        self.max_depth = style.max_depth
+
+    @staticmethod
+    def join(parts: typing.List[str]) -> str:
+        """Python expression concatenating ``parts``."""
+        merged: typing.List[str] = []
+        for p in parts:
+            if isinstance(p, _Lit) and merged and isinstance(merged[-1], _Lit):
+                merged[-1] = _Lit(merged[-1] + p)
+            else:
+                merged.append(p)
+        return " + ".join(repr(str(p)) if isinstance(p, _Lit) else p for p in merged) or "''"
+
+    def string(self, x: str, level: int) -> str:
+        check = "" if self.ascii else f" and {x}.isascii()"
+        return f"(_string({x}) if type({x}) is str{check} else _value({x}, depth + {level}))"
+
+    def integer(self, x: str, level: int) -> str:
+        return (f"(_int({x}) if type({x}) is int and -_INT_BOUND < {x} < _INT_BOUND "
+                f"else _value({x}, depth + {level}))")
+
+    def variant(self, cls: type, x: str, level: int) -> typing.Tuple[typing.List[str], int]:
+        parts: typing.List[str] = [_Lit(f'["{_schema.tag_of(cls)}"')]
+        deepest = level
+        for f in _schema.fields_of(cls):
+            field, d = self.text(f.hint, f"{x}.{f.name}", level + 1)
+            parts += [_Lit(self.sep), *field]
+            deepest = max(deepest, d)
+        parts.append(_Lit("]"))
+        return parts, deepest
+
+    def text(self, hint, x: str, level: int) -> typing.Tuple[typing.List[str], int]:
+        """Pieces of the text of the value ``x`` of type ``hint``, whose own
+        list, if it is one, is ``level`` below the node; and the deepest
+        level its fixed layout reaches.  Values laid out at run time check
+        their own depth."""
+        if isinstance(hint, type) and issubclass(hint, enum.Enum):
+            return [_Lit("["), self.string(x, level + 1), _Lit("]")], level
+        if hint in _UNIONS:
+            # the first variant, by far the most common, is written inline
+            first = _schema.variants(hint)[0]
+            parts, deepest = self.variant(first, x, level)
+            general = f"_{_UNIONS[hint]}_text({x}, depth + {level})"
+            return [f"({self.join(parts)} if type({x}) is {first.__name__} else {general})"], deepest
+        inner = _optional_arg(hint)
+        if inner is not None:
+            parts, deepest = self.text(inner, x, level)
+            return [f"('null' if {x} is None else {self.join(parts)})"], deepest
+        origin = typing.get_origin(hint)
+        if origin is list:
+            v = self.src.fresh("v")
+            parts, deepest = self.text(typing.get_args(hint)[0], v, level + 1)
+            each = f"{self.sep!r}.join([{self.join(parts)} for {v} in {x}])"
+            return [_Lit("["), each, _Lit("]")], max(level, deepest)
+        if origin is tuple:
+            parts = [_Lit("[")]
+            deepest = level
+            for i, h in enumerate(typing.get_args(hint)):
+                item, d = self.text(h, f"{x}[{i}]", level + 1)
+                parts += [_Lit(self.sep)] * (i > 0) + item
+                deepest = max(deepest, d)
+            parts.append(_Lit("]"))
+            return parts, deepest
+        if dataclasses.is_dataclass(hint):
+            raise TypeError("variant outside a union", hint)
+        if hint is str:
+            return [self.string(x, level)], level - 1
+        if hint is int:
+            return [self.integer(x, level)], level - 1
+        return [f"_value({x}, depth + {level})"], level - 1
+
+    def check(self, deepest: int) -> None:
+        if self.max_depth is not None:
+            self.src.add(1, f"if depth > {self.max_depth - deepest}:")
+            self.src.add(2, "raise JsonStyleError('nested too deeply')")
+
+    def gen_variant(self, cls: type) -> None:
+        """Text of a variant without expression fields, e.g. Id or Num,
+        given the depth of its own list."""
+        parts, deepest = self.variant(cls, "x", 0)
+        self.src.add(0, f"def _text_{cls.__name__}(x, depth):")
+        self.check(deepest)
+        self.src.add(1, f"return {self.join(parts)}")
+
+    def gen_union(self, union) -> None:
+        self.src.add(0, f"def _{_UNIONS[union]}_text(x, depth):")
+        self.src.add(1, "text = _TEXT.get(type(x))")
+        self.src.add(1, "if text is None:")
+        self.src.add(2, "raise TypeError(x)")
+        self.src.add(1, "return text(x, depth)")
+
+    def gen_node(self, cls: type, key: str) -> None:
+        """_write_X for the ExprDesc or DeclDesc class X: push the pieces of
+        its dict after the first onto the stack, last first, ending with
+        ``tail``, the text of the dict after its desc under ``key``; and
+        return the first."""
+        # the dict as a run of text pieces and expression slots
+        seq: typing.List[typing.Union[typing.List[str], typing.Tuple[str, str, int]]] = []
+
+        def put(*parts: str) -> None:
+            if seq and isinstance(seq[-1], list):
+                seq[-1].extend(parts)
+            else:
+                seq.append(list(parts))
+
+        # a match case is a list of its items, with the expression left out
+        hints = typing.get_args(MatchCase)
+        k = hints.index(Expr)
+        before: typing.List[str] = []
+        after: typing.List[str] = []
+        case_deepest = 3
+        for i, h in enumerate(hints):
+            if i != k:
+                item, d = self.text(h, f"c[{i}]", 4)
+                if i < k:
+                    before += item + [_Lit(self.sep)]
+                else:
+                    after += [_Lit(self.sep)] + item
+                case_deepest = max(case_deepest, d)
+        after.append(_Lit("]"))
+
+        deepest = 1
+        put(_Lit(f'{{"{key}"{self.colon}["{_schema.tag_of(cls)}"'))
+        for f in _schema.fields_of(cls):
+            x = f"d.{f.name}"
+            put(_Lit(self.sep))
+            if f.kind in (_schema.EXPR, _schema.OPT_EXPR):
+                seq.append((f.kind, x, 2))
+            elif f.kind == _schema.EXPRS:
+                put(_Lit("["))
+                seq.append((f.kind, x, 3))
+                put(_Lit("]"))
+                deepest = max(deepest, 2)
+            elif f.kind == _schema.CASES:
+                put(_Lit("["))
+                seq.append((f.kind, x, 2))
+                put(_Lit("]"))
+                deepest = max(deepest, case_deepest)
+            else:
+                parts, d = self.text(f.hint, x, 2)
+                put(*parts)
+                deepest = max(deepest, d)
+        put(_Lit("]"))
+
+        src = self.src
+        src.add(0, f"def _write_{cls.__name__}(d, stack, depth, tail):")
+        self.check(deepest)
+        if len(seq) == 1:
+            src.add(1, f"return {self.join(seq[0] + ['tail'])}")
+            return
+        src.add(1, "push = stack.append")
+        src.add(1, f"push({self.join(seq[-1] + ['tail'])})")
+        for piece in reversed(seq[1:-1]):
+            if isinstance(piece, list):
+                src.add(1, f"push({self.join(piece)})")
+                continue
+            kind, x, level = piece
+            if kind == _schema.EXPR:
+                src.add(1, f"push(({x}, depth + {level}))")
+            elif kind == _schema.OPT_EXPR:
+                src.add(1, f"push('null' if {x} is None else ({x}, depth + {level}))")
+            elif kind == _schema.EXPRS:
+                src.add(1, f"xs = {x}")
+                src.add(1, "for j in range(len(xs) - 1, 0, -1):")
+                src.add(2, f"push((xs[j], depth + {level}))")
+                src.add(2, f"push({self.sep!r})")
+                src.add(1, "if xs:")
+                src.add(2, f"push((xs[0], depth + {level}))")
+            elif kind == _schema.CASES:
+                # each case is a list one level below the list of cases
+                src.add(1, f"xs = {x}")
+                src.add(1, "for j in range(len(xs) - 1, -1, -1):")
+                src.add(2, "c = xs[j]")
+                src.add(2, f"push({self.join(after)})")
+                src.add(2, f"push((c[{k}], depth + {level + 2}))")
+                src.add(2, f"push(({self.sep + '['!r} if j else '[') + {self.join(before)})")
+        src.add(1, f"return {self.join(seq[0])}")
+
+
+def _generate(style) -> str:
+    gen = _Gen(style)
+    for union in _UNIONS:
+        for cls in _schema.variants(union):
+            gen.gen_variant(cls)
+        gen.gen_union(union)
+    for cls in _schema.variants(ExprDesc):
+        gen.gen_node(cls, "edesc")
+    for cls in _schema.variants(DeclDesc):
+        gen.gen_node(cls, "ddesc")
+    return "\n".join(gen.src.lines) + "\n"
+
+
+"""
+WRITERS
+"""
+
+class _Writer:
+    """The generated functions for one style."""
+
+    def __init__(self, style) -> None:
+        self.separator = style.separator
+        self.colon = style.colon
+        string = json.encoder.encode_basestring_ascii if style.ensure_ascii else json.encoder.encode_basestring
+        ensure_ascii, max_depth = style.ensure_ascii, style.max_depth
+        dumps, errors = style.dumps, tuple(style.errors)
+
+        def value(v, depth: int) -> str:
+            """Text of a value the schema leaves open, whose own list or
+            dict, if it is one, would be at ``depth``."""
+            if v is None:
+                return "null"
+            if v is True:
+                return "true"
+            if v is False:
+                return "false"
+            t = type(v)
+            if t is str and (ensure_ascii or v.isascii()):
+                return string(v)
+            if t is int and -_INT_BOUND < v < _INT_BOUND:
+                return int.__repr__(v)
+            if max_depth is not None and depth - 1 + _nesting(v) > max_depth:
+                raise JsonStyleError("nested too deeply")
+            try:
+                return dumps(v).decode()
+            except errors as e:
+                raise JsonStyleError(str(e)) from e
+
+        namespace = dict(globals())
+        namespace.update(_string=string, _int=int.__repr__, _value=value)
+        layout = repr((style.separator, style.colon, style.ensure_ascii, style.max_depth))
+        exec(_gencache.generated_code("_jsonwriter.py", "writer", lambda: _generate(style),
+                                      "<pygml.ast generated JSON writer>", layout), namespace)
+        namespace["_TEXT"] = {
+            cls: namespace[f"_text_{cls.__name__}"] for union in _UNIONS for cls in _schema.variants(union)
+        }
+        self.value = value
+        self.exprs = {cls: namespace[f"_write_{cls.__name__}"] for cls in _schema.variants(ExprDesc)}
+        self.decls = {cls: namespace[f"_write_{cls.__name__}"] for cls in _schema.variants(DeclDesc)}
+
+    def iter_decl(self, decl: Decl) -> typing.Iterator[str]:
+        sep, colon, value, exprs = self.separator, self.colon, self.value, self.exprs
+        edesc = '{"edesc"' + colon
+        eloc, etyp, egr = (f'{sep}"{key}"{colon}' for key in ("eloc", "etyp", "egr"))
+        unannotated = f"{eloc}null{etyp}null{egr}null}}"
+
+        desc = decl.ddesc
+        write = self.decls.get(type(desc))
+        if write is None:
+            raise TypeError("unhandled decl", desc)
+        # a Decl's dict is at depth 1, its fields' values at 2
+        stack: list = []
+        tail = f'{sep}"dloc"{colon}{value(decl.dloc, 2)}{sep}"dinfo"{colon}{value(decl.dinfo, 2)}}}'
+        buf = [write(desc, stack, 1, tail)]
+        pop, put = stack.pop, buf.append
+        while stack:
+            item = pop()
+            if item.__class__ is str:
+                put(item)
+                continue
+            e, depth = item
+            annotation = e._annotation
+            if annotation is _NO_ANNOTATION:
+                tail = unannotated
+            else:
+                tail = (eloc + value(annotation[0], depth + 1) + etyp + value(annotation[1], depth + 1)
+                        + egr + value(annotation[2], depth + 1) + "}")
+            if e.__class__ is LazyExpr and e._data is not None:
+                # never decoded, so the JSON it came from is still current
+                put(edesc + value(e._data["edesc"], depth + 1) + tail)
+                continue
+            d = e.edesc
+            write = exprs.get(d.__class__)
+            if write is None:
+                raise TypeError("unhandled expr", d)
+            put(write(d, stack, depth, tail))
+            if len(buf) > _CHUNK_PIECES:
+                yield "".join(buf)
+                buf.clear()
+        yield "".join(buf)
+
+
+_WRITERS: typing.Dict[tuple, _Writer] = {}
+
+
+def _writer(style) -> _Writer:
+    key = (style.separator, style.colon, style.ensure_ascii, style.max_depth, style.dumps,
+           tuple(style.errors))
+    writer = _WRITERS.get(key)
+    if writer is None:
+        writer = _WRITERS[key] = _Writer(style)
+    return writer
+
+
+def iter_decl_json(decl: Decl, style) -> typing.Iterator[str]:
+    """The JSON text of ``decl`` that ``style.dumps(encode_decl(decl))``
+    gives, in pieces of a few tens of kilobytes, made as they are asked for.
+
+    Raises :class:`JsonStyleError` partway if ``style`` cannot write it.
+    """
+    return _writer(style).iter_decl(decl)
+
+
+def decl_json(decl: Decl, style) -> str:
+    """:func:`iter_decl_json` in one piece."""
+    return "".join(_writer(style).iter_decl(decl))
@@ -0,0 +1,138 @@
+"""
+Per-node-kind profiling of the converter and the expression codec.
+
+The converter and codec work off explicit stacks.  While a profile is active
+(see :func:`profiling`) those stacks are :class:`_Stack` instances, which time
+every item as it is popped; otherwise they are plain lists and nothing is
+measured.  For each label (a clang node kind in "convert", an expression tag
+in "encode_expr" and "decode_expr") a profile counts:
+
+    nodes   nodes of that label processed
+    calls   stack items processed: the nodes plus their build steps
+    self    seconds spent on those items themselves
+    total   seconds from taking a node until its whole subtree is done,
+            counting nested nodes of the same label once
+"""
+import contextlib
+import time
+import typing
+
+
+_NODES, _CALLS, _TOTAL, _SELF = range(4)
+
+# Columns a report can be sorted by.
+PROFILE_SORT_KEYS = {"self": _SELF, "total": _TOTAL, "calls": _CALLS, "nodes": _NODES}
+
+
+class Profile:
+    def __init__(self) -> None:
+        # section -> label -> [nodes, calls, total, self]
+        self.sections: typing.Dict[str, typing.Dict[str, typing.List]] = {}
+
+    def stack(self, section: str, items: list, label: typing.Callable) -> "_Stack":
+        """A work stack holding ``items`` that records into ``section``.
+
+        ``label(item)`` returns the item's label and whether it is a node.
+        """
+        return _Stack(items, self.sections.setdefault(section, {}), label)
+
+    def report(self) -> typing.Dict[str, typing.Dict[str, dict]]:
+        return {
+            section: {
+                label: {"nodes": s[_NODES], "calls": s[_CALLS],
+                        "total": s[_TOTAL], "self": s[_SELF]}
+                for label, s in stats.items()
+            }
+            for section, stats in self.sections.items()
+        }
+
+    def format(self, sort: str = "self") -> str:
+        """The report as text, each section sorted by ``sort`` descending."""
+        column = PROFILE_SORT_KEYS[sort]
+        lines = []
+        for section, stats in self.sections.items():
+            nodes = sum(s[_NODES] for s in stats.values())
+            seconds = sum(s[_SELF] for s in stats.values())
+            lines.append(f"{section}: {nodes} nodes, {seconds * 1e3:.3f} ms")
+            lines.append(f"  {'label':<24} {'nodes':>9} {'calls':>9} "
+                         f"{'total ms':>11} {'self ms':>11} {'self %':>7}")
+            for label, s in sorted(stats.items(), key=lambda kv: kv[1][column], reverse=True):
+                share = s[_SELF] / seconds * 100 if seconds else 0.0
+                lines.append(f"  {label:<24} {s[_NODES]:>9} {s[_CALLS]:>9} "
+                             f"{s[_TOTAL] * 1e3:>11.3f} {s[_SELF] * 1e3:>11.3f} {share:>6.1f}%")
+            lines.append("")
+        return "\n".join(lines)
+
+
+class _Stack(list):
+    """A work stack that times its items.
+
+    An item's self time runs from its pop to the next pop (or until the stack
+    is found empty).  A node's subtree is everything pushed above the place
+    it was popped from, so it is done once the stack shrinks below that.
+    """
+    __slots__ = ("_stats", "_label", "_frames", "_open", "_current", "_start")
+
+    def __init__(self, items: list, stats: dict, label: typing.Callable) -> None:
+        super().__init__(items)
+        self._stats = stats
+        self._label = label
+        # open nodes: [stack length below them, start, label]
+        self._frames: typing.List[list] = []
+        # label -> number of its nodes in _frames
+        self._open: typing.Dict[str, int] = {}
+        self._current: typing.Optional[list] = None
+        self._start = 0.0
+
+    def _stop(self, now: float, size: int) -> None:
+        if self._current is not None:
+            self._current[_SELF] += now - self._start
+            self._current = None
+        frames = self._frames
+        while frames and frames[-1][0] >= size:
+            _, start, label = frames.pop()
+            self._open[label] -= 1
+            if not self._open[label]:
+                self._stats[label][_TOTAL] += now - start
+
+    def pop(self, *args):
+        now = time.perf_counter()
+        self._stop(now, list.__len__(self))
+        item = list.pop(self, *args)
+        label, is_node = self._label(item)
+        stats = self._stats.get(label)
+        if stats is None:
+            stats = self._stats[label] = [0, 0, 0.0, 0.0]
+        stats[_CALLS] += 1
+        if is_node:
+            stats[_NODES] += 1
+            self._frames.append([list.__len__(self), now, label])
+            self._open[label] = self._open.get(label, 0) + 1
+        self._current = stats
+        self._start = time.perf_counter()
+        return item
+
+    def __len__(self) -> int:
+        size = list.__len__(self)
+        if not size:
+            self._stop(time.perf_counter(), 0)
+        return size
+
+
+_active: typing.Optional[Profile] = None
+
+
+def active_profile() -> typing.Optional[Profile]:
+    return _active
+
+
+@contextlib.contextmanager
+def profiling(profile: typing.Optional[Profile] = None):
+    """Profile conversions and codec calls made inside the ``with`` block."""
+    global _active
+    previous = _active
+    _active = profile if profile is not None else Profile()
+    try:
+        yield _active
+    finally:
+        _active = previous
@@ -0,0 +1,64 @@
+"""
+Field layout of the node classes, read off their annotations in _types.
+
+Each variant class is described by its wire tag and its fields in order.  A
+field is either an expression slot (which the codecs fill iteratively) or a
+plain value whose annotation decides how it is encoded.
+"""
+import dataclasses
+import typing
+
+from . import _types
+from ._types import *
+
+
+# Field kinds.
+EXPR = "expr"            # Expr
+OPT_EXPR = "opt_expr"    # typing.Optional[Expr]
+EXPRS = "exprs"          # typing.List[Expr]
+CASES = "cases"          # typing.List[MatchCase]
+VALUE = "value"          # anything else; must not contain expressions
+
+# Classes whose name differs from the OCaml constructor.
+_TAGS = {ModId: "Modid"}
+
+
+class Field(typing.NamedTuple):
+    name: str
+    hint: object
+    kind: str
+
+
+def tag_of(cls: type) -> str:
+    return _TAGS.get(cls, cls.__name__)
+
+
+def _contains_expr(hint) -> bool:
+    return hint is Expr or any(_contains_expr(a) for a in typing.get_args(hint))
+
+
+def _kind(hint) -> str:
+    if hint is Expr:
+        return EXPR
+    if hint == typing.Optional[Expr]:
+        return OPT_EXPR
+    if hint == typing.List[Expr]:
+        return EXPRS
+    if hint == typing.List[MatchCase]:
+        return CASES
+    if _contains_expr(hint):
+        raise TypeError("unsupported expression field", hint)
+    return VALUE
+
+
+def fields_of(cls: type) -> typing.Tuple[Field, ...]:
+    hints = typing.get_type_hints(cls, vars(_types))
+    return tuple(
+        Field(f.name, hints[f.name], _kind(hints[f.name]))
+        for f in dataclasses.fields(cls)
+    )
+
+
+def variants(union) -> typing.Tuple[type, ...]:
+    return typing.get_args(union)
+
@@ -0,0 +1,337 @@
+"""
+Incremental reader for clang -ast-dump=json output.
+
+The dump for a file that includes system headers is mostly declarations the
+converter never looks at.  Rather than decoding the whole document, the text is
+tokenized chunk by chunk into SAX-style events and only the FunctionDecl
+subtrees are built; everything else is discarded as soon as it is read.
+
+With pruning (the default), even those subtrees are trimmed while they are
+read: functions located in included files are skipped, and only the keys and
+node kinds the converter looks at are kept.
+"""
+import json
+import re
+import typing
+
+
+CHUNK_SIZE = 1 << 20
+
+# Kinds whose "inner" list is searched for function declarations.
+CONTAINER_KINDS = frozenset((
+    "TranslationUnitDecl",
+    "LinkageSpecDecl",
+))
+
+_STRING = r'"[^"\\]*+(?:\\.[^"\\]*+)*+"'
+
+_TOKEN = re.compile(r"""
+    %s                              # complete string
+  | [{}\[\]]                        # structure
+  | -?[0-9][0-9.eE+-]*              # number
+  | true | false | null
+  | "                               # string running past the buffer
+""" % _STRING, re.VERBOSE)
+
+# Everything up to the next bracket that is not inside a string.
+_SKIP = re.compile(r"(?:[^\"{}\[\]]++|%s)*+" % _STRING)
+
+# A chunk is only tokenized up to the last of these, so that a number or
+# literal is never split across two reads.
+_SAFE_CUT = ",]}\n"
+
+# Keys of a clang node that pygml.ast._conv reads.  With pruning, the values
+# of all other keys ("id", "loc", "range", "type", ...) are skipped unread.
+KEPT_KEYS = frozenset((
+    "kind",
+    "inner",
+    "name",
+    "referencedDecl",
+    "opcode",
+    "value",
+    "hasElse",
+))
+
+_LITERALS = {"true": True, "false": False, "null": None}
+
+# Sent into iter_events() to discard the rest of the innermost open container.
+SKIP = object()
+
+_ARRAY = object()
+
+
+"""
+EVENTS
+"""
+
+def _scalar(tok: str):
+    if tok in _LITERALS:
+        return _LITERALS[tok]
+    try:
+        return int(tok)
+    except ValueError:
+        return float(tok)
+
+
+def _string(tok: str) -> str:
+    if "\\" in tok:
+        return json.loads(tok)
+    return tok[1:-1]
+
+
+def iter_events(fp: typing.TextIO, chunk_size: int = CHUNK_SIZE):
+    """Yield ``(event, value)`` pairs for the JSON text read from ``fp``.
+
+    Events are ``start_map``, ``end_map``, ``start_array``, ``end_array``,
+    ``map_key`` and ``value``.  Several concatenated documents are read as one
+    stream of events.  Sending :data:`SKIP` discards the rest of the innermost
+    open container without tokenizing it; the reply is that container's end
+    event.
+    """
+    in_map = [False]
+    expect_key = False
+    skipping = 0
+    buf = ""
+    eof = False
+    while not eof:
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+        end = len(buf)
+        if not eof:
+            end = max(buf.rfind(c) for c in _SAFE_CUT) + 1
+            if end == 0:
+                continue
+        pos = 0
+        while pos < end:
+            if skipping:
+                pos = _SKIP.match(buf, pos, end).end()
+                if pos == end or buf[pos] == '"':
+                    break
+                if buf[pos] in "{[":
+                    skipping += 1
+                    pos += 1
+                    continue
+                skipping -= 1
+                pos += 1
+                if skipping:
+                    continue
+                in_map.pop()
+                expect_key = in_map[-1]
+                event = "end_map" if buf[pos - 1] == "}" else "end_array"
+                if (yield event, None) is SKIP:
+                    skipping = 1
+                continue
+            for m in _TOKEN.finditer(buf, pos, end):
+                tok = m.group()
+                c = tok[0]
+                if c == '"':
+                    if len(tok) == 1:
+                        break
+                    if expect_key:
+                        expect_key = False
+                        ev = "map_key", _string(tok)
+                    else:
+                        expect_key = in_map[-1]
+                        ev = "value", _string(tok)
+                elif c == "{":
+                    in_map.append(True)
+                    expect_key = True
+                    ev = "start_map", None
+                elif c == "}":
+                    in_map.pop()
+                    expect_key = in_map[-1]
+                    ev = "end_map", None
+                elif c == "[":
+                    in_map.append(False)
+                    expect_key = False
+                    ev = "start_array", None
+                elif c == "]":
+                    in_map.pop()
+                    expect_key = in_map[-1]
+                    ev = "end_array", None
+                else:
+                    expect_key = in_map[-1]
+                    ev = "value", _scalar(tok)
+                if (yield ev) is SKIP:
+                    skipping = 1
+                    pos = m.end()
+                    break
+            else:
+                pos = end
+                continue
+            if not skipping:
+                pos = m.start()
+                break
+        buf = buf[pos:]
+    if buf.strip() or skipping:
+        raise ValueError("truncated JSON input", buf[:80])
+
+
+"""
+FUNCTION DECLARATIONS
+"""
+
+def _skip_value(events) -> None:
+    """Discard the value of the map key just read."""
+    if next(events)[0] != "value":
+        events.send(SKIP)
+
+
+def _pruned_kind(kind: str, parent_kind: typing.Optional[str]) -> bool:
+    """Whether a node of ``kind`` in the "inner" list of ``parent_kind`` is
+    one the converter drops anyway.
+
+    Only nodes whose removal does not shift a position the converter indexes
+    qualify: declarations in a block, and OpenMP clauses, which precede the
+    captured statement a directive is converted from.
+    """
+    if kind == "DeclStmt":
+        return parent_kind == "CompoundStmt"
+    return kind.startswith("OMP") and kind.endswith("Clause")
+
+
+def _build(events, node: dict, key: typing.Optional[str] = None, prune: bool = False) -> dict:
+    """Fill ``node`` from ``events`` up to the end of the current object.
+
+    ``key`` is a key of ``node`` that has already been read.  With ``prune``,
+    keys outside :data:`KEPT_KEYS` and nodes :func:`_pruned_kind` accepts are
+    left out.
+    """
+    stack: typing.List[typing.Any] = [node]
+    keys: typing.List[typing.Any] = [key]
+    if prune and key is not None and key not in KEPT_KEYS:
+        _skip_value(events)
+    for event, value in events:
+        top = stack[-1]
+        if event == "map_key":
+            if prune and value not in KEPT_KEYS:
+                _skip_value(events)
+            else:
+                keys[-1] = value
+            continue
+        if event == "end_map" or event == "end_array":
+            stack.pop()
+            keys.pop()
+            if not stack:
+                return node
+            continue
+        if event == "start_map":
+            value = {}
+        elif event == "start_array":
+            value = []
+        if type(top) is dict:
+            key = keys[-1]
+            if (prune and key == "kind" and len(stack) > 2 and type(stack[-2]) is list
+                    and _pruned_kind(value, stack[-3].get("kind"))):
+                stack.pop()
+                keys.pop()
+                stack[-1].pop()
+                events.send(SKIP)
+                continue
+            top[key] = value
+        else:
+            top.append(value)
+        if event == "start_map" or event == "start_array":
+            stack.append(value)
+            keys.append(None)
+    raise ValueError("truncated JSON input")
+
+
+def _has_body(decl: dict) -> bool:
+    return any(node.get("kind") == "CompoundStmt" for node in decl.get("inner", ()))
+
+
+def _is_included(loc: dict) -> bool:
+    """Whether the clang source location ``loc`` lies in an included file.
+
+    Clang repeats "includedFrom" on every location in an included file, even
+    where it leaves out a "file" equal to the previous one.  A location inside
+    a macro expansion counts where the macro was expanded.
+    """
+    return "includedFrom" in loc.get("expansionLoc", loc)
+
+
+def function_decls(node: dict) -> typing.Iterator[dict]:
+    """Yield every FunctionDecl with a body from an already decoded dump.
+
+    ``node`` is a FunctionDecl or a TranslationUnitDecl.  As in
+    :func:`iter_function_decls`, functions from included files are skipped.
+    """
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        kind = node.get("kind")
+        if kind == "FunctionDecl":
+            if _has_body(node) and not _is_included(node.get("loc", {})):
+                yield node
+        elif kind in CONTAINER_KINDS:
+            todo.extend(reversed(node.get("inner", ())))
+
+
+def iter_function_decls(fp: typing.TextIO, chunk_size: int = CHUNK_SIZE, prune: bool = True):
+    """Yield every FunctionDecl with a body from a clang JSON AST dump.
+
+    ``fp`` may hold a single FunctionDecl (as produced by -ast-dump-filter),
+    several of them back to back, or a whole TranslationUnitDecl.  Only the
+    yielded subtrees are ever materialized.  With ``prune``, functions from
+    included files are skipped and the yielded ones keep only what the
+    converter reads (see :func:`_build`).
+    """
+    events = iter_events(fp, chunk_size)
+    # one entry per enclosing container: the kind of an object (None until
+    # its "kind" key has been read) or _ARRAY
+    stack: typing.List[typing.Any] = []
+    pending: typing.Dict[str, typing.Any] = {}
+    for event, value in events:
+        if event == "start_map":
+            stack.append(None)
+            pending = {}
+        elif event == "start_array":
+            stack.append(_ARRAY)
+        elif event == "end_map" or event == "end_array":
+            stack.pop()
+        elif event == "map_key":
+            kind = stack[-1]
+            if kind is None and value == "kind":
+                _, kind = next(events)
+                if kind == "FunctionDecl":
+                    if prune:
+                        pending = {}
+                    pending["kind"] = kind
+                    # clang writes "loc" right after "kind"
+                    event, key = next(events)
+                    if event == "end_map":
+                        stack.pop()
+                        continue
+                    if key == "loc":
+                        next(events)
+                        loc = _build(events, {})
+                        if prune and _is_included(loc):
+                            events.send(SKIP)
+                            stack.pop()
+                            continue
+                        if not prune:
+                            pending["loc"] = loc
+                        key = None
+                    decl = _build(events, pending, key, prune)
+                    stack.pop()
+                    if _has_body(decl):
+                        yield decl
+                elif kind in CONTAINER_KINDS:
+                    stack[-1] = kind
+                else:
+                    events.send(SKIP)
+                    stack.pop()
+            elif kind is None:
+                # keys ahead of "kind" ("id") are kept for the built node
+                key = value
+                event, value = next(events)
+                if event == "value":
+                    pending[key] = value
+                else:
+                    events.send(SKIP)
+            elif value != "inner":
+                event, _ = next(events)
+                if event != "value":
+                    events.send(SKIP)
@@ -0,0 +1,331 @@
+"""
+Generic traversal of expression trees.
+
+The expression fields of every ExprDesc and DeclDesc class are read off their
+annotations once (see _schema), and per-class functions listing, locating
+and replacing a node's children are generated from them, so walking costs no
+dataclasses.fields call or isinstance chain per node.  Every walk works off
+an explicit stack, so trees of any depth are fine.
+
+A root is an Expr, a Decl or a whole Prog.  Children are visited in field
+order; the expression of a match case counts as a child of the match.
+"""
+import dataclasses
+import typing
+
+from . import _gencache, _schema
+from ._types import *
+
+
+# A step down from a node: an attribute name or a list or tuple index.
+PathStep = typing.Union[str, int]
+
+# Where the expression sits in a match case.
+_CASE_EXPR = typing.get_args(MatchCase).index(Expr)
+
+_CHILD_KINDS = (_schema.EXPR, _schema.OPT_EXPR, _schema.EXPRS, _schema.CASES)
+
+
+"""
+CODE GENERATION
+"""
+
+def _with_case_expr(case, expr: Expr):
+    items = list(case)
+    items[_CASE_EXPR] = expr
+    return type(case)(items)
+
+
+def _gen_class(lines: typing.List[str], cls: type) -> None:
+    """_children_X, _steps_X and _rebuild_X for the ExprDesc class X."""
+    name = cls.__name__
+    fields = _schema.fields_of(cls)
+    kinds = [f.kind for f in fields if f.kind in _CHILD_KINDS]
+
+    lines.append(f"def _children_{name}(d):")
+    if all(kind == _schema.EXPR for kind in kinds):
+        lines.append(f"    return ({''.join(f'd.{f.name}, ' for f in fields if f.kind == _schema.EXPR)})")
+    else:
+        lines.append("    c = []")
+        for f in fields:
+            x = f"d.{f.name}"
+            if f.kind == _schema.EXPR:
+                lines.append(f"    c.append({x})")
+            elif f.kind == _schema.OPT_EXPR:
+                lines.append(f"    if {x} is not None: c.append({x})")
+            elif f.kind == _schema.EXPRS:
+                lines.append(f"    c.extend({x})")
+            elif f.kind == _schema.CASES:
+                lines.append(f"    c.extend([case[{_CASE_EXPR}] for case in {x}])")
+        lines.append("    return c")
+
+    lines.append(f"def _steps_{name}(d):")
+    lines.append("    c = []")
+    for f in fields:
+        x, step = f"d.{f.name}", f"'edesc', {f.name!r}"
+        if f.kind == _schema.EXPR:
+            lines.append(f"    c.append((({step}), {x}))")
+        elif f.kind == _schema.OPT_EXPR:
+            lines.append(f"    if {x} is not None: c.append((({step}), {x}))")
+        elif f.kind == _schema.EXPRS:
+            lines.append(f"    c.extend([(({step}, j), e) for j, e in enumerate({x})])")
+        elif f.kind == _schema.CASES:
+            lines.append(f"    c.extend([(({step}, j, {_CASE_EXPR}), case[{_CASE_EXPR}]) "
+                         f"for j, case in enumerate({x})])")
+    lines.append("    return c")
+
+    args = []
+    for f in fields:
+        x = f"d.{f.name}"
+        if f.kind == _schema.EXPR:
+            args.append("nxt()")
+        elif f.kind == _schema.OPT_EXPR:
+            args.append(f"None if {x} is None else nxt()")
+        elif f.kind == _schema.EXPRS:
+            args.append(f"[nxt() for _ in {x}]")
+        elif f.kind == _schema.CASES:
+            args.append(f"[_with_case_expr(case, nxt()) for case in {x}]")
+        else:
+            args.append(x)
+    lines.append(f"def _rebuild_{name}(d, kids):")
+    lines.append("    nxt = iter(kids).__next__")
+    lines.append(f"    return {name}({', '.join(args)})")
+
+
+def _generate() -> str:
+    lines: typing.List[str] = []
+    for cls in _schema.variants(ExprDesc):
+        _gen_class(lines, cls)
+    return "\n".join(lines) + "\n"
+
+
+exec(_gencache.generated_code("_traverse.py", "traversal", _generate,
+                              "<pygml.ast generated traversal>"))
+
+
+def _table(prefix: str) -> typing.Dict[type, typing.Callable]:
+    return {cls: globals()[f"{prefix}{cls.__name__}"] for cls in _schema.variants(ExprDesc)}
+
+
+# ExprDesc class -> function of a node: its child expressions, the same
+# paired with the steps down to them, and a copy with other children.
+_CHILDREN = _table("_children_")
+_STEPS = _table("_steps_")
+_REBUILD = _table("_rebuild_")
+
+# DeclDesc class -> names of its expression fields.
+_DECL_EXPRS = {
+    cls: tuple(f.name for f in _schema.fields_of(cls) if f.kind == _schema.EXPR)
+    for cls in _schema.variants(DeclDesc)
+}
+
+
+def children(expr: Expr) -> typing.Sequence[Expr]:
+    """The expressions directly inside ``expr``, in field order."""
+    return _CHILDREN[type(expr.edesc)](expr.edesc)
+
+
+def _root_exprs(root) -> typing.List[Expr]:
+    if isinstance(root, Expr):
+        return [root]
+    if isinstance(root, Decl):
+        root = [root]
+    return [getattr(d.ddesc, name) for d in root for name in _DECL_EXPRS[type(d.ddesc)]]
+
+
+"""
+SITES
+"""
+
+class ExprSite:
+    """An expression reached by a walk.
+
+    ``step`` leads from the ``parent`` site's expression to this one.  A
+    root expression has no parent; if it was reached from a Decl, its step
+    leads from the Decl, and ``decl`` is the Decl's index in the Prog walked
+    (or 0 for a single Decl).
+    """
+    __slots__ = ("expr", "decl", "parent", "step")
+
+    def __init__(self, expr: Expr, decl: typing.Optional[int], parent: typing.Optional["ExprSite"],
+                 step: typing.Tuple[PathStep, ...]) -> None:
+        self.expr = expr
+        self.decl = decl
+        self.parent = parent
+        self.step = step
+
+    @property
+    def path(self) -> typing.Tuple[PathStep, ...]:
+        """Steps from the root (the Decl, if any) to the expression; see
+        :func:`resolve_path`."""
+        steps = []
+        site: typing.Optional[ExprSite] = self
+        while site is not None:
+            steps.append(site.step)
+            site = site.parent
+        return tuple(s for step in reversed(steps) for s in step)
+
+    @property
+    def depth(self) -> int:
+        n = 0
+        site = self.parent
+        while site is not None:
+            n += 1
+            site = site.parent
+        return n
+
+    def ancestors(self) -> typing.List[Expr]:
+        """The enclosing expressions, outermost first."""
+        exprs = []
+        site = self.parent
+        while site is not None:
+            exprs.append(site.expr)
+            site = site.parent
+        exprs.reverse()
+        return exprs
+
+    def __repr__(self) -> str:
+        return (f"ExprSite(decl={self.decl}, path={self.path!r}, "
+                f"kind={_schema.tag_of(type(self.expr.edesc))!r})")
+
+
+def resolve_path(node, path: typing.Iterable[PathStep]):
+    """Follow ``path`` down from ``node``."""
+    for step in path:
+        node = node[step] if type(step) is int else getattr(node, step)
+    return node
+
+
+def _root_sites(root) -> typing.List[ExprSite]:
+    if isinstance(root, Expr):
+        return [ExprSite(root, None, None, ())]
+    if isinstance(root, Decl):
+        root = [root]
+    return [
+        ExprSite(getattr(d.ddesc, name), i, None, ("ddesc", name))
+        for i, d in enumerate(root) for name in _DECL_EXPRS[type(d.ddesc)]
+    ]
+
+
+"""
+WALKS
+"""
+
+def iter_exprs(root, order: str = "pre") -> typing.Iterator[Expr]:
+    """Every expression under ``root``, parents before their children
+    ("pre") or after them ("post")."""
+    table = _CHILDREN
+    if order == "pre":
+        todo = _root_exprs(root)
+        todo.reverse()
+        while todo:
+            e = todo.pop()
+            yield e
+            d = e.edesc
+            todo.extend(reversed(table[type(d)](d)))
+        return
+    if order != "post":
+        raise ValueError("unknown order", order)
+    # (expression, whether its children have been pushed)
+    stack: typing.List[typing.Tuple[Expr, bool]] = [(e, False) for e in reversed(_root_exprs(root))]
+    while stack:
+        e, expanded = stack.pop()
+        if expanded:
+            yield e
+            continue
+        stack.append((e, True))
+        d = e.edesc
+        stack.extend([(c, False) for c in reversed(table[type(d)](d))])
+
+
+def iter_sites(root, order: str = "pre") -> typing.Iterator[ExprSite]:
+    """Like :func:`iter_exprs`, with the path to every expression."""
+    return _walk_sites(_root_sites(root), order)
+
+
+def _walk_sites(roots: typing.List[ExprSite], order: str) -> typing.Iterator[ExprSite]:
+    if order not in ("pre", "post"):
+        raise ValueError("unknown order", order)
+    steps = _STEPS
+    post = order == "post"
+    stack: typing.List[typing.Tuple[ExprSite, bool]] = [(s, False) for s in reversed(roots)]
+    while stack:
+        site, expanded = stack.pop()
+        if expanded:
+            yield site
+            continue
+        if post:
+            stack.append((site, True))
+        else:
+            yield site
+        d = site.expr.edesc
+        decl = site.decl
+        kids = steps[type(d)](d)
+        for step, e in reversed(kids):
+            stack.append((ExprSite(e, decl, site, step), False))
+
+
+def find_site(root, pred: typing.Callable[[Expr], bool]) -> typing.Optional[ExprSite]:
+    """The first expression under ``root``, in pre-order, for which ``pred``
+    holds; nothing past it is visited."""
+    for site in iter_sites(root):
+        if pred(site.expr):
+            return site
+    return None
+
+
+def find_expr(root, pred: typing.Callable[[Expr], bool]) -> typing.Optional[Expr]:
+    """Like :func:`find_site` without the path, which makes it cheaper."""
+    for e in iter_exprs(root):
+        if pred(e):
+            return e
+    return None
+
+
+"""
+REWRITING
+"""
+
+def rewrite_expr(expr: Expr, fn: typing.Callable[[Expr], Expr]) -> Expr:
+    """Rebuild ``expr`` bottom up, replacing every node by ``fn(node)``.
+
+    ``fn`` sees each node with its children already rewritten and returns
+    its replacement, or the node itself to keep it.  Nodes are copied only
+    where a child changed; the input tree is never modified.  A subtree
+    shared by several parents (as after hash-consing) is rewritten once.
+    """
+    table, rebuild = _CHILDREN, _REBUILD
+    done: typing.Dict[int, Expr] = {}
+    # (expression, its children once they have been pushed)
+    stack: typing.List[typing.Tuple[Expr, typing.Optional[typing.Sequence[Expr]]]] = [(expr, None)]
+    while stack:
+        e, kids = stack.pop()
+        if kids is None:
+            if id(e) in done:
+                continue
+            d = e.edesc
+            kids = table[type(d)](d)
+            stack.append((e, kids))
+            stack.extend([(c, None) for c in reversed(kids) if id(c) not in done])
+            continue
+        new = [done[id(c)] for c in kids]
+        node = e
+        if any(a is not b for a, b in zip(new, kids)):
+            node = Expr(rebuild[type(e.edesc)](e.edesc, new))
+            node._annotation = e._annotation
+        done[id(e)] = fn(node)
+    return done[id(expr)]
+
+
+def rewrite_decl(decl: Decl, fn: typing.Callable[[Expr], Expr]) -> Decl:
+    """:func:`rewrite_expr` over the expressions of ``decl``."""
+    desc = decl.ddesc
+    changed = {}
+    for name in _DECL_EXPRS[type(desc)]:
+        old = getattr(desc, name)
+        new = rewrite_expr(old, fn)
+        if new is not old:
+            changed[name] = new
+    if not changed:
+        return decl
+    return Decl(dataclasses.replace(desc, **changed), decl.dloc, decl.dinfo)
@@ -1,313 +1,391 @@
-from __future__ import annotations
-import dataclasses
-import enum
-import typing
-
-
-@dataclasses.dataclass
-class Unhandled:
-    kind: str
-    raw: object
-
-
-"""
-LONG IDENTIFIERS
-"""
-
-@dataclasses.dataclass
-class Id:
-    name: str
-
-
-@dataclasses.dataclass
-class ModId:
-    module: str
-    rest: LongId
-
-
-LongId = typing.Union[Id, ModId]
-
-
-"""
-CONSTANTS
-"""
-
-@dataclasses.dataclass
-class Num:
-    value: int
-
-
-@dataclasses.dataclass
-class String:
-    value: str
-
-
-@dataclasses.dataclass
-class Char:
-    value: str
-
-
-@dataclasses.dataclass
-class Bool:
-    value: bool
-
-
-@dataclasses.dataclass
-class Unit:
-    pass
-
-
-@dataclasses.dataclass
-class Futref:
-    value: object
-
-
-Const = typing.Union[Num, String, Char, Bool, Unit, Futref]
-
-
-"""
-INFIX OPERATORS
-"""
-
-class InfixOp(enum.StrEnum):
-    Plus = "Plus"
-    Minus = "Minus"
-    Times = "Times"
-    Div = "Div"
-    Lt = "Lt"
-    Le = "Le"
-    Gt = "Gt"
-    Ge = "Ge"
-    Eq = "Eq"
-    Ne = "Ne"
-    And = "And"
-    Or = "Or"
-    Concat = "Concat"
-
-
-"""
-EXPRESSION DESCRIPTION
-"""
-
-class IsRecursive(enum.StrEnum):
-    Recursive = "Recursive"
-    Terminal = "Terminal"
-
-
-@dataclasses.dataclass
-class EVar:
-    id: LongId
-
-
-@dataclasses.dataclass
-class EConst:
-    value: Const
-
-
-@dataclasses.dataclass
-class EInfixop:
-    op: str
-    left: Expr
-    right: Expr
-
-
-@dataclasses.dataclass
-class EFunc:
-    recursive: typing.Optional[str]
-    name: str
-    arg: str
-    arg_ty: typing.Optional[object]
-    ret_ty: typing.Optional[object]
-    uf: typing.Optional[object]
-    ut: typing.Optional[object]
-    body: Expr
-
-
-@dataclasses.dataclass
-class EIf:
-    cond: Expr
-    then: Expr
-    els: Expr
-
-
-@dataclasses.dataclass
-class ELet:
-    name: str
-    ann: typing.Optional[object]
-    value: Expr
-    body: Expr
-
-
-@dataclasses.dataclass
-class ELetTuple:
-    names: typing.List[str]
-    value: Expr
-    body: Expr
-
-
-@dataclasses.dataclass
-class ELetRecord:
-    fields: typing.List[tuple]
-    value: Expr
-    body: Expr
-
-
-@dataclasses.dataclass
-class EApp:
-    fn: Expr
-    v1: typing.Optional[object]
-    v2: typing.Optional[object]
-    arg: Expr
-
-
-@dataclasses.dataclass
-class EMatch:
-    scrutinee: Expr
-    cases: typing.List[tuple]
-
-
-@dataclasses.dataclass
-class ETuple:
-    items: typing.List[Expr]
-
-
-@dataclasses.dataclass
-class ERef:
-    expr: Expr
-
-
-@dataclasses.dataclass
-class EDeref:
-    expr: Expr
-
-
-@dataclasses.dataclass
-class EUpdate:
-    target: Expr
-    value: Expr
-
-
-@dataclasses.dataclass
-class EFuture:
-    v: typing.Optional[object]
-    expr: Expr
-
-
-@dataclasses.dataclass
-class EForce:
-    expr: Expr
-
-
-@dataclasses.dataclass
-class EPar:
-    left: Expr
-    right: Expr
-
-
-@dataclasses.dataclass
-class ETry:
-    expr: Expr
-    cases: typing.List[tuple]
-
-
-@dataclasses.dataclass
-class EAnnot:
-    expr: Expr
-    typ: object
-
-
-@dataclasses.dataclass
-class ENewVert:
-    var: object
-    typ: object
-    expr: Expr
-
-
-"""
-EXPRESSION WRAPPER
-"""
-
-@dataclasses.dataclass
-class Expr:
-    edesc: ExprDesc
-    eloc: typing.Optional[object] = None
-    etyp: typing.Optional[object] = None
-    egr: typing.Optional[object] = None
-
-
-ExprDesc = typing.Union[
-    EVar, EConst, EInfixop, EFunc, EIf,
-    ELet, ELetTuple, ELetRecord,
-    EApp, EMatch, ETuple,
-    ERef, EDeref, EUpdate,
-    EFuture, EForce, EPar,
-    ETry, EAnnot, ENewVert
-]
-
-
-"""
-DECLARATIONS
-"""
-
-@dataclasses.dataclass
-class DVal:
-    name: str
-    typ: typing.Optional[object]
-    expr: Expr
-
-
-@dataclasses.dataclass
-class DExp:
-    expr: Expr
-
-
-@dataclasses.dataclass
-class DExtType:
-    name: str
-
-
-@dataclasses.dataclass
-class DExtRecType:
-    name: str
-    fields: typing.List[typing.Tuple[LongId, object]]
-
-
-@dataclasses.dataclass
-class DExternal:
-    id: LongId
-    typ: object
-
-
-@dataclasses.dataclass
-class DTypeDef:
-    params: typing.List[str]
-    name: str
-    constructors: typing.List[tuple]
-
-
-DeclDesc = typing.Union[
-    DVal,
-    DExp,
-    DExtType,
-    DExtRecType,
-    DExternal,
-    DTypeDef
-]
-
-
-"""
-DECLARATION WRAPPER
-"""
-
-@dataclasses.dataclass
-class Decl:
-    ddesc: DeclDesc
-    dloc: typing.Optional[object] = None
-    dinfo: typing.Optional[object] = None
-
-
-"""
-PROGRAM
-"""
-
-Prog = typing.List[Decl]
+from __future__ import annotations
+import dataclasses
+import enum
+import sys
+import typing
+
+
+# Nodes are slotted, and the identifier and operator strings they hold are
+# interned, so the many copies of "n" or "Plus" in a converted program share
+# one string object.
+
+def _intern(s):
+    return sys.intern(s) if type(s) is str else s
+
+
+@dataclasses.dataclass(slots=True)
+class Unhandled:
+    kind: str
+    raw: object
+
+
+"""
+LONG IDENTIFIERS
+"""
+
+@dataclasses.dataclass(slots=True)
+class Id:
+    name: str
+
+    def __post_init__(self) -> None:
+        self.name = _intern(self.name)
+
+
+@dataclasses.dataclass(slots=True)
+class ModId:
+    module: str
+    rest: LongId
+
+    def __post_init__(self) -> None:
+        self.module = _intern(self.module)
+
+
+LongId = typing.Union[Id, ModId]
+
+
+"""
+CONSTANTS
+"""
+
+@dataclasses.dataclass(slots=True)
+class Num:
+    value: int
+
+
+@dataclasses.dataclass(slots=True)
+class String:
+    value: str
+
+
+@dataclasses.dataclass(slots=True)
+class Char:
+    value: str
+
+
+@dataclasses.dataclass(slots=True)
+class Bool:
+    value: bool
+
+
+@dataclasses.dataclass(slots=True)
+class Unit:
+    pass
+
+
+@dataclasses.dataclass(slots=True)
+class Futref:
+    value: object
+
+
+Const = typing.Union[Num, String, Char, Bool, Unit, Futref]
+
+
+"""
+INFIX OPERATORS
+"""
+
+class InfixOp(enum.StrEnum):
+    Plus = "Plus"
+    Minus = "Minus"
+    Times = "Times"
+    Div = "Div"
+    Lt = "Lt"
+    Le = "Le"
+    Gt = "Gt"
+    Ge = "Ge"
+    Eq = "Eq"
+    Ne = "Ne"
+    And = "And"
+    Or = "Or"
+    Concat = "Concat"
+
+
+"""
+EXPRESSION DESCRIPTION
+"""
+
+class IsRecursive(enum.StrEnum):
+    Recursive = "Recursive"
+    Terminal = "Terminal"
+
+
+@dataclasses.dataclass(slots=True)
+class EVar:
+    id: LongId
+
+
+@dataclasses.dataclass(slots=True)
+class EConst:
+    value: Const
+
+
+@dataclasses.dataclass(slots=True)
+class EInfixop:
+    op: InfixOp
+    left: Expr
+    right: Expr
+
+    def __post_init__(self) -> None:
+        self.op = _intern(self.op)
+
+
+@dataclasses.dataclass(slots=True)
+class EFunc:
+    recursive: typing.Optional[IsRecursive]
+    name: str
+    arg: str
+    arg_ty: typing.Optional[object]
+    ret_ty: typing.Optional[object]
+    uf: typing.Optional[object]
+    ut: typing.Optional[object]
+    body: Expr
+
+    def __post_init__(self) -> None:
+        self.name = _intern(self.name)
+        self.arg = _intern(self.arg)
+
+
+@dataclasses.dataclass(slots=True)
+class EIf:
+    cond: Expr
+    then: Expr
+    els: typing.Optional[Expr]
+
+
+@dataclasses.dataclass(slots=True)
+class ELet:
+    name: str
+    ann: typing.Optional[object]
+    value: Expr
+    body: Expr
+
+    def __post_init__(self) -> None:
+        self.name = _intern(self.name)
+
+
+@dataclasses.dataclass(slots=True)
+class ELetTuple:
+    names: typing.List[str]
+    value: Expr
+    body: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class ELetRecord:
+    fields: typing.List[typing.Tuple[LongId, str]]
+    value: Expr
+    body: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EApp:
+    fn: Expr
+    v1: typing.Optional[object]
+    v2: typing.Optional[object]
+    arg: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EMatch:
+    scrutinee: Expr
+    cases: typing.List[MatchCase]
+
+
+@dataclasses.dataclass(slots=True)
+class ETuple:
+    items: typing.List[Expr]
+
+
+@dataclasses.dataclass(slots=True)
+class ERef:
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EDeref:
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EUpdate:
+    target: Expr
+    value: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EFuture:
+    v: typing.Optional[object]
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EForce:
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class EPar:
+    left: Expr
+    right: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class ETry:
+    expr: Expr
+    cases: typing.List[MatchCase]
+
+
+@dataclasses.dataclass(slots=True)
+class EAnnot:
+    expr: Expr
+    typ: object
+
+
+@dataclasses.dataclass(slots=True)
+class ENewVert:
+    var: object
+    typ: object
+    expr: Expr
+
+
+"""
+EXPRESSION WRAPPER
+"""
+
+# Shared by every expression without annotations, which is nearly all of them.
+_NO_ANNOTATION = (None, None, None)
+
+
+def _annotation_field(index: int) -> property:
+    def get(self: Expr):
+        return self._annotation[index]
+
+    def set(self: Expr, value) -> None:
+        annotation = list(self._annotation)
+        annotation[index] = value
+        self._annotation = (
+            _NO_ANNOTATION if annotation == [None, None, None] else tuple(annotation)
+        )
+
+    return property(get, set)
+
+
+class Expr:
+    """Expression wrapper.
+
+    Behaves like a dataclass with fields ``edesc``, ``eloc``, ``etyp`` and
+    ``egr``, but keeps the three annotations in one tuple so that an
+    unannotated node costs a single shared reference.
+    """
+    __slots__ = ("edesc", "_annotation")
+    __match_args__ = ("edesc", "eloc", "etyp", "egr")
+
+    def __init__(
+        self,
+        edesc: ExprDesc,
+        eloc: typing.Optional[object] = None,
+        etyp: typing.Optional[object] = None,
+        egr: typing.Optional[object] = None,
+    ) -> None:
+        self.edesc = edesc
+        if eloc is None and etyp is None and egr is None:
+            self._annotation = _NO_ANNOTATION
+        else:
+            self._annotation = (eloc, etyp, egr)
+
+    eloc = _annotation_field(0)
+    etyp = _annotation_field(1)
+    egr = _annotation_field(2)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Expr):
+            return NotImplemented
+        return (self.edesc, self._annotation) == (other.edesc, other._annotation)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return (f"Expr(edesc={self.edesc!r}, eloc={self.eloc!r}, "
+                f"etyp={self.etyp!r}, egr={self.egr!r})")
+
+
+# e.g. | Some x -> e is (Id "Some", ["x"], e)
+MatchCase = typing.Tuple[LongId, typing.List[str], Expr]
+
+
+ExprDesc = typing.Union[
+    EVar, EConst, EInfixop, EFunc, EIf,
+    ELet, ELetTuple, ELetRecord,
+    EApp, EMatch, ETuple,
+    ERef, EDeref, EUpdate,
+    EFuture, EForce, EPar,
+    ETry, EAnnot, ENewVert
+]
+
+
+"""
+DECLARATIONS
+"""
+
+@dataclasses.dataclass(slots=True)
+class DVal:
+    name: str
+    typ: typing.Optional[object]
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class DExp:
+    expr: Expr
+
+
+@dataclasses.dataclass(slots=True)
+class DExtType:
+    name: str
+
+
+@dataclasses.dataclass(slots=True)
+class DExtRecType:
+    name: str
+    fields: typing.List[typing.Tuple[LongId, object]]
+
+
+@dataclasses.dataclass(slots=True)
+class DExternal:
+    id: LongId
+    typ: object
+
+
+@dataclasses.dataclass(slots=True)
+class DTypeDef:
+    params: typing.List[str]
+    name: str
+    constructors: typing.List[typing.Tuple[str, object]]
+
+
+DeclDesc = typing.Union[
+    DVal,
+    DExp,
+    DExtType,
+    DExtRecType,
+    DExternal,
+    DTypeDef
+]
+
+
+"""
+DECLARATION WRAPPER
+"""
+
+@dataclasses.dataclass(slots=True)
+class Decl:
+    ddesc: DeclDesc
+    dloc: typing.Optional[object] = None
+    dinfo: typing.Optional[object] = None
+
+
+"""
+PROGRAM
+"""
+
+Prog = typing.List[Decl]
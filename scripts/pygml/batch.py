@@ -0,0 +1,264 @@
+"""
+Batch conversion of many clang JSON AST dumps over a process pool.
+
+Every finished file is appended to a JSON Lines manifest, so an interrupted
+run picks up where it stopped: inputs whose last manifest entry succeeded and
+whose size, mtime and output options are unchanged are skipped.
+
+Under --out-dir each output keeps its input's path relative to the directory
+or glob root it was found under, so same-named inputs in different
+directories do not overwrite each other.  Inputs that would still share an
+output are rejected before anything is converted.
+"""
+import functools
+import glob
+import json
+import os
+import time
+import typing
+
+from .cache import ConversionCache
+from .convert import SUFFIXES, Skip, convert_file, output_options
+from .jsonio import COMPRESSIONS, strip_compression
+
+
+MANIFEST_NAME = "convert_ast.manifest.jsonl"
+
+# Inputs picked up from directories.
+INPUT_PATTERNS = ("*.json",) + tuple("*.json" + suffix for suffix in COMPRESSIONS.values())
+
+
+class Job(typing.NamedTuple):
+    src: str
+    dst: str
+    size: int
+    mtime_ns: int
+    # what else decides the output's bytes; see :func:`job_options`
+    options: str
+
+
+class OutputCollision(ValueError):
+    """Several inputs would be converted to the same output file."""
+
+
+"""
+INPUTS
+"""
+
+def _glob_root(pattern: str) -> str:
+    """The directory ``pattern`` matches below: its components up to the
+    first with a wildcard."""
+    parts = []
+    for part in pattern.split(os.sep):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return os.sep.join(parts) or os.curdir
+
+
+def expand_inputs(patterns: typing.Iterable[str]) -> typing.Dict[str, str]:
+    """Expand files, directories (every dump below them, see
+    :data:`INPUT_PATTERNS`) and glob patterns.
+
+    Maps each input's absolute path to its name relative to the directory or
+    glob root it was found under; a file given by name is just its base name.
+    """
+    found: typing.Dict[str, str] = {}
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            root = pattern
+            paths = [
+                path for name in INPUT_PATTERNS
+                for path in glob.glob(os.path.join(pattern, "**", name), recursive=True)
+            ]
+        elif glob.has_magic(pattern):
+            root = _glob_root(pattern)
+            paths = glob.glob(pattern, recursive=True)
+        else:
+            root = os.path.dirname(pattern)
+            paths = [pattern]
+        for path in sorted(paths):
+            src = os.path.abspath(path)
+            found.setdefault(src, os.path.relpath(src, os.path.abspath(root or os.curdir)))
+    return found
+
+
+def output_path(
+    src: str,
+    out_dir: typing.Optional[str],
+    fmt: str = "json",
+    compress: typing.Optional[str] = None,
+    name: typing.Optional[str] = None,
+) -> str:
+    """Where the output for ``src`` goes: the input name, less any compression
+    suffix, plus the format's suffix and that of ``compress``.
+
+    Under ``out_dir`` the input is known by ``name``, a path relative to it,
+    by default the base name of ``src``.
+    """
+    if out_dir is not None:
+        src = os.path.join(out_dir, name or os.path.basename(src))
+    path = strip_compression(src) + SUFFIXES[fmt]
+    if compress is not None:
+        path += COMPRESSIONS[compress]
+    return path
+
+
+def job_options(fmt: str = "json", skip_unsupported: Skip = False,
+                compress: typing.Optional[str] = None) -> str:
+    """:func:`pygml.convert.output_options` plus the output compression."""
+    options = output_options(fmt, skip_unsupported)
+    if compress is not None:
+        options += ":" + compress
+    return options
+
+
+def check_collisions(jobs: typing.Iterable[Job]) -> None:
+    """Raise :class:`OutputCollision` if two of ``jobs`` share an output."""
+    seen: typing.Dict[str, str] = {}
+    for job in jobs:
+        other = seen.setdefault(job.dst, job.src)
+        if other != job.src:
+            raise OutputCollision(f"{other} and {job.src} would both be converted to {job.dst}")
+
+
+"""
+MANIFEST
+"""
+
+def read_manifest(path: str) -> typing.Dict[str, dict]:
+    """Return the last manifest entry recorded for each input."""
+    entries: typing.Dict[str, dict] = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # torn last line of an interrupted run
+                continue
+            entries[entry["src"]] = entry
+    return entries
+
+
+def is_done(job: Job, entry: typing.Optional[dict]) -> bool:
+    return (
+        entry is not None
+        and entry["status"] == "ok"
+        and entry["dst"] == job.dst
+        and entry["size"] == job.size
+        and entry["mtime_ns"] == job.mtime_ns
+        and entry.get("options") == job.options
+        and os.path.exists(job.dst)
+    )
+
+
+"""
+WORKERS
+"""
+
+_caches: typing.Dict[typing.Tuple[str, int], ConversionCache] = {}
+
+def run_job(
+    job: Job,
+    stream: bool = True,
+    cache_dir: typing.Optional[str] = None,
+    cache_size: int = 0,
+    fmt: str = "json",
+    skip_unsupported: Skip = False,
+    incremental: bool = False,
+    max_memory: typing.Optional[int] = None,
+) -> dict:
+    """Convert one input, returning its manifest entry."""
+    start = time.perf_counter()
+    entry = job._asdict()
+    cache = None
+    if cache_dir is not None:
+        cache = _caches.get((cache_dir, cache_size))
+        if cache is None:
+            cache = _caches[cache_dir, cache_size] = ConversionCache(cache_dir, cache_size)
+    try:
+        entry["cached"] = convert_file(
+            job.src, job.dst, stream, cache, fmt,
+            skip_unsupported=skip_unsupported, incremental=incremental, max_memory=max_memory)
+        entry["status"] = "ok"
+    except Exception as e:
+        entry["status"] = "error"
+        entry["error"] = f"{type(e).__name__}: {e}"
+    if cache is not None:
+        cache.flush_stats()
+    entry["seconds"] = round(time.perf_counter() - start, 6)
+    return entry
+
+
+def run_batch(
+    patterns: typing.Iterable[str],
+    jobs: typing.Optional[int] = None,
+    out_dir: typing.Optional[str] = None,
+    manifest: typing.Optional[str] = None,
+    stream: bool = True,
+    cache: typing.Optional[ConversionCache] = None,
+    fmt: str = "json",
+    skip_unsupported: Skip = False,
+    incremental: bool = False,
+    compress: typing.Optional[str] = None,
+    max_memory: typing.Optional[int] = None,
+) -> typing.Dict[str, int]:
+    """Convert every input matched by ``patterns``; return per-status counts.
+
+    Raises :class:`OutputCollision`, before converting anything, if two
+    inputs would be converted to the same output.
+    """
+    options = job_options(fmt, skip_unsupported, compress)
+    all_jobs = []
+    for src, name in expand_inputs(patterns).items():
+        st = os.stat(src)
+        dst = output_path(src, out_dir, fmt, compress, name)
+        all_jobs.append(Job(src, dst, st.st_size, st.st_mtime_ns, options))
+    check_collisions(all_jobs)
+
+    if out_dir is not None:
+        os.makedirs(out_dir, exist_ok=True)
+    if manifest is None:
+        manifest = os.path.join(out_dir or os.curdir, MANIFEST_NAME)
+    previous = read_manifest(manifest)
+
+    counts = {"ok": 0, "error": 0, "skipped": 0, "cached": 0}
+    todo = []
+    for job in all_jobs:
+        if is_done(job, previous.get(job.src)):
+            counts["skipped"] += 1
+        else:
+            os.makedirs(os.path.dirname(job.dst), exist_ok=True)
+            todo.append(job)
+
+    worker = functools.partial(
+        run_job,
+        stream=stream,
+        cache_dir=None if cache is None else cache.root,
+        cache_size=0 if cache is None else cache.max_size,
+        fmt=fmt,
+        skip_unsupported=skip_unsupported,
+        incremental=incremental,
+        max_memory=max_memory,
+    )
+    jobs = min(jobs or os.cpu_count() or 1, max(len(todo), 1))
+    with open(manifest, "a") as log:
+        if jobs == 1:
+            results: typing.Iterable[dict] = map(worker, todo)
+            _record(results, log, counts)
+        else:
+            import multiprocessing  # only here, to keep it off the startup path
+            chunksize = max(1, len(todo) // (jobs * 16))
+            with multiprocessing.Pool(jobs) as pool:
+                _record(pool.imap_unordered(worker, todo, chunksize), log, counts)
+    return counts
+
+
+def _record(results: typing.Iterable[dict], log: typing.TextIO, counts: typing.Dict[str, int]) -> None:
+    for entry in results:
+        counts[entry["status"]] += 1
+        counts["cached"] += bool(entry.get("cached"))
+        log.write(json.dumps(entry) + "\n")
+        log.flush()
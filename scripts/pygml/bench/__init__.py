@@ -0,0 +1,4 @@
+from ._io import *
+from ._startup import *
+from ._suite import *
+from ._synth import *
@@ -0,0 +1,203 @@
+"""
+Benchmarks of the clang-to-GML conversion stages on synthetic dumps.
+
+    python -m pygml.bench run -o results.json
+    python -m pygml.bench run --shape chain --sizes 100,1000 --stages convert,encode
+    python -m pygml.bench compare before.json after.json
+    python -m pygml.bench generate tasks 100 -o tasks-100.json
+    python -m pygml.bench io --backend orjson --backend stdlib -o io.json
+    python -m pygml.bench startup -o startup.json
+
+"run" prints one line per measurement to stderr and writes all of them as
+JSON.  "compare" prints the new/old ratios of two result files and exits
+with status 1 if any stage got slower or bigger by more than --threshold.
+"io" times pygml.jsonio across JSON backends and compressions instead, and
+"startup" how long convert_ast takes to start, warm, cold and bundled, with
+the import time of each under -X importtime, against a request to a warm
+conversion server; their results compare the same way.
+"""
+import argparse
+import json
+import sys
+import typing
+
+from .. import jsonio
+from ._io import IO_SWEEPS, run_io_matrix
+from ._startup import STARTUP_CASES, STARTUP_WAYS, run_startup
+from ._suite import COMPARED, STAGES, SWEEPS, compare, run_sweep
+from ._synth import SHAPES, write_dump
+
+
+def _progress(record: dict) -> None:
+    line = f"{record['shape']:>9} {record['size']:>6} {record['stage']:<20}"
+    if "error" in record:
+        line += f" {record['error'][:60]}"
+    else:
+        if "seconds" in record:
+            line += f" {record['seconds'] * 1e3:10.3f} ms"
+        if "peak_bytes" in record:
+            line += f" {record['peak_bytes'] / 2**20:9.2f} MiB peak"
+        if "import_seconds" in record:
+            line += f" {record['import_seconds'] * 1e3:10.3f} ms importing"
+    print(line, file=sys.stderr, flush=True)
+
+
+def _csv(text: str) -> typing.List[str]:
+    return [item for item in text.split(",") if item]
+
+
+def _write(doc: dict, path: typing.Optional[str]) -> None:
+    if path is None:
+        json.dump(doc, sys.stdout, indent=1)
+        print()
+    else:
+        with open(path, "w") as f:
+            json.dump(doc, f, indent=1)
+
+
+def main() -> None:
+    cfg = parse_args()
+
+    if cfg.command in ("run", "io"):
+        defaults = SWEEPS if cfg.command == "run" else IO_SWEEPS
+        shapes = cfg.shape or list(defaults)
+        sweeps = {
+            shape: [int(n) for n in _csv(cfg.sizes)] if cfg.sizes else defaults.get(shape, SWEEPS[shape])
+            for shape in shapes
+        }
+        if cfg.command == "run" and cfg.quick:
+            sweeps = {shape: sizes[:2] for shape, sizes in sweeps.items()}
+        if cfg.command == "run":
+            doc = run_sweep(
+                sweeps,
+                repeat=cfg.repeat,
+                min_time=cfg.min_time,
+                memory=not cfg.no_memory,
+                stages=_csv(cfg.stages) if cfg.stages else None,
+                progress=_progress,
+            )
+        else:
+            doc = run_io_matrix(
+                sweeps,
+                repeat=cfg.repeat,
+                min_time=cfg.min_time,
+                backends=cfg.backend,
+                compressions=cfg.compression,
+                progress=_progress,
+            )
+        _write(doc, cfg.output)
+
+    elif cfg.command == "startup":
+        doc = run_startup(
+            size=cfg.size,
+            repeat=cfg.repeat,
+            ways=cfg.way,
+            cases=cfg.case,
+            progress=_progress,
+        )
+        _write(doc, cfg.output)
+
+    elif cfg.command == "compare":
+        with open(cfg.OLD, "r") as f:
+            old = json.load(f)
+        with open(cfg.NEW, "r") as f:
+            new = json.load(f)
+        print(f"old: {old['meta'].get('commit')}  new: {new['meta'].get('commit')}")
+        rows = compare(old, new, cfg.threshold)
+        for row in rows:
+            ratios = "  ".join(
+                f"{field} x{row[field]:.2f}" for field in COMPARED if field in row
+            )
+            flag = "  REGRESSION" if row["regression"] else ""
+            if "error" in row:
+                ratios += f"  now fails: {row['error'][:60]}"
+            print(f"{row['shape']:>9} {row['size']:>6} {row['stage']:<20} {ratios}{flag}")
+        if any(row["regression"] for row in rows):
+            sys.exit(1)
+
+    else:
+        doc = SHAPES[cfg.SHAPE](cfg.SIZE)
+        if cfg.output is None:
+            write_dump(doc, sys.stdout)
+        else:
+            with open(cfg.output, "w") as f:
+                write_dump(doc, f)
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m pygml.bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Measure the stages over size sweeps")
+    run.add_argument("--shape", choices=sorted(SHAPES), action="append", default=None,
+                     help="Shape to measure; repeatable. Default: all")
+    run.add_argument("--sizes", type=str, default=None,
+                     help="Comma-separated sizes for every shape. Default: per-shape sweeps")
+    run.add_argument("--stages", type=str, default=None,
+                     help=f"Comma-separated stages out of {','.join(STAGES)}. Default: all")
+    run.add_argument("--quick", action="store_true",
+                     help="Only the two smallest sizes of each sweep")
+    run.add_argument("--repeat", type=int, default=3,
+                     help="Timed repetitions per stage; the best is reported. Default: 3")
+    run.add_argument("--min-time", type=float, default=0.05,
+                     help="Minimum seconds per repetition; short stages are looped. "
+                          "Default: 0.05")
+    run.add_argument("--no-memory", action="store_true",
+                     help="Skip the tracemalloc pass that records peak memory")
+    run.add_argument("-o", "--output", type=str, default=None,
+                     help="Write the results here instead of stdout")
+
+    io = commands.add_parser("io", help="Measure reading and writing over JSON backends "
+                                        "and compressions")
+    io.add_argument("--shape", choices=sorted(SHAPES), action="append", default=None,
+                    help="Shape to measure; repeatable. Default: functions and headers")
+    io.add_argument("--sizes", type=str, default=None,
+                    help="Comma-separated sizes for every shape. Default: per-shape sweeps")
+    io.add_argument("--backend", choices=sorted(jsonio.BACKENDS), action="append", default=None,
+                    help="JSON backend; repeatable. Default: all installed")
+    io.add_argument("--compression", choices=["plain"] + jsonio.available_compressions(),
+                    action="append", default=None,
+                    help="How the dump is stored; repeatable. Default: all available")
+    io.add_argument("--repeat", type=int, default=3,
+                    help="Timed repetitions per stage; the best is reported. Default: 3")
+    io.add_argument("--min-time", type=float, default=0.05,
+                    help="Minimum seconds per repetition. Default: 0.05")
+    io.add_argument("-o", "--output", type=str, default=None,
+                    help="Write the results here instead of stdout")
+
+    startup = commands.add_parser("startup", help="Measure how long convert_ast takes "
+                                                   "to start, in fresh processes")
+    startup.add_argument("--way", choices=STARTUP_WAYS, action="append", default=None,
+                         help="How convert_ast is run; repeatable. Default: all")
+    startup.add_argument("--case", choices=sorted(STARTUP_CASES), action="append", default=None,
+                         help="What it is run for; repeatable. Default: all")
+    startup.add_argument("--size", type=int, default=10,
+                         help="Functions in the dump converted. Default: 10")
+    startup.add_argument("--repeat", type=int, default=10,
+                         help="Runs per case, and as many again under -X importtime; "
+                              "the best is reported. Default: 10")
+    startup.add_argument("-o", "--output", type=str, default=None,
+                         help="Write the results here instead of stdout")
+
+    cmp = commands.add_parser("compare", help="Compare two result files")
+    cmp.add_argument("OLD", type=str)
+    cmp.add_argument("NEW", type=str)
+    cmp.add_argument("--threshold", type=float, default=1.1,
+                     help="Ratio above which a stage counts as regressed. Default: 1.1")
+
+    gen = commands.add_parser("generate", help="Write a synthetic clang dump")
+    gen.add_argument("SHAPE", choices=sorted(SHAPES))
+    gen.add_argument("SIZE", type=int)
+    gen.add_argument("-o", "--output", type=str, default=None,
+                     help="Write the dump here instead of stdout")
+
+    cfg = parser.parse_args()
+    if cfg.command == "run" and cfg.stages:
+        unknown = set(_csv(cfg.stages)) - set(STAGES)
+        if unknown:
+            parser.error(f"unknown stages: {', '.join(sorted(unknown))}")
+    return cfg
+
+
+if __name__ == "__main__":
+    main()
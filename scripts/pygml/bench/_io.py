@@ -0,0 +1,120 @@
+"""
+Timing of pygml.jsonio across JSON backends and file compressions.
+
+Each synthetic dump is stored plain and with every compression available,
+then for each stored copy and each backend installed:
+
+    load:B:C    pygml.jsonio.load: map (orjson) or read (stdlib), or
+                decompress, and decode it whole
+    stream:C    read its FunctionDecls with the streaming reader
+    dumps:B     encode the converted program as .conv text
+    write:B:C   write that text, compressed as C
+
+C is "plain" for an uncompressed file.  Records use these names as their
+stage, so two result files compare like those of :func:`run_sweep`.
+"""
+import os
+import tempfile
+import typing
+
+from .. import ast, convert, jsonio
+from ._suite import environment, time_call
+from ._synth import SHAPES, write_dump
+
+
+# Sizes measured for each shape by default.
+IO_SWEEPS: typing.Dict[str, typing.Tuple[int, ...]] = {
+    "functions": (10, 100, 1000),
+    "headers": (1000, 10000, 100000),
+}
+
+_PLAIN = "plain"
+
+
+def _stream(path: str) -> typing.List[dict]:
+    with jsonio.open_file(path) as f:
+        return list(ast.iter_function_decls(f))
+
+
+def _store(src: str, compression: str) -> str:
+    if compression == _PLAIN:
+        return src
+    dst = src + jsonio.COMPRESSIONS[compression]
+    with open(src, "rb") as f:
+        jsonio.write_bytes(dst, f.read())
+    return dst
+
+
+def run_io_case(
+    shape: str,
+    size: int,
+    repeat: int = 3,
+    min_time: float = 0.05,
+    backends: typing.Optional[typing.Iterable[str]] = None,
+    compressions: typing.Optional[typing.Iterable[str]] = None,
+) -> typing.List[dict]:
+    """Measure the ``shape`` dump of ``size`` over ``backends`` (default: all
+    installed) and ``compressions`` (default: plain and all available)."""
+    chosen = [jsonio.get_backend(name) for name in (backends or jsonio.BACKENDS)]
+    methods = list(compressions or [_PLAIN] + jsonio.available_compressions())
+    records = []
+
+    def measure(stage: str, fn: typing.Callable, arg, **fields) -> None:
+        record = {"shape": shape, "size": size, "stage": stage, **fields}
+        times = time_call(fn, arg, repeat, min_time)
+        record["seconds"] = min(times)
+        record["repeat"] = len(times)
+        records.append(record)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, f"{shape}-{size}.json")
+        with open(src, "w") as f:
+            write_dump(SHAPES[shape](size), f)
+        paths = {method: _store(src, method) for method in methods}
+        for method, path in paths.items():
+            measure(f"stream:{method}", _stream, path,
+                    compression=method, input_bytes=os.path.getsize(path))
+            for backend in chosen:
+                measure(f"load:{backend.name}:{method}", lambda p: jsonio.load(p, backend), path,
+                        backend=backend.name, compression=method)
+
+        prog = convert.convert_functions(_stream(src))
+        encoded = ast.encode_program(prog)
+        for backend in chosen:
+            try:
+                text = jsonio.dumps(encoded, backend)
+            except RecursionError as e:
+                records.append({"shape": shape, "size": size, "stage": f"dumps:{backend.name}",
+                                "backend": backend.name, "error": f"{type(e).__name__}: {e}"})
+                continue
+            measure(f"dumps:{backend.name}", lambda js: jsonio.dumps(js, backend), encoded,
+                    backend=backend.name, output_bytes=len(text))
+            for method in methods:
+                out = os.path.join(tmp, "out.conv")
+                if method != _PLAIN:
+                    out += jsonio.COMPRESSIONS[method]
+                measure(f"write:{backend.name}:{method}", lambda data: jsonio.write_bytes(out, data),
+                        text, backend=backend.name, compression=method)
+                records[-1]["output_bytes"] = os.path.getsize(out)
+    return records
+
+
+def run_io_matrix(
+    sweeps: typing.Optional[typing.Dict[str, typing.Iterable[int]]] = None,
+    repeat: int = 3,
+    min_time: float = 0.05,
+    backends: typing.Optional[typing.Iterable[str]] = None,
+    compressions: typing.Optional[typing.Iterable[str]] = None,
+    progress: typing.Optional[typing.Callable[[dict], None]] = None,
+) -> dict:
+    """Run :func:`run_io_case` over ``sweeps`` (default :data:`IO_SWEEPS`)."""
+    if sweeps is None:
+        sweeps = IO_SWEEPS
+    results = []
+    for shape, sizes in sweeps.items():
+        for size in sizes:
+            for record in run_io_case(shape, size, repeat, min_time, backends, compressions):
+                results.append(record)
+                if progress is not None:
+                    progress(record)
+    return {"meta": environment(), "results": results}
@@ -0,0 +1,197 @@
+"""
+Start-up time of convert_ast, measured in fresh interpreters.
+
+Each case runs the converter as a new process on a small synthetic dump,
+the way gml does for every file it converts:
+
+    help    convert_ast --help
+    hit     a conversion served from the conversion cache
+    miss    the same conversion with --no-cache
+
+and each case is run three ways:
+
+    tree    python -m convert_ast from a copy of the scripts, its bytecode
+            and generated code cached by an earlier run
+    cold    the same with none of them cached or written, as on the first
+            run after a checkout or wherever bytecode cannot be written
+    bundle  the zipapp pygml.bundle builds from the same tree
+    server  a request to a running pygml.server, timed from this process
+            the way gml makes it, over the socket: "hit" for an unchanged
+            dump, "miss" for one touched before every request and so
+            reconverted; there is nothing to time for "help"
+
+The stage of a record is "way:case", e.g. "cold:hit"; "python" is an
+interpreter doing nothing, the floor under all of them.  ``seconds`` is the
+best wall time of the runs.  The same runs are repeated under -X importtime
+for ``import_seconds``, the total time spent importing, and for the slowest
+modules of the fastest of them.  Records compare like those of
+:func:`run_sweep`, so a result file kept per commit tracks start-up latency
+over time.
+"""
+import contextlib
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import typing
+
+from .. import bundle, server
+from ._suite import environment
+from ._synth import SHAPES, write_dump
+
+
+STARTUP_WAYS = ("tree", "cold", "bundle", "server")
+
+# case -> convert_ast arguments, run in a directory holding dump.json
+STARTUP_CASES: typing.Dict[str, typing.Tuple[str, ...]] = {
+    "help": ("--help",),
+    "hit": ("--cache-dir", "cache", "dump.json"),
+    "miss": ("--no-cache", "dump.json"),
+}
+
+# Modules listed per record, the slowest first.
+_SLOWEST = 10
+
+_SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(text: str) -> typing.Dict[str, float]:
+    """Seconds each module took to import itself, from the stderr of
+    ``python -X importtime``; other lines are ignored."""
+    times = {}
+    for line in text.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # the header
+            continue
+        times[fields[2].strip()] = int(fields[0]) / 1e6
+    return times
+
+
+def _run(cmd: typing.List[str], env: dict, cwd: str) -> typing.Tuple[float, str]:
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, env=env, cwd=cwd, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stderr=proc.stderr)
+    return elapsed, proc.stderr
+
+
+def _measure(cmd: typing.List[str], env: dict, cwd: str, repeat: int) -> dict:
+    walls = [_run(cmd, env, cwd)[0] for _ in range(repeat)]
+    imports = [parse_importtime(_run(cmd[:1] + ["-X", "importtime"] + cmd[1:], env, cwd)[1])
+               for _ in range(repeat)]
+    fastest = min(imports, key=lambda times: sum(times.values()))
+    slowest = sorted(fastest.items(), key=lambda item: item[1], reverse=True)[:_SLOWEST]
+    return {
+        "seconds": min(walls),
+        "median": statistics.median(walls),
+        "repeat": repeat,
+        "import_seconds": sum(fastest.values()),
+        "imports": len(fastest),
+        "slowest_imports": dict(slowest),
+    }
+
+
+def _measure_server(sock: str, path: str, case: str, repeat: int) -> dict:
+    walls = []
+    for _ in range(repeat):
+        if case == "miss":
+            st = os.stat(path)
+            os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000))
+        start = time.perf_counter()
+        server.convert_text(sock, path)
+        walls.append(time.perf_counter() - start)
+    return {"seconds": min(walls), "median": statistics.median(walls), "repeat": repeat}
+
+
+@contextlib.contextmanager
+def _running_server(sock: str, env: dict, cwd: str) -> typing.Iterator[None]:
+    """A pygml.server from the scripts listening on ``sock``."""
+    cmd = [sys.executable, "-m", "pygml.server", "--socket", sock, "serve"]
+    proc = subprocess.Popen(cmd, env=dict(env, PYTHONPATH=_SCRIPTS_DIR), cwd=cwd,
+                            stderr=subprocess.PIPE, text=True)
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(sock):
+            if proc.poll() is not None or time.monotonic() > deadline:
+                proc.kill()
+                raise subprocess.CalledProcessError(proc.wait(), cmd, stderr=proc.stderr.read())
+            time.sleep(0.01)
+        yield
+    finally:
+        if proc.poll() is None:
+            server.request(sock, {"op": "shutdown"})
+            proc.wait()
+        proc.stderr.close()
+
+
+def run_startup(
+    size: int = 10,
+    repeat: int = 10,
+    ways: typing.Optional[typing.Iterable[str]] = None,
+    cases: typing.Optional[typing.Iterable[str]] = None,
+    progress: typing.Optional[typing.Callable[[dict], None]] = None,
+) -> dict:
+    """Time :data:`STARTUP_CASES` (default: all) the ``ways`` of
+    :data:`STARTUP_WAYS` (default: all) on a dump of ``size`` functions.
+
+    Returns ``{"meta": environment(), "results": [record, ...]}`` as
+    :func:`run_sweep` does.
+    """
+    ways = list(STARTUP_WAYS if ways is None else ways)
+    cases = list(STARTUP_CASES if cases is None else cases)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        def record(stage: str, measure: typing.Callable[[], dict]) -> None:
+            rec = {"shape": "startup", "size": size, "stage": stage}
+            try:
+                rec.update(measure())
+            except subprocess.CalledProcessError as e:
+                rec["error"] = f"exit status {e.returncode}: {e.stderr.strip()[-200:]}"
+            results.append(rec)
+            if progress is not None:
+                progress(rec)
+
+        dump = os.path.join(tmp, "dump.json")
+        with open(dump, "w") as f:
+            write_dump(SHAPES["functions"](size), f)
+        base = {k: v for k, v in os.environ.items() if not k.startswith("PYTHON")}
+        python = [sys.executable]
+        record("python", lambda: _measure(python + ["-c", "pass"], base, tmp, repeat))
+
+        for way in ways:
+            if way == "server":
+                sock = os.path.join(tmp, "server.sock")
+                with _running_server(sock, base, tmp):
+                    # the first request converts, whatever the case
+                    server.convert_text(sock, dump)
+                    for case in cases:
+                        if case != "help":
+                            record(f"server:{case}", lambda: _measure_server(sock, dump, case, repeat))
+                continue
+            if way == "bundle":
+                path = os.path.join(tmp, "convert_ast.pyz")
+                bundle.build(path, interpreter=None)
+                env, cmd = base, python + [path]
+            else:
+                # a copy with no __pycache__, so what the tree has cached does not count
+                scripts = os.path.join(tmp, way)
+                shutil.copytree(os.path.join(_SCRIPTS_DIR, "pygml"), os.path.join(scripts, "pygml"),
+                                ignore=shutil.ignore_patterns("__pycache__"))
+                shutil.copy(os.path.join(_SCRIPTS_DIR, "convert_ast.py"), scripts)
+                env = dict(base, PYTHONPATH=scripts)
+                if way == "cold":
+                    env["PYTHONDONTWRITEBYTECODE"] = "1"
+                cmd = python + ["-m", "convert_ast"]
+            # fills the conversion cache for "hit", and the pycache for "tree"
+            _run(cmd + list(STARTUP_CASES["hit"]), env, tmp)
+            for case in cases:
+                record(f"{way}:{case}", lambda: _measure(cmd + list(STARTUP_CASES[case]), env, tmp, repeat))
+    return {"meta": environment(), "results": results}
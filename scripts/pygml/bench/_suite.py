@@ -0,0 +1,317 @@
+"""
+Per-stage timing and memory of the conversion pipeline over size sweeps.
+
+A run converts each synthetic dump stage by stage and measures every stage on
+its own, given the previous stage's output:
+
+    load           read the dump file into FunctionDecl dicts
+    convert        pygml.ast.convert_program over them
+    encode         pygml.ast.encode_program
+    index          pygml.ast.ProgIndex over the converted program
+    walk           pygml.ast.iter_exprs over the converted program
+    walk_sites     pygml.ast.iter_sites, which tracks paths as well
+    walk_naive     the same count by plain recursion over dataclasses.fields,
+                   for comparison; deep trees overflow the stack
+    rewrite        pygml.ast.rewrite_decl with a function keeping every node
+    workspan       pygml.workspan.estimate at sizes 0 to 31
+    dump           json.dumps of the encoded program, as written to .conv
+    dump_stream    the same text by pygml.ast.iter_decl_json straight from
+                   the converted program, with no encode stage before it
+    decode         pygml.ast.decode_program of the encoded program
+    decode_lazy    the same with lazy=True, which decodes no expression yet
+    encode_binary  pygml.ast.encode_program_binary
+    decode_binary  pygml.ast.decode_program_binary
+
+Results are plain JSON, tagged with the commit they were taken at, so two
+runs can be compared with :func:`compare`.
+"""
+import dataclasses
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import typing
+
+from .. import ast, jsonio, workspan
+from ._synth import SHAPES, write_dump
+
+
+RESULTS_VERSION = 1
+
+# Sizes measured for each shape by default.
+SWEEPS: typing.Dict[str, typing.Tuple[int, ...]] = {
+    "tasks": (10, 100, 1000),
+    "block": (100, 1000, 10000),
+    "chain": (10, 100, 400),
+    "functions": (10, 100, 1000),
+    "headers": (100, 1000, 10000),
+}
+
+
+def _load(path: str) -> typing.List[dict]:
+    with open(path, "r") as f:
+        return list(ast.iter_function_decls(f))
+
+
+def _convert(data: typing.List[dict]) -> ast.Prog:
+    return [decl for d in data for decl in ast.convert_program(d)]
+
+
+def _walk(prog: ast.Prog) -> int:
+    return sum(1 for _ in ast.iter_exprs(prog))
+
+
+def _walk_sites(prog: ast.Prog) -> int:
+    return sum(1 for _ in ast.iter_sites(prog))
+
+
+def _count_naive(node) -> int:
+    if isinstance(node, ast.Expr):
+        return 1 + _count_naive(node.edesc)
+    if isinstance(node, (list, tuple)):
+        return sum(_count_naive(x) for x in node)
+    if dataclasses.is_dataclass(node):
+        return sum(_count_naive(getattr(node, f.name)) for f in dataclasses.fields(node))
+    return 0
+
+
+def _walk_naive(prog: ast.Prog) -> int:
+    return sum(_count_naive(decl.ddesc) for decl in prog)
+
+
+def _rewrite(prog: ast.Prog) -> ast.Prog:
+    return [ast.rewrite_decl(decl, lambda e: e) for decl in prog]
+
+
+def _workspan(prog: ast.Prog) -> dict:
+    return workspan.estimate(prog, range(32))
+
+
+def _dump(js: list) -> bytes:
+    return json.dumps(js).encode()
+
+
+def _dump_stream(prog: ast.Prog) -> bytes:
+    style = jsonio.get_backend("stdlib")
+    return ("[" + style.separator.join([ast.decl_json(d, style) for d in prog]) + "]").encode()
+
+
+def _decode_lazy(js: list) -> ast.Prog:
+    return ast.decode_program(js, lazy=True)
+
+
+# name -> (function, name of the stage whose output it takes)
+STAGES: typing.Dict[str, typing.Tuple[typing.Callable, typing.Optional[str]]] = {
+    "load": (_load, None),
+    "convert": (_convert, "load"),
+    "encode": (ast.encode_program, "convert"),
+    "index": (ast.ProgIndex, "convert"),
+    "walk": (_walk, "convert"),
+    "walk_sites": (_walk_sites, "convert"),
+    "walk_naive": (_walk_naive, "convert"),
+    "rewrite": (_rewrite, "convert"),
+    "workspan": (_workspan, "convert"),
+    "dump": (_dump, "encode"),
+    "dump_stream": (_dump_stream, "convert"),
+    "decode": (ast.decode_program, "encode"),
+    "decode_lazy": (_decode_lazy, "encode"),
+    "encode_binary": (ast.encode_program_binary, "convert"),
+    "decode_binary": (ast.decode_program_binary, "encode_binary"),
+}
+
+
+"""
+MEASUREMENT
+"""
+
+def time_call(fn: typing.Callable, arg, repeat: int = 3, min_time: float = 0.05) -> typing.List[float]:
+    """Seconds per call of ``fn(arg)``, one figure per repetition.
+
+    Each repetition loops for at least ``min_time`` seconds, with the
+    collector off as in timeit.
+    """
+    number = 1
+    while True:
+        elapsed = _loop(fn, arg, number)
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 2 >= min_time else 10
+    times = [elapsed / number]
+    for _ in range(repeat - 1):
+        times.append(_loop(fn, arg, number) / number)
+    return times
+
+
+def _loop(fn: typing.Callable, arg, number: int) -> float:
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn(arg)
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def trace_call(fn: typing.Callable, arg) -> typing.Tuple[typing.Any, int, int]:
+    """Run ``fn(arg)`` under tracemalloc.
+
+    Returns the result, the peak bytes allocated during the call, and the
+    bytes still held once it returned (roughly the size of the result).
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        result = fn(arg)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak - base, current - base
+
+
+"""
+RUNS
+"""
+
+def run_case(
+    shape: str,
+    size: int,
+    repeat: int = 3,
+    min_time: float = 0.05,
+    memory: bool = True,
+    stages: typing.Optional[typing.Iterable[str]] = None,
+) -> typing.List[dict]:
+    """Measure every stage on the ``shape`` dump of ``size``; one record each.
+
+    A stage that fails records its error instead, and the stages depending
+    on it are left out.
+    """
+    wanted = set(STAGES if stages is None else stages)
+    needed = set()
+    for name in wanted:
+        while name is not None and name not in needed:
+            needed.add(name)
+            name = STAGES[name][1]
+    doc = SHAPES[shape](size)
+    records = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f"{shape}-{size}.json")
+        with open(path, "w") as f:
+            write_dump(doc, f)
+        del doc
+        outputs: typing.Dict[str, typing.Any] = {}
+        for name, (fn, source) in STAGES.items():
+            if name not in needed or (source is not None and source not in outputs):
+                continue
+            arg = path if source is None else outputs[source]
+            record = {"shape": shape, "size": size, "stage": name}
+            try:
+                if memory:
+                    outputs[name], record["peak_bytes"], record["result_bytes"] = trace_call(fn, arg)
+                else:
+                    outputs[name] = fn(arg)
+                if name in wanted:
+                    times = time_call(fn, arg, repeat, min_time)
+                    record["seconds"] = min(times)
+                    record["median"] = statistics.median(times)
+                    record["repeat"] = len(times)
+            except (RecursionError, MemoryError, ValueError) as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+            if name == "load":
+                record["input_bytes"] = os.path.getsize(path)
+            if name in wanted:
+                records.append(record)
+    return records
+
+
+def _git(*args: str) -> typing.Optional[str]:
+    try:
+        out = subprocess.run(("git",) + args, cwd=os.path.dirname(os.path.abspath(__file__)),
+                             capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.strip()
+
+
+def environment() -> dict:
+    """What a result file records about where it was taken."""
+    status = _git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "version": RESULTS_VERSION,
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": None if status is None else bool(status),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run_sweep(
+    sweeps: typing.Optional[typing.Dict[str, typing.Iterable[int]]] = None,
+    repeat: int = 3,
+    min_time: float = 0.05,
+    memory: bool = True,
+    stages: typing.Optional[typing.Iterable[str]] = None,
+    progress: typing.Optional[typing.Callable[[dict], None]] = None,
+) -> dict:
+    """Run :func:`run_case` over ``sweeps`` (default :data:`SWEEPS`).
+
+    Returns ``{"meta": environment(), "results": [record, ...]}``; each
+    record is also passed to ``progress`` as soon as it is taken.
+    """
+    if sweeps is None:
+        sweeps = SWEEPS
+    results = []
+    for shape, sizes in sweeps.items():
+        for size in sizes:
+            for record in run_case(shape, size, repeat, min_time, memory, stages):
+                results.append(record)
+                if progress is not None:
+                    progress(record)
+    return {"meta": environment(), "results": results}
+
+
+"""
+COMPARISON
+"""
+
+# Fields whose ratio :func:`compare` reports.
+COMPARED = ("seconds", "peak_bytes", "import_seconds")
+
+
+def _index(doc: dict) -> typing.Dict[typing.Tuple[str, int, str], dict]:
+    return {(r["shape"], r["size"], r["stage"]): r for r in doc["results"]}
+
+
+def compare(old: dict, new: dict, threshold: float = 1.1) -> typing.List[dict]:
+    """Pair up the records two runs have in common.
+
+    Each row holds the new/old ratio of ``seconds``, ``peak_bytes`` and
+    ``import_seconds`` where both runs have them, and ``regression`` is set
+    when any ratio exceeds ``threshold`` or a stage that worked before now
+    fails.
+    """
+    before = _index(old)
+    rows = []
+    for key, rec in _index(new).items():
+        prev = before.get(key)
+        if prev is None:
+            continue
+        row = {"shape": key[0], "size": key[1], "stage": key[2], "regression": False}
+        for field in COMPARED:
+            if rec.get(field) and prev.get(field):
+                row[field] = rec[field] / prev[field]
+                row["regression"] |= row[field] > threshold
+        if "error" in rec and "error" not in prev:
+            row["error"] = rec["error"]
+            row["regression"] = True
+        rows.append(row)
+    return rows
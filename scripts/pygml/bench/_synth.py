@@ -0,0 +1,255 @@
+"""
+Synthetic clang -ast-dump=json documents for the benchmarks.
+
+Each shape stresses one part of the converter and is generated at any size:
+
+    tasks      fib.c's else branch with ``size`` task/assign pairs before the
+               taskwait
+    block      a CompoundStmt of ``size`` assignments
+    chain      a return of a left-nested BinaryOperator chain ``size`` deep
+    functions  a TranslationUnitDecl of ``size`` fib.c functions
+    headers    fib.c after ``size`` declarations from an included header
+
+Nodes carry the id, loc, range, type and valueCategory noise of a real dump,
+so reading them costs what reading clang's output does.
+"""
+import itertools
+import json
+import typing
+
+
+_encode_string = json.encoder.encode_basestring_ascii  # type: ignore[attr-defined]
+
+_MAIN_FILE = "testcases/fib.c"
+_HEADER = "/usr/include/stdio.h"
+
+
+class _Builder:
+    """Makes clang-shaped nodes, numbering their ids from 1."""
+
+    def __init__(self) -> None:
+        self._ids = itertools.count(1)
+
+    def node(self, kind: str, inner: typing.Optional[list] = None, **fields) -> dict:
+        offset = next(self._ids)
+        node = {
+            "id": hex(offset),
+            "kind": kind,
+            "loc": {"offset": offset, "col": 3, "tokLen": 1},
+            "range": {
+                "begin": {"offset": offset, "col": 3, "tokLen": 1},
+                "end": {"offset": offset + 4, "col": 7, "tokLen": 1},
+            },
+        }
+        node.update(fields)
+        if inner is not None:
+            node["inner"] = inner
+        return node
+
+    def ref(self, name: str, kind: str = "ParmVarDecl") -> dict:
+        decl = self.node("DeclRefExpr", type={"qualType": "int"}, valueCategory="lvalue",
+                         referencedDecl={"id": "0x1", "kind": kind, "name": name,
+                                         "type": {"qualType": "int"}})
+        return self.node("ImplicitCastExpr", [decl], type={"qualType": "int"},
+                         valueCategory="prvalue", castKind="LValueToRValue")
+
+    def lit(self, value: int) -> dict:
+        return self.node("IntegerLiteral", type={"qualType": "int"},
+                         valueCategory="prvalue", value=str(value))
+
+    def binop(self, op: str, left: dict, right: dict) -> dict:
+        return self.node("BinaryOperator", [left, right], type={"qualType": "int"},
+                         valueCategory="prvalue", opcode=op)
+
+    def call(self, fn: str, arg: dict) -> dict:
+        callee = self.node("DeclRefExpr", type={"qualType": "long long (int)"},
+                           valueCategory="prvalue",
+                           referencedDecl={"id": "0x2", "kind": "FunctionDecl", "name": fn,
+                                           "type": {"qualType": "long long (int)"}})
+        decay = self.node("ImplicitCastExpr", [callee],
+                          type={"qualType": "long long (*)(int)"},
+                          valueCategory="prvalue", castKind="FunctionToPointerDecay")
+        return self.node("CallExpr", [decay, arg], type={"qualType": "long long"},
+                         valueCategory="prvalue")
+
+    def assign(self, var: str, value: dict) -> dict:
+        target = self.node("DeclRefExpr", type={"qualType": "int"}, valueCategory="lvalue",
+                           referencedDecl={"id": "0x3", "kind": "VarDecl", "name": var,
+                                           "type": {"qualType": "int"}})
+        return self.binop("=", target, value)
+
+    def task(self, var: str, value: dict) -> dict:
+        shared = self.node("OMPSharedClause", [
+            self.node("DeclRefExpr", type={"qualType": "int"}, valueCategory="lvalue",
+                      referencedDecl={"id": "0x3", "kind": "VarDecl", "name": var}),
+        ])
+        captured = self.node("CapturedStmt", [
+            self.node("CapturedDecl", [
+                self.assign(var, value),
+                self.node("ImplicitParamDecl", name="__context", isImplicit=True,
+                          type={"qualType": "struct (unnamed at fib.c:9:9) *const restrict"}),
+            ]),
+        ])
+        return self.node("OMPTaskDirective", [shared, captured])
+
+    def ret(self, value: dict) -> dict:
+        return self.node("ReturnStmt", [value])
+
+    def locals(self, names: typing.Iterable[str]) -> dict:
+        return self.node("DeclStmt", [
+            self.node("VarDecl", name=name, type={"qualType": "int"}, isUsed=True)
+            for name in names
+        ])
+
+    def function(self, name: str, body: typing.List[dict], param: str = "n") -> dict:
+        parm = self.node("ParmVarDecl", name=param, type={"qualType": "int"}, isUsed=True)
+        return self.node("FunctionDecl", [parm, self.node("CompoundStmt", body)],
+                         name=name, mangledName=name,
+                         type={"qualType": "long long (int)"})
+
+    def fib(self, name: str = "fib", tasks: int = 1) -> dict:
+        """fib.c, with ``tasks`` tasks spawned before the taskwait."""
+        names = [f"a{i}" for i in range(tasks)]
+        stmts = [
+            self.task(var, self.call(name, self.binop("-", self.ref("n"), self.lit(i + 1))))
+            for i, var in enumerate(names)
+        ]
+        stmts.append(self.assign("b", self.call(name, self.binop("-", self.ref("n"),
+                                                                 self.lit(tasks + 1)))))
+        stmts.append(self.node("OMPTaskwaitDirective"))
+        stmts.append(self.ret(self.binop("+", self.ref(names[-1], "VarDecl"),
+                                         self.ref("b", "VarDecl"))))
+        els = self.node("CompoundStmt", stmts)
+        base = self.ret(self.lit(1))
+        cond = self.binop("<=", self.ref("n"), self.lit(1))
+        body = [
+            self.locals(names + ["b"]),
+            self.node("IfStmt", [cond, base, els], hasElse=True),
+        ]
+        return self.function(name, body)
+
+    def header_decl(self, i: int) -> dict:
+        if i % 3 == 0:
+            parm = self.node("ParmVarDecl", name="__s", type={"qualType": "const char *"})
+            node = self.node("FunctionDecl", [parm], name=f"hfn{i}",
+                             type={"qualType": "int (const char *)"}, storageClass="extern")
+        elif i % 3 == 1:
+            node = self.node("TypedefDecl", [
+                self.node("BuiltinType", type={"qualType": "unsigned long"}),
+            ], name=f"t{i}", type={"qualType": "unsigned long"})
+        else:
+            node = self.node("RecordDecl", [
+                self.node("FieldDecl", name=f"f{j}", type={"qualType": "int"})
+                for j in range(8)
+            ], name=f"s{i}", tagUsed="struct", completeDefinition=True)
+        node["loc"] = {"offset": i, "file": _HEADER, "line": i + 1, "col": 1, "tokLen": 3,
+                       "includedFrom": {"file": _MAIN_FILE}}
+        return node
+
+    def unit(self, decls: typing.List[dict]) -> dict:
+        return {"id": "0x0", "kind": "TranslationUnitDecl", "loc": {}, "range": {},
+                "inner": decls}
+
+
+"""
+SHAPES
+"""
+
+def tasks(size: int) -> dict:
+    return _Builder().fib(tasks=size)
+
+
+def block(size: int) -> dict:
+    b = _Builder()
+    stmts = [b.locals(f"v{i}" for i in range(min(size, 8)))]
+    stmts += [
+        b.assign(f"v{i % 8}", b.binop("*", b.ref("n"), b.lit(i)))
+        for i in range(size)
+    ]
+    stmts.append(b.ret(b.ref("n")))
+    return b.function("block", stmts)
+
+
+def chain(size: int) -> dict:
+    b = _Builder()
+    expr = b.ref("n")
+    for i in range(size):
+        expr = b.binop("-" if i % 2 else "+", expr, b.lit(i))
+    return b.function("chain", [b.ret(expr)])
+
+
+def functions(size: int) -> dict:
+    b = _Builder()
+    return b.unit([b.fib(f"fib{i}") for i in range(size)])
+
+
+def headers(size: int) -> dict:
+    b = _Builder()
+    return b.unit([b.header_decl(i) for i in range(size)] + [b.fib()])
+
+
+SHAPES: typing.Dict[str, typing.Callable[[int], dict]] = {
+    "tasks": tasks,
+    "block": block,
+    "chain": chain,
+    "functions": functions,
+    "headers": headers,
+}
+
+
+"""
+OUTPUT
+"""
+
+def write_dump(doc: dict, fp: typing.TextIO) -> None:
+    """Write ``doc`` to ``fp`` laid out like clang's dump (indent 2).
+
+    Unlike json.dump this is iterative, so the deepest chains can be written.
+    """
+    out: typing.List[str] = []
+    # one entry per open container: its item iterator, whether it is an
+    # object, and whether an item has been written yet
+    stack: typing.List[list] = []
+    value: typing.Any = doc
+    indent = "\n"
+    while True:
+        if type(value) is dict or type(value) is list:
+            is_map = type(value) is dict
+            if value:
+                out.append("{" if is_map else "[")
+                indent += "  "
+                stack.append([iter(value.items() if is_map else value), is_map, False])
+            else:
+                out.append("{}" if is_map else "[]")
+        elif type(value) is str:
+            out.append(_encode_string(value))
+        else:
+            out.append(json.dumps(value))
+        # move on to the next value, closing exhausted containers
+        while stack:
+            top = stack[-1]
+            item = next(top[0], _END)
+            if item is _END:
+                stack.pop()
+                indent = indent[:-2]
+                out.append(indent + ("}" if top[1] else "]"))
+                continue
+            sep = "," + indent if top[2] else indent
+            top[2] = True
+            if top[1]:
+                key, value = item
+                out.append(sep + _encode_string(key) + ": ")
+            else:
+                value = item
+                out.append(sep)
+            break
+        else:
+            break
+        if len(out) > 1 << 12:
+            fp.write("".join(out))
+            out.clear()
+    out.append("\n")
+    fp.write("".join(out))
+
+
+_END = object()
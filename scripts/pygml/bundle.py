@@ -0,0 +1,108 @@
+"""
+convert_ast as a single precompiled zipapp, for the fastest start.
+
+    python -m pygml.bundle -o convert_ast.pyz
+    python3 convert_ast.pyz --skip-unsupported fib.c.json
+
+The archive holds convert_ast and pygml with their bytecode compiled ahead
+of time, as unchecked hash-based .pyc files, so nothing is compiled or
+stat'ed against its source when it starts.  The generated code of pygml.ast
+(see pygml.ast._gencache), for the style output is written in, and the
+converter version the conversion cache keys on are computed at build time
+as well.  Built with one Python, the archive still runs on another, only
+without those savings.
+
+gml runs the bundle named by $GML_CONVERT_BUNDLE instead of the scripts.
+"""
+import argparse
+import os
+import py_compile
+import shutil
+import sys
+import tempfile
+import typing
+import zipapp
+
+from . import ast, cache, jsonio
+
+
+BUNDLE_ENV = "GML_CONVERT_BUNDLE"
+
+_SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_MAIN = '''\
+# Generated by pygml.bundle.
+import pygml.cache
+
+# the sources it hashes are in this archive, where it cannot list them
+pygml.cache._version = {version!r}
+
+import convert_ast
+
+convert_ast.main()
+'''
+
+
+def _sources() -> typing.Iterator[str]:
+    """The files to bundle, relative to the scripts directory."""
+    yield "convert_ast.py"
+    for root, dirs, files in os.walk(os.path.join(_SCRIPTS_DIR, "pygml")):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+        for name in sorted(files):
+            if name.endswith(".py"):
+                yield os.path.relpath(os.path.join(root, name), _SCRIPTS_DIR)
+
+
+def _generated() -> typing.Dict[str, bytes]:
+    """The generated code of pygml.ast, made or read from the cache here."""
+    ast._jsonwriter._writer(jsonio.output_backend())
+    return dict(ast._gencache.GENERATED)
+
+
+def build(target: str, interpreter: typing.Optional[str] = "/usr/bin/env python3",
+          compressed: bool = False) -> None:
+    """Write the bundle to ``target``."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for rel in _sources():
+            dst = os.path.join(tmp, rel)
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copy2(os.path.join(_SCRIPTS_DIR, rel), dst)
+            # next to its source, where zipimport looks for it
+            py_compile.compile(dst, cfile=dst + "c", dfile=rel, doraise=True,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+        pycache = os.path.join(tmp, "pygml", "ast", "__pycache__")
+        for name, data in _generated().items():
+            os.makedirs(pycache, exist_ok=True)
+            with open(os.path.join(pycache, name), "wb") as f:
+                f.write(data)
+        with open(os.path.join(tmp, "__main__.py"), "w") as f:
+            f.write(_MAIN.format(version=cache.converter_version()))
+        zipapp.create_archive(tmp, target, interpreter, compressed=compressed)
+
+
+"""
+COMMAND LINE
+"""
+
+def main() -> None:
+    cfg = parse_args()
+    build(cfg.output, cfg.python or None, cfg.compress)
+    print(f"wrote {cfg.output}, {os.path.getsize(cfg.output) >> 10} KiB", file=sys.stderr)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m pygml.bundle", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", type=str, default="convert_ast.pyz",
+                        help="Where to write the bundle. Default: convert_ast.pyz")
+    parser.add_argument("--python", type=str, default="/usr/bin/env python3",
+                        help="Interpreter for the #! line, which makes the bundle "
+                             "executable; empty for none. Default: /usr/bin/env python3")
+    parser.add_argument("--compress", action="store_true",
+                        help="Deflate the members, which makes the bundle smaller "
+                             "but slower to start")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+Content-addressed on-disk cache of converted programs.
+
+Entries are keyed by the SHA-256 of the input dump together with a hash of
+the converter sources and the output format, so editing the converter
+invalidates everything it produced.  A hit returns the stored output without
+parsing the input.
+The store is capped in size and evicts least recently used entries; a hit
+refreshes the entry's mtime, which is what the eviction order goes by.  Its
+total size is kept up to date in stats.json, so only a store that takes it
+over the cap walks the entries.  The warnings a conversion printed about
+skipped functions are kept with its entry, to be printed again on a hit.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import typing
+
+
+DEFAULT_SIZE = 256 << 20
+
+CACHE_DIR_ENV = "PYGML_CACHE_DIR"
+
+# Sources whose contents decide what a dump converts to.
+_CONVERTER_SOURCES = ("ast", "convert.py", "incremental.py", "jsonio.py")
+
+_STATS_KEYS = ("hits", "misses", "stores", "evictions")
+
+
+def default_dir() -> str:
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "pygml")
+
+
+_version: typing.Optional[str] = None
+
+def converter_version() -> str:
+    """Hash of the converter sources, computed once per process."""
+    global _version
+    if _version is None:
+        root = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256()
+        for name in _CONVERTER_SOURCES:
+            path = os.path.join(root, name)
+            files = sorted(
+                os.path.join(path, f) for f in os.listdir(path) if f.endswith(".py")
+            ) if os.path.isdir(path) else [path]
+            for file in files:
+                h.update(os.path.relpath(file, root).encode() + b"\0")
+                with open(file, "rb") as f:
+                    h.update(f.read())
+        _version = h.hexdigest()
+    return _version
+
+
+def file_key(path: str, fmt: str = "json", chunk_size: int = 1 << 20) -> str:
+    """Cache key for the dump at ``path`` converted to ``fmt``.
+
+    ``fmt`` may carry options that change the output, e.g.
+    "json:skip-unsupported".
+    """
+    h = hashlib.sha256(converter_version().encode())
+    if fmt != "json":
+        h.update(fmt.encode() + b"\0")
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class Hit(typing.NamedTuple):
+    data: bytes
+    warnings: typing.List[str]
+
+
+class ConversionCache:
+    def __init__(self, root: typing.Optional[str] = None, max_size: int = DEFAULT_SIZE) -> None:
+        self.root = root or default_dir()
+        self.max_size = max_size
+        self.stats = dict.fromkeys(_STATS_KEYS, 0)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".conv")
+
+    @staticmethod
+    def _warnings_path(path: str) -> str:
+        return path[:-len(".conv")] + ".warnings"
+
+    def get(self, key: str) -> typing.Optional[Hit]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            self.stats["misses"] += 1
+            return None
+        try:
+            with open(self._warnings_path(path), "r") as f:
+                warnings = json.load(f)
+        except FileNotFoundError:
+            warnings = []
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(path)
+        self.stats["hits"] += 1
+        return Hit(data, warnings)
+
+    def put(self, key: str, data: bytes, warnings: typing.Sequence[str] = ()) -> None:
+        self._store(key, lambda f: f.write(data), warnings)
+
+    def put_file(self, key: str, src: typing.BinaryIO, warnings: typing.Sequence[str] = ()) -> None:
+        """:meth:`put` the rest of ``src``, copied over in chunks rather
+        than read whole."""
+        self._store(key, lambda f: shutil.copyfileobj(src, f), warnings)
+
+    def _write_temp(self, path: str, write: typing.Callable[[typing.BinaryIO], object]) -> typing.Tuple[str, int]:
+        """Write a file to be renamed to ``path``; return its name and size."""
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                return tmp, f.tell()
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def _store(self, key: str, write: typing.Callable[[typing.BinaryIO], object],
+               warnings: typing.Sequence[str]) -> None:
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so concurrent readers never see a partial entry;
+        # the warnings go first, so no reader sees the entry without them
+        if warnings:
+            text = json.dumps(list(warnings)).encode()
+            tmp, _ = self._write_temp(path, lambda f: f.write(text))
+            os.replace(tmp, self._warnings_path(path))
+        tmp, size = self._write_temp(path, write)
+        with self._locked_stats() as totals:
+            try:
+                replaced = os.stat(path).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+            if "size" in totals:
+                totals["size"] += size - replaced
+            else:
+                # a store from before the size was kept
+                totals["size"] = sum(n for _, n, _ in self._scan())
+            if totals["size"] > self.max_size:
+                totals["size"] = self._evict()
+        self.stats["stores"] += 1
+
+    def entries(self) -> typing.List[os.DirEntry]:
+        found = []
+        for shard in os.scandir(self.root):
+            if shard.is_dir():
+                found.extend(e for e in os.scandir(shard.path) if e.name.endswith(".conv"))
+        return found
+
+    def _scan(self) -> typing.List[typing.Tuple[int, int, str]]:
+        """(mtime, size, path) of every entry."""
+        found = []
+        for e in self.entries():
+            with contextlib.suppress(FileNotFoundError):
+                st = e.stat()
+                found.append((st.st_mtime_ns, st.st_size, e.path))
+        return found
+
+    def evict(self) -> None:
+        """Delete least recently used entries until the store fits its cap."""
+        with self._locked_stats() as totals:
+            totals["size"] = self._evict()
+
+    def _evict(self) -> int:
+        """:meth:`evict` with the stats locked; return the size left."""
+        entries = self._scan()
+        total = sum(n for _, n, _ in entries)
+        if total <= self.max_size:
+            return total
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(path)
+                self.stats["evictions"] += 1
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self._warnings_path(path))
+            total -= size
+        return total
+
+    def clear(self) -> None:
+        with self._locked_stats() as totals:
+            for e in self.entries():
+                for path in (e.path, self._warnings_path(e.path)):
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(path)
+            totals["size"] = 0
+
+    """
+    STATISTICS
+    """
+
+    @contextlib.contextmanager
+    def _locked_stats(self):
+        with open(os.path.join(self.root, "stats.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            path = os.path.join(self.root, "stats.json")
+            try:
+                with open(path, "r") as f:
+                    totals = json.load(f)
+            except (FileNotFoundError, ValueError):
+                totals = dict.fromkeys(_STATS_KEYS, 0)
+            yield totals
+            with open(path, "w") as f:
+                json.dump(totals, f)
+
+    def flush_stats(self) -> None:
+        """Add this process's counters to the totals kept in the store."""
+        if not any(self.stats.values()):
+            return
+        with self._locked_stats() as totals:
+            for k, v in self.stats.items():
+                totals[k] = totals.get(k, 0) + v
+        self.stats = dict.fromkeys(_STATS_KEYS, 0)
+
+    def summary(self) -> dict:
+        with self._locked_stats() as totals:
+            summary = dict(totals)
+        entries = self.entries()
+        summary["entries"] = len(entries)
+        summary["size"] = sum(e.stat().st_size for e in entries)
+        summary["max_size"] = self.max_size
+        return summary
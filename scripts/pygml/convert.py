@@ -0,0 +1,467 @@
+"""
+Conversion of one clang JSON AST dump into a GML .conv program
+
+A dump may hold a single function (clang's -ast-dump-filter) or a whole
+translation unit.  Each user function becomes one Decl; with several jobs
+the functions are spread over forked workers that share the parsed dump
+copy-on-write and send back only their encoded output.
+"""
+from __future__ import annotations
+
+import contextlib
+import gc
+import os
+import sys
+import typing
+
+from . import jsonio
+from .cache import ConversionCache, file_key
+from .memory import MemoryReport, choose_strategy, input_size, predict_peak
+
+if typing.TYPE_CHECKING:
+    # Functions import pygml.ast where they use it: building its node classes
+    # and codecs is most of what starting up costs, and a conversion served
+    # from the cache never needs them.
+    from . import ast
+
+
+# Output formats and the suffix their files get.  "json" is what the checker
+# reads; "binary" is the compact format of pygml.ast.encode_program_binary.
+SUFFIXES = {"json": ".conv", "binary": ".convb"}
+
+# Chunks of functions per worker, so uneven functions still balance out.
+_CHUNKS_PER_JOB = 4
+
+# What may be skipped when the converter cannot handle it: nothing (False),
+# any function (True), or only drivers (DRIVERS); see convert_function.
+Skip = typing.Union[bool, str]
+
+DRIVERS = "drivers"
+
+# Node kinds that make the function holding them a driver.
+_DRIVER_KINDS = frozenset(("OMPParallelDirective",))
+
+
+def read_functions(fp: typing.TextIO, stream: bool = True, prune: bool = True) -> typing.List[dict]:
+    """The FunctionDecls with a body in the clang dump read from ``fp``.
+
+    ``prune`` applies to the streaming reader only; see
+    :func:`pygml.ast.iter_function_decls`.
+    """
+    from . import ast
+    if not stream:
+        return list(ast.function_decls(jsonio.loads(fp.read())))
+    return list(ast.iter_function_decls(fp, prune=prune))
+
+
+def read_file(path: str, stream: bool = True, prune: bool = True) -> typing.List[dict]:
+    """:func:`read_functions` of the dump at ``path``, which may be compressed.
+
+    Without ``stream`` the dump is mapped into memory and decoded whole by the
+    JSON backend.
+    """
+    from . import ast
+    if not stream:
+        return list(ast.function_decls(jsonio.load(path)))
+    with jsonio.open_file(path) as f:
+        return read_functions(f, prune=prune)
+
+
+def is_driver(data: dict) -> bool:
+    """Whether the FunctionDecl ``data`` is a driver rather than a kernel:
+    ``main``, or a function that starts an OpenMP parallel region."""
+    if data.get("name") == "main":
+        return True
+    todo = [data]
+    while todo:
+        node = todo.pop()
+        if node.get("kind") in _DRIVER_KINDS:
+            return True
+        todo.extend(child for child in node.get("inner", ()) if child)
+    return False
+
+
+def convert_function(data: dict, skip_unsupported: Skip = False) -> typing.Tuple[ast.Prog, typing.Optional[str]]:
+    """Convert one FunctionDecl; return its Decls and, if it was skipped, why.
+
+    With ``skip_unsupported``, a function the converter cannot handle (such
+    as a ``main`` setting up the OpenMP runtime) converts to no Decls instead
+    of failing the whole conversion.  With :data:`DRIVERS`, only a driver
+    (see :func:`is_driver`) may be skipped; any other function still fails.
+    """
+    from . import ast
+    try:
+        return ast.convert_program(data), None
+    except Exception as e:
+        if not skip_unsupported or (skip_unsupported == DRIVERS and not is_driver(data)):
+            raise
+        return [], f"{type(e).__name__}: {e}"
+
+
+# Warnings printed while _recording_skips is active, or None.
+_skipped: typing.Optional[typing.List[str]] = None
+
+
+def warn_skipped(data: dict, error: str) -> None:
+    warning = f"skipping function {data.get('name')}: {error}"
+    print(warning, file=sys.stderr)
+    if _skipped is not None:
+        _skipped.append(warning)
+
+
+@contextlib.contextmanager
+def _recording_skips() -> typing.Iterator[typing.List[str]]:
+    """Collect the warnings :func:`warn_skipped` prints, to be cached with
+    the output they came with."""
+    global _skipped
+    outer, _skipped = _skipped, []
+    try:
+        yield _skipped
+    finally:
+        _skipped = outer
+
+
+def convert_functions(functions: typing.Iterable[dict], skip_unsupported: Skip = False) -> ast.Prog:
+    """Convert each FunctionDecl into a Decl, warning on stderr about any
+    skipped; see :func:`convert_function`."""
+    prog = []
+    for data in functions:
+        decls, error = convert_function(data, skip_unsupported)
+        if error is not None:
+            warn_skipped(data, error)
+        prog += decls
+    return prog
+
+
+def load_program(
+    fp: typing.TextIO,
+    stream: bool = True,
+    prune: bool = True,
+    skip_unsupported: Skip = False,
+) -> ast.Prog:
+    """Convert the clang dump read from ``fp`` into a program."""
+    return convert_functions(read_functions(fp, stream, prune), skip_unsupported)
+
+
+def dump_program(prog: ast.Prog, fmt: str = "json") -> bytes:
+    from . import ast
+    if fmt == "binary":
+        return ast.encode_program_binary(prog)
+    if fmt == "json":
+        return join_encoded([([_dump_decl(d) for d in prog], None)])
+    raise ValueError("unknown output format", fmt)
+
+
+def _json_pieces(decl: ast.Decl) -> typing.Iterable[str]:
+    """The JSON text of ``decl``, as ``json.dumps(ast.encode_decl(decl))``
+    gives it, in pieces; see :func:`pygml.ast.iter_decl_json`.
+
+    The text is in the style of :func:`pygml.jsonio.output_backend` whatever
+    the JSON backend, so the output does not depend on which is installed.
+    """
+    from . import ast
+    return ast.iter_decl_json(decl, jsonio.output_backend())
+
+
+def _dump_decl(decl: ast.Decl) -> str:
+    return "".join(_json_pieces(decl))
+
+
+def _write_decl(decl: ast.Decl, out: typing.BinaryIO) -> None:
+    for piece in _json_pieces(decl):
+        out.write(piece.encode())
+
+
+"""
+PARALLEL CONVERSION
+"""
+
+# What a function converts to, as each Decl's JSON text, and why it was
+# skipped if it was.
+Encoded = typing.Tuple[typing.List[str], typing.Optional[str]]
+
+# The parsed functions, inherited by forked workers.
+_functions: typing.List[dict] = []
+
+
+def _encode_chunk(functions: typing.List[dict], fmt: str, skip_unsupported: Skip):
+    """Convert ``functions``; for "json" give an :data:`Encoded` per function,
+    for "binary" the whole chunk as one binary program."""
+    if fmt == "json":
+        results = []
+        for data in functions:
+            decls, error = convert_function(data, skip_unsupported)
+            results.append(([_dump_decl(d) for d in decls], error))
+        return results
+    return dump_program(convert_functions(functions, skip_unsupported), fmt)
+
+
+def _pool_task(task: typing.Tuple[int, int, str, Skip]):
+    lo, hi, fmt, skip_unsupported = task
+    return _encode_chunk(_functions[lo:hi], fmt, skip_unsupported)
+
+
+def _map_chunks(functions: typing.List[dict], fmt: str, jobs: int, skip_unsupported: Skip) -> list:
+    """:func:`_encode_chunk` over ``functions``, one result per chunk.
+
+    With ``jobs`` > 1, where fork is available, chunks go to a pool of forked
+    workers.  They inherit ``functions`` instead of receiving a pickled copy
+    and send back only encoded output.
+    """
+    import multiprocessing  # only here, to keep it off the startup path
+    if (jobs <= 1 or len(functions) < 2
+            or "fork" not in multiprocessing.get_all_start_methods()):
+        return [_encode_chunk(functions, fmt, skip_unsupported)]
+
+    global _functions
+    jobs = min(jobs, len(functions))
+    step = -(-len(functions) // (jobs * _CHUNKS_PER_JOB))
+    tasks = [
+        (lo, min(lo + step, len(functions)), fmt, skip_unsupported)
+        for lo in range(0, len(functions), step)
+    ]
+    _functions = functions
+    # keep the collector from writing to, and so copying, the shared pages
+    gc.freeze()
+    try:
+        with multiprocessing.get_context("fork").Pool(jobs) as pool:
+            return pool.map(_pool_task, tasks, chunksize=1)
+    finally:
+        gc.unfreeze()
+        _functions = []
+
+
+def encode_functions(
+    functions: typing.List[dict],
+    jobs: int = 1,
+    skip_unsupported: Skip = False,
+) -> typing.List[Encoded]:
+    """Convert ``functions`` and JSON-encode each one's Decls, in order."""
+    results = [r for part in _map_chunks(functions, "json", jobs, skip_unsupported) for r in part]
+    for data, (_, error) in zip(functions, results):
+        if error is not None:
+            warn_skipped(data, error)
+    return results
+
+
+def join_encoded(results: typing.Iterable[Encoded], fmt: str = "json") -> bytes:
+    """The program made of the encoded functions ``results``, in ``fmt``."""
+    from . import ast
+    texts = [text for decls, _ in results for text in decls]
+    if fmt == "json":
+        return ("[" + jsonio.output_backend().separator.join(texts) + "]").encode()
+    return dump_program([ast.decode_decl(jsonio.loads(text)) for text in texts], fmt)
+
+
+def dump_functions(
+    functions: typing.List[dict],
+    fmt: str = "json",
+    jobs: int = 1,
+    skip_unsupported: Skip = False,
+) -> bytes:
+    """Convert ``functions`` and encode them as one program in ``fmt``.
+
+    The output is that of ``dump_program(convert_functions(...))`` for any
+    ``jobs``.  Binary chunks from workers are merged by decoding them, since
+    each carries its own string table.
+    """
+    from . import ast
+    if fmt not in SUFFIXES:
+        raise ValueError("unknown output format", fmt)
+    if fmt == "json":
+        return join_encoded(encode_functions(functions, jobs, skip_unsupported))
+    parts = _map_chunks(functions, fmt, jobs, skip_unsupported)
+    if len(parts) == 1:
+        return parts[0]
+    prog = [decl for part in parts for decl in ast.decode_program_binary(part)]
+    return dump_program(prog, fmt)
+
+
+def output_options(fmt: str = "json", skip_unsupported: Skip = False) -> str:
+    """``fmt`` with the options that change the output's bytes, such as
+    "json:skip-unsupported" or "json:skip-drivers"."""
+    options = fmt
+    if skip_unsupported == DRIVERS:
+        options += ":skip-drivers"
+    elif skip_unsupported:
+        options += ":skip-unsupported"
+    return options
+
+
+"""
+LOW-MEMORY CONVERSION
+"""
+
+def write_functions(
+    functions: typing.Iterable[dict],
+    out: typing.BinaryIO,
+    fmt: str = "json",
+    skip_unsupported: Skip = False,
+) -> None:
+    """Convert ``functions`` one at a time and write the program to ``out``.
+
+    For "json" each Decl is written out piece by piece as it is encoded,
+    with no encoded copy of it in between (see :func:`pygml.ast.iter_decl_json`);
+    "binary", whose string table covers the whole program, keeps the Decls
+    to the end.  A
+    FunctionDecl is let go once it is converted, so with a lazy iterator such
+    as :func:`pygml.ast.iter_function_decls` only one is ever held.  The
+    output is that of :func:`dump_functions`.
+    """
+    separator = jsonio.output_backend().separator.encode()
+    prog: ast.Prog = []
+    head = b"["
+    for data in functions:
+        decls, error = convert_function(data, skip_unsupported)
+        if error is not None:
+            warn_skipped(data, error)
+        # or it stays alive while the next function is read
+        del data
+        if fmt != "json":
+            prog += decls
+            continue
+        for decl in decls:
+            out.write(head)
+            _write_decl(decl, out)
+            head = separator
+    if fmt == "json":
+        out.write(b"[]" if head == b"[" else b"]")
+    else:
+        out.write(dump_program(prog, fmt))
+
+
+def _write_file(functions: typing.Iterable[dict], dst: str, fmt: str, skip_unsupported: Skip) -> None:
+    """:func:`write_functions` to ``dst``, which is replaced only once it
+    is complete."""
+    suffix = jsonio.COMPRESSIONS.get(jsonio.output_compression(dst) or "", "")
+    fd, tmp = jsonio.create_temp(dst, ".tmp" + suffix)
+    os.close(fd)
+    try:
+        with jsonio.open_file(tmp, "wb") as out:
+            write_functions(functions, out, fmt, skip_unsupported)
+        os.replace(tmp, dst)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _convert_low_memory(src: str, dst: str, fmt: str, skip_unsupported: Skip) -> None:
+    """:func:`_write_file` from the dump at ``src``, read function by
+    function."""
+    from . import ast
+    with jsonio.open_file(src) as f:
+        _write_file(ast.iter_function_decls(f), dst, fmt, skip_unsupported)
+
+
+def _convert_staged(src: str, dst: str, stream: bool, fmt: str, skip_unsupported: Skip,
+                    memory: MemoryReport) -> bytes:
+    """Convert ``src`` to ``dst`` as :func:`convert_file` does, one stage
+    after the other so that ``memory`` can tell them apart; return the
+    output."""
+    with memory.stage("load"):
+        functions = read_file(src, stream)
+    with memory.stage("convert"):
+        prog = convert_functions(functions, skip_unsupported)
+        del functions
+    with memory.stage("encode"):
+        if fmt == "json":
+            texts = [_dump_decl(d) for d in prog]
+        else:
+            data = dump_program(prog, fmt)
+        del prog
+    with memory.stage("dump"):
+        if fmt == "json":
+            data = join_encoded([(texts, None)])
+            del texts
+        jsonio.write_bytes(dst, data)
+    return data
+
+
+def convert_file(
+    src: str,
+    dst: str,
+    stream: bool = True,
+    cache: typing.Optional[ConversionCache] = None,
+    fmt: str = "json",
+    jobs: int = 1,
+    skip_unsupported: Skip = False,
+    incremental: bool = False,
+    max_memory: typing.Optional[int] = None,
+    memory: typing.Optional[MemoryReport] = None,
+) -> bool:
+    """Convert the clang dump at ``src`` and write the encoded program to ``dst``.
+
+    Either file may be compressed; see :mod:`pygml.jsonio`.  With
+    ``incremental``, only functions that changed since the last incremental
+    conversion to ``dst`` are converted; see :mod:`pygml.incremental`.
+
+    A conversion predicted to take more than ``max_memory`` bytes switches
+    to a leaner strategy, down to converting and writing one function at a
+    time, which leaves any incremental state as it was; see
+    :mod:`pygml.memory`.  ``memory`` gets the resident memory of each stage,
+    which then run one after the other in this process.  Returns whether
+    the result came from ``cache``; a hit prints again any warnings about
+    skipped functions that the conversion it came from printed.
+    """
+    key = None
+    if cache is not None:
+        key = file_key(src, output_options(fmt, skip_unsupported))
+        hit = cache.get(key)
+        if hit is not None:
+            for warning in hit.warnings:
+                print(warning, file=sys.stderr)
+            jsonio.write_bytes(dst, hit.data)
+            return True
+
+    with _recording_skips() as skipped:
+        data = _convert(src, dst, stream, fmt, jobs, skip_unsupported, incremental, max_memory, memory)
+    if cache is not None:
+        if data is None:
+            # written straight to dst, so copied in from there
+            with jsonio.open_file(dst, "rb") as f:
+                cache.put_file(key, f, skipped)
+        else:
+            cache.put(key, data, skipped)
+    return False
+
+
+def _convert(src: str, dst: str, stream: bool, fmt: str, jobs: int, skip_unsupported: Skip,
+             incremental: bool, max_memory: typing.Optional[int],
+             memory: typing.Optional[MemoryReport]) -> typing.Optional[bytes]:
+    """:func:`convert_file` less the cache; return the output, or None if it
+    was written to ``dst`` without ever being whole."""
+    strategy = "stream" if stream else "whole"
+    if max_memory is not None:
+        size = input_size(src)
+        chosen = choose_strategy(size, strategy, max_memory)
+        if chosen != strategy:
+            print(f"{src}: {size / 2**20:.0f} MiB dump, predicted to take "
+                  f"{predict_peak(size, strategy) / 2**20:.0f} MiB converting {strategy}; "
+                  f"converting {chosen} to stay under {max_memory / 2**20:.0f} MiB",
+                  file=sys.stderr)
+            strategy = chosen
+    if memory is not None:
+        memory.strategy = strategy
+
+    if strategy == "low":
+        with memory.stage("stream") if memory is not None else contextlib.nullcontext():
+            _convert_low_memory(src, dst, fmt, skip_unsupported)
+        return None
+
+    stream = strategy == "stream"
+    if memory is not None and not incremental:
+        return _convert_staged(src, dst, stream, fmt, skip_unsupported, memory)
+    if not incremental and jobs <= 1:
+        # nothing needs the output whole, so it goes straight to the file
+        _write_file(read_file(src, stream), dst, fmt, skip_unsupported)
+        return None
+    functions = read_file(src, stream)
+    if incremental:
+        from .incremental import dump_incremental, state_path
+        data = dump_incremental(functions, state_path(dst), fmt, jobs, skip_unsupported,
+                                pruned=stream).data
+    else:
+        data = dump_functions(functions, fmt, jobs, skip_unsupported)
+    del functions
+    jsonio.write_bytes(dst, data)
+    return data
@@ -0,0 +1,177 @@
+"""
+Incremental reconversion: only functions that changed are converted again.
+
+Next to the output, FILE.conv.functions records a fingerprint of every
+function's FunctionDecl subtree together with its encoded Decls.  A
+fingerprint covers only the keys the converter reads, so the ids and source
+locations that shift whenever something earlier in the file is edited do not
+count.  The next run still reads the whole dump, but converts only the
+functions whose fingerprint it has not seen and splices the stored Decls in
+for the rest; the output is byte-identical to a full conversion.
+"""
+import hashlib
+import json
+import os
+import typing
+
+from . import jsonio
+from .cache import converter_version
+from .convert import Encoded, Skip, encode_functions, join_encoded, output_options, warn_skipped
+
+
+STATE_SUFFIX = ".functions"
+
+STATE_VERSION = 1
+
+_encode_string = json.encoder.encode_basestring_ascii  # type: ignore[attr-defined]
+
+_CONSTANTS = {True: "true", False: "false", None: "null"}
+
+
+def _canonical(data: dict) -> str:
+    """``json.dumps(data, sort_keys=True, separators=(",", ":"))`` restricted
+    to the converter's keys, without recursion."""
+    from . import ast
+    # the converter's keys, in the order json.dumps(sort_keys=True) puts them
+    order = sorted(ast.KEPT_KEYS)
+    parts: typing.List[str] = []
+    # a tuple holds text to emit as is
+    todo: typing.List[typing.Any] = [data]
+    while todo:
+        x = todo.pop()
+        t = type(x)
+        if t is tuple:
+            parts.append(x[0])
+        elif t is dict:
+            keys = [key for key in order if key in x]
+            parts.append("{")
+            todo.append(("}",))
+            for i in range(len(keys) - 1, -1, -1):
+                todo.append(x[keys[i]])
+                todo.append((("," if i else "") + _encode_string(keys[i]) + ":",))
+        elif t is list:
+            parts.append("[")
+            todo.append(("]",))
+            for i in range(len(x) - 1, -1, -1):
+                todo.append(x[i])
+                if i:
+                    todo.append((",",))
+        elif t is str:
+            parts.append(_encode_string(x))
+        elif t is bool or x is None:
+            parts.append(_CONSTANTS[x])
+        else:
+            parts.append(repr(x))
+    return "".join(parts)
+
+
+def fingerprint(data: dict, pruned: bool = False) -> str:
+    """Hash of the converter-visible content of the clang subtree ``data``.
+
+    A tree ``pruned`` while streaming holds only the converter's keys already,
+    so unless it is too deep, the json module can serialize it directly.
+    """
+    text = None
+    if pruned:
+        try:
+            text = json.dumps(data, sort_keys=True, separators=(",", ":"), check_circular=False)
+        except RecursionError:
+            pass
+    if text is None:
+        text = _canonical(data)
+    return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+
+"""
+STATE
+"""
+
+def state_path(dst: str) -> str:
+    return dst + STATE_SUFFIX
+
+
+def _header(skip_unsupported: Skip) -> dict:
+    return {
+        "version": STATE_VERSION,
+        "converter": converter_version(),
+        # the Decl texts are JSON whatever the output format
+        "options": output_options("json", skip_unsupported),
+    }
+
+
+def load_state(path: str, skip_unsupported: Skip = False) -> typing.Dict[str, Encoded]:
+    """The functions recorded at ``path`` by fingerprint.
+
+    A missing or unreadable state, or one written by another converter
+    version or with other options, is empty.
+    """
+    try:
+        state = jsonio.load(path)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(state, dict) or state.get("header") != _header(skip_unsupported):
+        return {}
+    return {fp: (entry["decls"], entry["skipped"]) for fp, entry in state["functions"].items()}
+
+
+def save_state(path: str, functions: typing.Dict[str, Encoded], skip_unsupported: Skip = False) -> None:
+    state = {
+        "header": _header(skip_unsupported),
+        "functions": {
+            fp: {"decls": decls, "skipped": skipped}
+            for fp, (decls, skipped) in functions.items()
+        },
+    }
+    fd, tmp = jsonio.create_temp(path)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(jsonio.dumps(state))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+"""
+CONVERSION
+"""
+
+class Result(typing.NamedTuple):
+    data: bytes
+    reused: int
+    converted: int
+
+
+def dump_incremental(
+    functions: typing.List[dict],
+    path: str,
+    fmt: str = "json",
+    jobs: int = 1,
+    skip_unsupported: Skip = False,
+    pruned: bool = False,
+) -> Result:
+    """Like :func:`pygml.convert.dump_functions`, reusing and then updating
+    the state at ``path``.
+
+    The state keeps only the functions of this run.  ``pruned`` says
+    ``functions`` come from the pruning streaming reader; see
+    :func:`fingerprint`.
+    """
+    previous = load_state(path, skip_unsupported)
+    fps = [fingerprint(data, pruned) for data in functions]
+    todo = {}
+    for fp, data in zip(fps, functions):
+        if fp not in previous:
+            todo.setdefault(fp, data)
+
+    current = dict(zip(todo, encode_functions(list(todo.values()), jobs, skip_unsupported)))
+    for fp, data in zip(fps, functions):
+        if fp not in current:
+            current[fp] = previous[fp]
+            if previous[fp][1] is not None:
+                warn_skipped(data, previous[fp][1])
+
+    data = join_encoded([current[fp] for fp in fps], fmt)
+    if todo or len(current) != len(previous):
+        save_state(path, current, skip_unsupported)
+    return Result(data, len(functions) - len(todo), len(todo))
@@ -0,0 +1,268 @@
+"""
+File and JSON I/O for clang dumps and converted programs.
+
+Files may be compressed: gzip or zstd input is recognized by its magic bytes,
+and output is compressed when its name ends in ".gz" or ".zst".  zstd needs
+the zstandard package (or Python's compression.zstd).
+
+Whole documents are decoded by the fastest JSON backend installed, orjson if
+present, else the standard library.  $PYGML_JSON_BACKEND picks one by name.
+orjson decodes a file straight from its memory map; the standard library
+needs bytes, so for it the file is read instead, since a map would only be
+copied.  A backend that cannot handle a document, for example
+because it nests deeper than the backend allows, falls back to the standard
+library, so the choice changes speed but never what can be read.
+
+Backends differ in whitespace: orjson writes compact JSON.  Converted programs
+are therefore always written in the standard library's style (see
+:func:`output_backend`), so their bytes never depend on what is installed.
+"""
+import contextlib
+import gzip
+import importlib.util
+import json
+import mmap
+import os
+import typing
+
+
+JSON_BACKEND_ENV = "PYGML_JSON_BACKEND"
+
+# Output compression by file name suffix.
+COMPRESSIONS = {"gzip": ".gz", "zstd": ".zst"}
+
+_MAGIC = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+
+
+class Backend(typing.NamedTuple):
+    name: str
+    loads: typing.Callable[[typing.Any], typing.Any]
+    dumps: typing.Callable[[typing.Any], bytes]
+    # what dumps puts between the items of a list, and between a key and
+    # its value
+    separator: str
+    colon: str
+    # whether dumps escapes characters outside ASCII
+    ensure_ascii: bool
+    # raised for documents the backend cannot handle
+    errors: typing.Tuple[typing.Type[BaseException], ...]
+    # the deepest nesting of lists and dicts dumps writes, if it is limited
+    max_depth: typing.Optional[int]
+
+
+def _stdlib_dumps(obj) -> bytes:
+    return json.dumps(obj).encode()
+
+
+def _stdlib() -> Backend:
+    return Backend("stdlib", json.loads, _stdlib_dumps, ", ", ": ", True, (), None)
+
+
+def _orjson() -> Backend:
+    import orjson
+    return Backend("orjson", orjson.loads, orjson.dumps, ",", ":", False,
+                   (orjson.JSONDecodeError, orjson.JSONEncodeError), 255)
+
+
+class _Backends(typing.Mapping[str, Backend]):
+    """The installed backends by name.  Each is imported when it is first
+    looked up, so code that only needs the names, such as a cache hit,
+    never pays for importing the library."""
+
+    def __init__(self, makers: typing.Dict[str, typing.Callable[[], Backend]]) -> None:
+        self._makers = makers
+        self._made: typing.Dict[str, Backend] = {}
+
+    def __getitem__(self, name: str) -> Backend:
+        backend = self._made.get(name)
+        if backend is None:
+            backend = self._made[name] = self._makers[name]()
+        return backend
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._makers
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._makers)
+
+    def __len__(self) -> int:
+        return len(self._makers)
+
+
+BACKENDS: typing.Mapping[str, Backend] = _Backends({
+    "stdlib": _stdlib,
+    **({"orjson": _orjson} if importlib.util.find_spec("orjson") is not None else {}),
+})
+
+# Backends in order of preference.
+_PREFERENCE = ("orjson", "stdlib")
+
+
+"""
+JSON
+"""
+
+def backend_name(name: typing.Optional[str] = None) -> str:
+    """The name of the backend :func:`get_backend` gives, without importing it."""
+    if name is None:
+        name = os.environ.get(JSON_BACKEND_ENV) or next(n for n in _PREFERENCE if n in BACKENDS)
+    if name not in BACKENDS:
+        raise ValueError("JSON backend not available", name)
+    return name
+
+
+def get_backend(name: typing.Optional[str] = None) -> Backend:
+    """The backend called ``name``, by default $PYGML_JSON_BACKEND or the
+    fastest installed."""
+    return BACKENDS[backend_name(name)]
+
+
+def output_backend() -> Backend:
+    """The backend whose style .conv output is written in: the standard
+    library's, whatever $PYGML_JSON_BACKEND says."""
+    return BACKENDS["stdlib"]
+
+
+def loads(data, backend: typing.Optional[Backend] = None):
+    """Decode ``data``: str, bytes or any buffer such as an mmap.
+
+    Only orjson decodes a buffer in place; for the standard library, and
+    for a document orjson gives up on, it is first copied into bytes.
+    """
+    if backend is None:
+        backend = get_backend()
+    if backend.name != "stdlib":
+        try:
+            return backend.loads(data)
+        except backend.errors:
+            pass
+    if not isinstance(data, (str, bytes, bytearray)):
+        data = bytes(data)
+    return json.loads(data)
+
+
+def dumps(obj, backend: typing.Optional[Backend] = None) -> bytes:
+    if backend is None:
+        backend = get_backend()
+    try:
+        return backend.dumps(obj)
+    except backend.errors:
+        return _stdlib_dumps(obj)
+
+
+"""
+FILES
+"""
+
+def _zstd():
+    try:
+        from compression import zstd  # type: ignore[import-not-found]
+    except ImportError:
+        try:
+            import zstandard as zstd  # type: ignore[import-not-found,no-redef]
+        except ImportError:
+            raise ImportError("zstd files need the zstandard package") from None
+    return zstd
+
+
+def available_compressions() -> typing.List[str]:
+    names = ["gzip"]
+    try:
+        _zstd()
+    except ImportError:
+        pass
+    else:
+        names.append("zstd")
+    return names
+
+
+def compression(path: str) -> typing.Optional[str]:
+    """The compression of the file at ``path`` going by its first bytes."""
+    with open(path, "rb") as f:
+        head = f.read(4)
+    return _MAGIC.get(head[:2]) or _MAGIC.get(head)
+
+
+def output_compression(path: str) -> typing.Optional[str]:
+    """The compression output to ``path`` gets going by its name."""
+    for name, suffix in COMPRESSIONS.items():
+        if path.endswith(suffix):
+            return name
+    return None
+
+
+def strip_compression(path: str) -> str:
+    """``path`` without a compression suffix."""
+    method = output_compression(path)
+    return path[:-len(COMPRESSIONS[method])] if method else path
+
+
+def open_file(path: str, mode: str = "r") -> typing.IO:
+    """Open ``path`` like ``open``, decompressing what is read and compressing
+    what is written as the file calls for.  Text is UTF-8."""
+    if "r" in mode:
+        method = compression(path)
+    else:
+        method = output_compression(path)
+    encoding = None if "b" in mode else "utf-8"
+    if method is None:
+        return open(path, mode, encoding=encoding)
+    if "b" not in mode and "t" not in mode:
+        mode += "t"
+    if method == "gzip":
+        return gzip.open(path, mode, encoding=encoding)
+    return _zstd().open(path, mode, encoding=encoding)
+
+
+@contextlib.contextmanager
+def mapped(path: str) -> typing.Iterator[typing.Any]:
+    """The contents of ``path`` as a buffer: the file mapped into memory, or
+    its decompressed bytes."""
+    if compression(path) is not None:
+        with open_file(path, "rb") as f:
+            yield f.read()
+        return
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def load(path: str, backend: typing.Optional[Backend] = None):
+    """Decode the JSON document at ``path``, mapped into memory for orjson
+    and read for the standard library."""
+    if backend is None:
+        backend = get_backend()
+    if backend.name == "stdlib":
+        with open_file(path, "rb") as f:
+            return json.loads(f.read())
+    with mapped(path) as data:
+        return loads(data, backend)
+
+
+def create_temp(path: str, suffix: str = ".tmp") -> typing.Tuple[int, str]:
+    """Create a new empty file next to ``path`` to be renamed over it; return
+    its descriptor, open for writing, and its name.
+
+    Unlike with tempfile.mkstemp, whose files are private, the file gets the
+    mode ``open`` would give ``path``, so what replaces ``path`` follows the
+    umask.
+    """
+    directory, name = os.path.split(os.path.abspath(path))
+    while True:
+        tmp = os.path.join(directory, f".{name}.{os.urandom(4).hex()}{suffix}")
+        try:
+            return os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666), tmp
+        except FileExistsError:
+            continue
+
+
+def write_bytes(path: str, data: bytes) -> None:
+    with open_file(path, "wb") as f:
+        f.write(data)
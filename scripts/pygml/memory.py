@@ -0,0 +1,170 @@
+"""
+Memory use of a conversion: measured per stage, and predicted from the input
+size so that a conversion bound to overrun a budget can pick a leaner way.
+
+The ways to convert a dump, from the hungriest to the leanest:
+
+    whole   decode the dump at once (--no-stream): about 4x its size
+    stream  materialize only its FunctionDecls, pruned to the keys the
+            converter reads: well under the dump's size
+    low     stream one function at a time, freeing each FunctionDecl once
+            it is converted and writing each Decl out as soon as it is
+            encoded: little beyond the interpreter, whatever the input
+
+Memory is the process's resident set.  Where Linux allows it, the peak is
+reset as each stage starts (/proc/self/clear_refs), so every stage reports
+its own; elsewhere a stage reports the high-water mark reached by its end.
+"""
+import contextlib
+import os
+import resource
+import struct
+import sys
+import typing
+
+from . import jsonio
+
+
+STRATEGIES = ("whole", "stream", "low")
+
+# Predicted peak resident memory: _BASE plus so many bytes per byte of the
+# (uncompressed) dump.  Measured on synthetic dumps of 14-460 MB, over an
+# interpreter of about 21 MiB: whole took 3.9-4.2x, stream 0.4-0.7x.
+_BASE = 32 << 20
+_PER_INPUT_BYTE = {"whole": 4.5, "stream": 0.75, "low": 0.0}
+
+# Assumed when a compressed file does not record its uncompressed size.
+_COMPRESSION_RATIO = 12
+
+
+"""
+MEASUREMENT
+"""
+
+def _status() -> typing.Dict[str, int]:
+    """VmRSS and VmHWM from /proc/self/status, in bytes."""
+    values = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS:", "VmHWM:")):
+                key, value = line.split(":")
+                values[key] = int(value.split()[0]) << 10
+    return values
+
+
+def _maxrss() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak << 10
+
+
+def current_rss() -> typing.Optional[int]:
+    try:
+        return _status()["VmRSS"]
+    except (OSError, KeyError):
+        return None
+
+
+def peak_rss() -> int:
+    try:
+        return _status()["VmHWM"]
+    except (OSError, KeyError):
+        return _maxrss()
+
+
+def reset_peak() -> bool:
+    """Lower the recorded peak to the current resident set, if the system
+    lets us; return whether it did."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return True
+
+
+class MemoryReport:
+    """Peak and remaining resident memory of each stage of a conversion."""
+
+    def __init__(self) -> None:
+        # stage -> [peak, current at its end]
+        self.stages: typing.Dict[str, typing.List[typing.Optional[int]]] = {}
+        # whether each stage's peak is its own rather than the run's so far
+        self.per_stage = True
+        self.strategy: typing.Optional[str] = None
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> typing.Iterator[None]:
+        self.per_stage = reset_peak() and self.per_stage
+        try:
+            yield
+        finally:
+            self.stages[name] = [peak_rss(), current_rss()]
+
+    def report(self) -> dict:
+        return {
+            "strategy": self.strategy,
+            "per_stage": self.per_stage,
+            "stages": {name: {"peak": peak, "current": current}
+                       for name, (peak, current) in self.stages.items()},
+        }
+
+    def format(self) -> str:
+        lines = [f"memory ({self.strategy or 'default'}), "
+                 + ("peak per stage" if self.per_stage else "peak so far after each stage")]
+        lines.append(f"  {'stage':<10} {'peak MiB':>10} {'end MiB':>10}")
+        for name, (peak, current) in self.stages.items():
+            end = "?" if current is None else f"{current / 2**20:.1f}"
+            lines.append(f"  {name:<10} {peak / 2**20:>10.1f} {end:>10}")
+        return "\n".join(lines)
+
+
+"""
+PREDICTION
+"""
+
+def input_size(path: str) -> int:
+    """Uncompressed size of the file at ``path``, estimated if it is
+    compressed with zstd and its frame does not record it."""
+    size = os.path.getsize(path)
+    method = jsonio.compression(path)
+    if method is None:
+        return size
+    if method == "gzip" and size >= 4:
+        # the trailer holds the size modulo 2**32; a single member file
+        # compresses well below that ratio, so take the smallest fit
+        with open(path, "rb") as f:
+            f.seek(-4, os.SEEK_END)
+            isize, = struct.unpack("<I", f.read(4))
+        while isize < size:
+            isize += 1 << 32
+        return isize
+    if method == "zstd":
+        with open(path, "rb") as f:
+            head = f.read(18)
+        try:
+            zstd = jsonio._zstd()
+            if hasattr(zstd, "get_frame_parameters"):
+                content = zstd.get_frame_parameters(head).content_size
+            else:
+                content = zstd.get_frame_info(head).decompressed_size
+        except Exception:
+            # no zstd module, or a header it cannot read
+            content = None
+        if content is not None and 0 < content < 1 << 62:
+            return content
+    return size * _COMPRESSION_RATIO
+
+
+def predict_peak(size: int, strategy: str) -> int:
+    """Expected peak resident memory converting a dump of ``size`` bytes."""
+    return _BASE + int(_PER_INPUT_BYTE[strategy] * size)
+
+
+def choose_strategy(size: int, preferred: str, budget: int) -> str:
+    """``preferred``, or the first leaner strategy predicted to stay within
+    ``budget`` bytes; "low" if none is."""
+    for strategy in STRATEGIES[STRATEGIES.index(preferred):]:
+        if predict_peak(size, strategy) <= budget:
+            return strategy
+    return "low"
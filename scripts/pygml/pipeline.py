@@ -0,0 +1,279 @@
+"""
+clang to .conv in one process, with no intermediate files.
+
+    python -m pygml.pipeline fib.c > fib.c.json.conv
+    python -m pygml.pipeline fib.c -o fib.c.json.conv --stats
+
+clang runs as a subprocess and its JSON dump is read straight off its stdout
+while it is being written.  Each function is converted as soon as it has been
+read and its Decls are written out at once, so the dump never touches the
+disk and the program is never held whole (except for --format binary, whose
+string table covers the whole program).  The output is byte for byte what
+convert_ast writes for the same dump with --skip-unsupported or --skip-drivers
+as given.
+
+With --stats the wall time and bytes of each stage go to stderr:
+
+    clang    waiting on clang's output; bytes it wrote
+    read     parsing the dump into FunctionDecls; bytes and functions read
+    convert  converting them; Decls made
+    encode   encoding the Decls; bytes of output
+    write    writing the output, compressing it if asked to; bytes written
+
+The stages take turns in one thread, so their times add up to the total.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import typing
+
+from . import ast, jsonio
+from .convert import DRIVERS, SUFFIXES, Skip, _dump_decl, convert_function, dump_program, warn_skipped
+
+
+# What main.ml runs clang with, less the file name.
+CLANG_COMMAND = ("clang", "-fopenmp", "-fno-color-diagnostics",
+                 "-Xclang", "-ast-dump=json", "-fsyntax-only")
+
+PIPELINE_STAGES = ("clang", "read", "convert", "encode", "write")
+
+
+class Stats:
+    """Wall time, bytes and items per stage of one pipeline run."""
+
+    def __init__(self) -> None:
+        self.seconds = {stage: 0.0 for stage in PIPELINE_STAGES}
+        self.bytes = {stage: 0 for stage in PIPELINE_STAGES}
+        self.items = {stage: 0 for stage in PIPELINE_STAGES}
+        self.total = 0.0
+
+    def report(self) -> typing.Dict[str, typing.Any]:
+        stages = {
+            stage: {"seconds": self.seconds[stage], "bytes": self.bytes[stage],
+                    "items": self.items[stage]}
+            for stage in PIPELINE_STAGES
+        }
+        return {"total": self.total, "stages": stages}
+
+    def format(self) -> str:
+        lines = [f"{'stage':<8} {'ms':>11} {'%':>6} {'bytes':>12} {'items':>8}"]
+        for stage in PIPELINE_STAGES:
+            seconds = self.seconds[stage]
+            share = seconds / self.total * 100 if self.total else 0.0
+            lines.append(f"{stage:<8} {seconds * 1e3:>11.3f} {share:>6.1f} "
+                         f"{self.bytes[stage]:>12} {self.items[stage]:>8}")
+        lines.append(f"{'total':<8} {self.total * 1e3:>11.3f}")
+        return "\n".join(lines)
+
+
+class _Pipe(io.RawIOBase):
+    """A readable pipe that charges the time spent waiting on it, and the
+    bytes that came through, to the clang stage."""
+
+    def __init__(self, raw: typing.BinaryIO, stats: Stats) -> None:
+        self._raw = raw
+        self._stats = stats
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        start = time.perf_counter()
+        n = self._raw.readinto(buffer)
+        self._stats.seconds["clang"] += time.perf_counter() - start
+        self._stats.bytes["clang"] += n or 0
+        return n
+
+
+def _timed_functions(pipe: _Pipe, stream: bool, stats: Stats) -> typing.Iterator[dict]:
+    """The FunctionDecls read from ``pipe``, timing the reading apart from
+    the waiting on clang."""
+    clock = time.perf_counter
+    buffered = io.BufferedReader(pipe)
+    start, waited = clock(), stats.seconds["clang"]
+    if stream:
+        functions = ast.iter_function_decls(io.TextIOWrapper(buffered, encoding="utf-8"))
+    else:
+        functions = ast.function_decls(jsonio.loads(buffered.read()))
+    while True:
+        try:
+            data = next(functions)
+        except StopIteration:
+            data = None
+        stats.seconds["read"] += clock() - start - (stats.seconds["clang"] - waited)
+        if data is None:
+            stats.bytes["read"] = stats.bytes["clang"]
+            return
+        stats.items["read"] += 1
+        yield data
+        start, waited = clock(), stats.seconds["clang"]
+
+
+class _Output:
+    """The output file, timing and counting what is written to it."""
+
+    def __init__(self, out: typing.BinaryIO, stats: Stats) -> None:
+        self._out = out
+        self._stats = stats
+
+    def write(self, data: bytes) -> None:
+        start = time.perf_counter()
+        self._out.write(data)
+        self._stats.seconds["write"] += time.perf_counter() - start
+        self._stats.bytes["write"] += len(data)
+
+    def flush(self) -> None:
+        start = time.perf_counter()
+        self._out.flush()
+        self._stats.seconds["write"] += time.perf_counter() - start
+
+
+def _convert(functions: typing.Iterable[dict], out: _Output, fmt: str,
+             skip_unsupported: Skip, stats: Stats) -> bytes:
+    """Convert ``functions``, writing each Decl to ``out`` as soon as it is
+    made; return the rest of the output, to write once clang has exited
+    cleanly.  Nothing at all is written for a dump without functions, so a
+    failed clang leaves the output empty or unterminated."""
+    clock = time.perf_counter
+    separator = jsonio.output_backend().separator.encode()
+    prog: ast.Prog = []
+    head = b"["
+    for data in functions:
+        start = clock()
+        decls, error = convert_function(data, skip_unsupported)
+        stats.seconds["convert"] += clock() - start
+        stats.items["convert"] += len(decls)
+        if error is not None:
+            warn_skipped(data, error)
+        if fmt != "json":
+            prog += decls
+            continue
+        for decl in decls:
+            start = clock()
+            text = head + _dump_decl(decl).encode()
+            stats.seconds["encode"] += clock() - start
+            stats.bytes["encode"] += len(text)
+            stats.items["encode"] += 1
+            out.write(text)
+            head = separator
+
+    start = clock()
+    if fmt == "json":
+        tail = b"[]" if head == b"[" else b"]"
+    else:
+        tail = dump_program(prog, fmt)
+        stats.items["encode"] = len(prog)
+    stats.seconds["encode"] += clock() - start
+    stats.bytes["encode"] += len(tail)
+    return tail
+
+
+def run_pipeline(
+    src: str,
+    out: typing.BinaryIO,
+    clang: typing.Sequence[str] = CLANG_COMMAND,
+    fmt: str = "json",
+    skip_unsupported: Skip = False,
+    stream: bool = True,
+) -> Stats:
+    """Run ``clang`` on ``src`` and write the converted program to ``out``.
+
+    Raises subprocess.CalledProcessError if clang fails, even when the
+    conversion of its truncated output failed first.
+    """
+    if fmt not in SUFFIXES:
+        raise ValueError("unknown output format", fmt)
+    stats = Stats()
+    start = time.perf_counter()
+    cmd = [*clang, src]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    output = _Output(out, stats)
+    try:
+        functions = _timed_functions(_Pipe(proc.stdout, stats), stream, stats)
+        tail = _convert(functions, output, fmt, skip_unsupported, stats)
+    except Exception as e:
+        proc.stdout.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, cmd) from e
+        raise
+    # the dump has been read to its end, so clang is done or nearly
+    wait = time.perf_counter()
+    proc.stdout.close()
+    returncode = proc.wait()
+    stats.seconds["clang"] += time.perf_counter() - wait
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd)
+    output.write(tail)
+    output.flush()
+    stats.total = time.perf_counter() - start
+    return stats
+
+
+"""
+COMMAND LINE
+"""
+
+def main() -> None:
+    cfg = parse_args()
+    if cfg.json_backend is not None:
+        os.environ[jsonio.JSON_BACKEND_ENV] = cfg.json_backend
+    clang = (cfg.clang, *CLANG_COMMAND[1:], *cfg.clang_arg)
+    if cfg.output is None or cfg.output == "-":
+        out = sys.stdout.buffer
+    else:
+        out = jsonio.open_file(cfg.output, "wb")
+    try:
+        stats = run_pipeline(cfg.FILE, out, clang, cfg.format, cfg.skip_unsupported,
+                             not cfg.no_stream)
+    except subprocess.CalledProcessError as e:
+        sys.exit(f"clang failed with status {e.returncode}")
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    if cfg.stats:
+        print(stats.format(), file=sys.stderr)
+    if cfg.stats_json is not None:
+        with open(cfg.stats_json, "w") as f:
+            json.dump(stats.report(), f, indent=2)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m pygml.pipeline", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("FILE", type=str, help="C file to run clang on")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Write the program here, compressed if the name ends in "
+                             ".gz or .zst, instead of stdout (also -)")
+    parser.add_argument("--format", choices=sorted(SUFFIXES), default="json",
+                        help="Output format, as for convert_ast. Default: json")
+    skip = parser.add_mutually_exclusive_group()
+    skip.add_argument("--skip-unsupported", action="store_true",
+                      help="Leave out, with a warning, functions the converter "
+                           "cannot handle instead of failing")
+    skip.add_argument("--skip-drivers", action="store_const", dest="skip_unsupported",
+                      const=DRIVERS,
+                      help="As --skip-unsupported, but only for drivers: main and "
+                           "functions starting an OpenMP parallel region")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="Read clang's whole dump into memory and decode it at once "
+                             "with the JSON backend, which is faster but holds it all")
+    parser.add_argument("--json-backend", choices=sorted(jsonio.BACKENDS), default=None,
+                        help="JSON library for decoding with --no-stream. "
+                             f"Default: ${jsonio.JSON_BACKEND_ENV} or the fastest installed")
+    parser.add_argument("--clang", type=str, default=CLANG_COMMAND[0],
+                        help=f"clang executable. Default: {CLANG_COMMAND[0]}")
+    parser.add_argument("--clang-arg", type=str, action="append", default=[],
+                        help="Extra argument for clang, given as --clang-arg=-Idir; repeatable")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print per-stage wall time and bytes to stderr")
+    parser.add_argument("--stats-json", type=str, default=None,
+                        help="Write the per-stage figures to this file as JSON")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+"""
+Long-lived conversion server on a local Unix socket.
+
+Keeps pygml.ast imported and the converted programs cached in memory, up to
+--cache-size with least recently used ones evicted first, so a conversion
+costs one socket round trip instead of a Python start.  Requests and
+replies are single JSON lines:
+
+    {"op": "convert", "path": "/abs/file.c.json", "watch": false,
+     "skip_unsupported": false}
+    -> {"ok": true, "cached": false, "prog": [...]}
+
+"skip_unsupported" is false, true or "drivers", as for
+pygml.convert.convert_function.
+
+    {"op": "stats"}     -> {"ok": true, "stats": {...}}
+    {"op": "shutdown"}  -> {"ok": true}
+
+With "raw": true, a convert reply is instead a JSON line without "prog",
+followed by the program text exactly as convert_ast writes it to FILE.conv.
+Failures reply {"ok": false, "error": "..."}.  Paths given with "watch" are
+polled and reconverted as soon as they change on disk, so the next request
+for them is served from memory.
+
+`python -m pygml.bench startup --way server` measures the latency of both a
+reconversion and a hit, next to that of starting convert_ast afresh.
+"""
+import argparse
+import collections
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import typing
+
+from .cache import DEFAULT_SIZE
+from .convert import DRIVERS, Skip, convert_functions, dump_program, read_file
+from . import ast
+
+
+SOCKET_ENV = "GML_CONVERT_SOCKET"
+
+
+class Entry(typing.NamedTuple):
+    size: int
+    mtime_ns: int
+    skip_unsupported: Skip
+    text: str
+
+
+class Converter:
+    """In-memory cache of encoded programs keyed by path and file state.
+
+    The programs' text is capped at ``max_size`` bytes; least recently used
+    ones are evicted beyond it, and stop being watched.
+    """
+
+    def __init__(self, stream: bool = True, max_size: int = DEFAULT_SIZE) -> None:
+        self.stream = stream
+        self.max_size = max_size
+        self.size = 0
+        self.cache: typing.OrderedDict[str, Entry] = collections.OrderedDict()
+        self.watched: typing.Set[str] = set()
+        self.stats = {"requests": 0, "hits": 0, "conversions": 0, "evictions": 0, "errors": 0}
+        # the converter keeps module level state, so conversions never overlap
+        self.lock = threading.Lock()
+
+    def get(self, path: str, skip_unsupported: Skip = False) -> typing.Tuple[str, bool]:
+        """Return the encoded program for ``path`` and whether it was cached."""
+        st = os.stat(path)
+        with self.lock:
+            self.stats["requests"] += 1
+            entry = self.cache.get(path)
+            if entry is not None and entry[:3] == (st.st_size, st.st_mtime_ns, skip_unsupported):
+                self.stats["hits"] += 1
+                self.cache.move_to_end(path)
+                return entry.text, True
+            return self._convert(path, st, skip_unsupported).text, False
+
+    def _convert(self, path: str, st: os.stat_result, skip_unsupported: Skip = False) -> Entry:
+        prog = convert_functions(read_file(path, self.stream), skip_unsupported)
+        entry = Entry(st.st_size, st.st_mtime_ns, skip_unsupported, dump_program(prog).decode())
+        self._drop(path)
+        self.cache[path] = entry
+        self.size += len(entry.text)
+        self.stats["conversions"] += 1
+        # the newest entry stays, however large, to answer its request
+        while self.size > self.max_size and len(self.cache) > 1:
+            old = next(iter(self.cache))
+            self._drop(old)
+            self.watched.discard(old)
+            self.stats["evictions"] += 1
+        return entry
+
+    def _drop(self, path: str) -> None:
+        entry = self.cache.pop(path, None)
+        if entry is not None:
+            self.size -= len(entry.text)
+
+    def watch(self, path: str) -> None:
+        with self.lock:
+            self.watched.add(path)
+
+    def poll(self) -> None:
+        """Reconvert every watched path whose size or mtime changed."""
+        with self.lock:
+            for path in list(self.watched):
+                try:
+                    st = os.stat(path)
+                    entry = self.cache.get(path)
+                    if entry is None or (entry.size, entry.mtime_ns) != (st.st_size, st.st_mtime_ns):
+                        self._convert(path, st, entry is not None and entry.skip_unsupported)
+                except FileNotFoundError:
+                    self.watched.discard(path)
+                    self._drop(path)
+                except Exception:
+                    # the file may be half written; retry on the next poll
+                    self.stats["errors"] += 1
+
+
+"""
+SERVER
+"""
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "Server"
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            reply = self.server.dispatch(request)
+        except Exception as e:
+            self.server.converter.stats["errors"] += 1
+            reply = json.dumps({"ok": False, "error": f"{type(e).__name__}: {e}"})
+        self.wfile.write(reply.encode() + b"\n")
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, converter: Converter) -> None:
+        self.converter = converter
+        _remove_stale_socket(path)
+        super().__init__(path, _Handler)
+
+    def dispatch(self, request: dict) -> str:
+        op = request.get("op")
+        if op == "convert":
+            path = os.path.abspath(request["path"])
+            if request.get("watch"):
+                self.converter.watch(path)
+            skip = request.get("skip_unsupported", False)
+            if skip not in (False, True, DRIVERS):
+                raise ValueError("unknown skip_unsupported", skip)
+            text, cached = self.converter.get(path, skip)
+            # the cached text is spliced in rather than decoded and re-encoded
+            if request.get("raw"):
+                return '{"ok": true, "cached": %s}\n%s' % (json.dumps(cached), text)
+            return '{"ok": true, "cached": %s, "prog": %s}' % (json.dumps(cached), text)
+        if op == "stats":
+            return json.dumps({"ok": True, "stats": self.converter.stats})
+        if op == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return json.dumps({"ok": True})
+        raise ValueError("unknown op", op)
+
+
+def _remove_stale_socket(path: str) -> None:
+    if not os.path.exists(path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        try:
+            s.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.unlink(path)
+            return
+    raise OSError(f"a server is already listening on {path}")
+
+
+def serve(path: str, watch_interval: float = 0.5, stream: bool = True,
+          max_size: int = DEFAULT_SIZE) -> None:
+    converter = Converter(stream, max_size)
+
+    def poll_forever() -> None:
+        while True:
+            time.sleep(watch_interval)
+            converter.poll()
+
+    threading.Thread(target=poll_forever, daemon=True).start()
+    with Server(path, converter) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+"""
+CLIENT
+"""
+
+def request(path: str, message: dict) -> dict:
+    """Send one request to the server listening on ``path``."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps(message).encode() + b"\n")
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile("rb") as f:
+            reply = json.loads(f.read())
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    return reply
+
+
+def convert_text(
+    path: str,
+    file: str,
+    watch: bool = False,
+    skip_unsupported: Skip = False,
+) -> bytes:
+    """Convert ``file`` on the server at ``path`` and return the program as
+    the bytes convert_ast would write for it."""
+    message = {"op": "convert", "path": os.path.abspath(file), "watch": watch,
+               "skip_unsupported": skip_unsupported, "raw": True}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        s.sendall(json.dumps(message).encode() + b"\n")
+        s.shutdown(socket.SHUT_WR)
+        with s.makefile("rb") as f:
+            reply = json.loads(f.readline())
+            text = f.read()
+    if not reply["ok"]:
+        raise RuntimeError(reply["error"])
+    # less the newline ending the reply
+    return text[:-1]
+
+
+def convert(
+    path: str,
+    file: str,
+    watch: bool = False,
+    skip_unsupported: Skip = False,
+    lazy: bool = False,
+) -> ast.Prog:
+    """Convert ``file`` on the server at ``path`` and decode the result,
+    with ``lazy`` as :class:`pygml.ast.LazyExpr` expressions."""
+    reply = request(path, {"op": "convert", "path": os.path.abspath(file), "watch": watch,
+                           "skip_unsupported": skip_unsupported})
+    return ast.decode_program(reply["prog"], lazy=lazy)
+
+
+def main() -> None:
+    cfg = parse_args()
+    sock = cfg.socket or os.environ.get(SOCKET_ENV)
+    if not sock:
+        sys.exit(f"no socket given; pass --socket or set {SOCKET_ENV}")
+
+    if cfg.command == "serve":
+        serve(sock, cfg.watch_interval, not cfg.no_stream, cfg.cache_size << 20)
+    elif cfg.command == "convert":
+        text = convert_text(sock, cfg.FILE, cfg.watch, cfg.skip_unsupported)
+        if cfg.output is None:
+            sys.stdout.buffer.write(text)
+        else:
+            with open(cfg.output, "wb") as f:
+                f.write(text)
+    else:
+        print(json.dumps(request(sock, {"op": cfg.command})))
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", type=str, default=None,
+                        help=f"Socket path. Default: ${SOCKET_ENV}")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="Run the server")
+    serve.add_argument("--watch-interval", type=float, default=0.5,
+                       help="Seconds between polls of watched files. Default: 0.5")
+    serve.add_argument("--no-stream", action="store_true",
+                       help="Decode whole dumps at once with the JSON backend")
+    serve.add_argument("--cache-size", type=int, default=DEFAULT_SIZE >> 20,
+                       help="Cap on the programs kept in memory, in MiB; least recently "
+                            f"used ones are evicted beyond it. Default: {DEFAULT_SIZE >> 20}")
+
+    conv = commands.add_parser("convert", help="Convert a file on the server")
+    conv.add_argument("FILE", type=str, help="File to convert. Expects .json format!")
+    conv.add_argument("-o", "--output", type=str, default=None,
+                      help="Write the program here instead of stdout")
+    conv.add_argument("--watch", action="store_true",
+                      help="Keep reconverting FILE whenever it changes")
+    skip = conv.add_mutually_exclusive_group()
+    skip.add_argument("--skip-unsupported", action="store_true",
+                      help="Leave out functions the converter cannot handle")
+    skip.add_argument("--skip-drivers", action="store_const", dest="skip_unsupported",
+                      const=DRIVERS,
+                      help="Leave out drivers the converter cannot handle")
+
+    commands.add_parser("stats", help="Print cache statistics")
+    commands.add_parser("shutdown", help="Stop the server")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""
+Static work, span and live-future estimates of converted task programs.
+
+    python -m pygml.workspan fib.c.json --sizes 10,20,30
+    python -m pygml.workspan kernels/*.conv --sizes 0:64 --set cutoff=16
+
+Every function of a Prog is run abstractly on an integer argument, the input
+size n.  Each expression evaluated costs one unit; EFuture (an OpenMP task)
+starts its body alongside the rest of the function, EForce (the taskwait)
+waits for it, and a call to a function of the Prog costs what that function
+costs at the argument's value.  For every n this gives
+
+    work   units evaluated in all
+    span   units on the longest chain of dependent ones
+    live   most futures started and not yet forced at one time, in the order
+           a single worker runs them (each task body on the spot)
+
+Integer arithmetic on n and on literals is carried out, so a base case such
+as ``if (n <= 1)`` takes its branch; a condition that cannot be evaluated
+takes the costlier branch in each measure.  Names the program cannot compute,
+such as a global cutoff, can be given values.
+
+Costs are memoized per function and argument, so all the sizes asked for
+share one table and a sweep costs about what its largest size does.  A call
+the evaluation cannot size (an unknown argument, a cycle, or recursion more
+than ``limit`` calls deep) makes the estimate None, as does an expression
+nested too deep to evaluate.
+"""
+import argparse
+import json
+import sys
+import typing
+
+from . import ast, jsonio
+from .convert import SUFFIXES, convert_functions, read_file
+
+
+class Cost(typing.NamedTuple):
+    work: int
+    span: int
+    live: int
+    # futures still unforced when the function returns
+    pending: int
+
+
+class Estimate(typing.NamedTuple):
+    """Costs of the function ``name`` at each of ``sizes``."""
+    name: str
+    sizes: typing.List[int]
+    work: typing.List[typing.Optional[int]]
+    span: typing.List[typing.Optional[int]]
+    live: typing.List[typing.Optional[int]]
+
+    def parallelism(self) -> typing.List[typing.Optional[float]]:
+        """Work over span at each size."""
+        return [None if w is None else w / s for w, s in zip(self.work, self.span)]
+
+
+"""
+ABSTRACT EVALUATION
+"""
+
+class _Need(Exception):
+    """A call whose cost is not in the table yet."""
+
+    def __init__(self, key: typing.Tuple[str, int]) -> None:
+        self.key = key
+
+
+class _Unbounded(Exception):
+    pass
+
+
+class _Future:
+    __slots__ = ("finish", "value")
+
+    def __init__(self, finish: int, value) -> None:
+        self.finish = finish
+        self.value = value
+
+
+def _known(value) -> bool:
+    return type(value) is int or type(value) is bool
+
+
+def _div(a: int, b: int) -> typing.Optional[int]:
+    if b == 0:
+        return None
+    q = abs(a) // abs(b)
+    return q if (a < 0) == (b < 0) else -q
+
+
+_ARITH: typing.Dict[str, typing.Callable[[int, int], typing.Any]] = {
+    ast.InfixOp.Plus: lambda a, b: a + b,
+    ast.InfixOp.Minus: lambda a, b: a - b,
+    ast.InfixOp.Times: lambda a, b: a * b,
+    ast.InfixOp.Div: _div,
+    ast.InfixOp.Lt: lambda a, b: a < b,
+    ast.InfixOp.Le: lambda a, b: a <= b,
+    ast.InfixOp.Gt: lambda a, b: a > b,
+    ast.InfixOp.Ge: lambda a, b: a >= b,
+    ast.InfixOp.Eq: lambda a, b: a == b,
+    ast.InfixOp.Ne: lambda a, b: a != b,
+    ast.InfixOp.And: lambda a, b: bool(a) and bool(b),
+    ast.InfixOp.Or: lambda a, b: bool(a) or bool(b),
+}
+
+
+class _Table:
+    """Memoized costs of the functions of one program."""
+
+    def __init__(self, prog: ast.Prog, bindings: typing.Mapping[str, int], limit: int) -> None:
+        # name -> (argument name, body)
+        self.functions: typing.Dict[str, typing.Tuple[str, ast.Expr]] = {}
+        for decl in prog:
+            desc = decl.ddesc
+            if type(desc) is ast.DVal and type(desc.expr.edesc) is ast.EFunc:
+                fn = desc.expr.edesc
+                self.functions[desc.name] = (fn.arg, fn.body)
+        self.bindings = dict(bindings)
+        self.limit = limit
+        self.costs: typing.Dict[typing.Tuple[str, int], typing.Optional[Cost]] = {}
+        # counters of the evaluation under way
+        self.work = 0
+        self.pending: typing.Set[_Future] = set()
+        self.held = 0
+        self.peak = 0
+        self.finish = 0
+
+    def cost(self, name: str, n: int) -> typing.Optional[Cost]:
+        """The cost of ``name`` at ``n``, or None if it cannot be sized.
+
+        Evaluating a call not in the table yet is abandoned, the call is
+        evaluated first, and the caller is evaluated again; the calls waiting
+        on each other form an explicit stack rather than Python recursion.
+        """
+        top = (name, n)
+        stack = [top]
+        waiting = {top}
+        while stack and top not in self.costs:
+            key = stack[-1]
+            try:
+                cost = self._evaluate(*key)
+            except _Need as e:
+                if e.key not in waiting and len(stack) < self.limit:
+                    stack.append(e.key)
+                    waiting.add(e.key)
+                    continue
+                cost = None
+            except (_Unbounded, RecursionError):
+                cost = None
+            if cost is None:
+                # everything waiting depends on this call
+                for k in stack:
+                    self.costs[k] = None
+                break
+            self.costs[key] = cost
+            stack.pop()
+            waiting.discard(key)
+        return self.costs[top]
+
+    def _evaluate(self, name: str, n: int) -> Cost:
+        arg, body = self.functions[name]
+        self.work, self.pending, self.held, self.peak, self.finish = 0, set(), 0, 0, 0
+        env = dict(self.bindings)
+        env[arg] = n
+        _, t = self._eval(body, env, 0)
+        return Cost(self.work, max(t, self.finish), self.peak, len(self.pending) + self.held)
+
+    def _eval(self, expr: ast.Expr, env: dict, t: int) -> typing.Tuple[typing.Any, int]:
+        """The value of ``expr`` (an int or bool if known, a _Future, or
+        None) and the time it is ready, evaluating from time ``t``."""
+        copied = False
+        while True:
+            d = expr.edesc
+            cls = type(d)
+            self.work += 1
+            t += 1
+            # let chains and known branches continue in place, so a long
+            # statement list costs no recursion
+            if cls is ast.ELet:
+                if not copied:
+                    env = dict(env)
+                    copied = True
+                env[d.name], t = self._eval(d.value, env, t)
+                expr = d.body
+                continue
+            if cls is ast.EIf:
+                cond, t = self._eval(d.cond, env, t)
+                if not _known(cond):
+                    return self._either(d.then, d.els, env, t)
+                branch = d.then if cond else d.els
+                if branch is None:
+                    return None, t
+                expr = branch
+                continue
+            break
+
+        if cls is ast.EVar:
+            return (env.get(d.id.name) if type(d.id) is ast.Id else None), t
+        if cls is ast.EConst:
+            value = d.value
+            return (value.value if type(value) in (ast.Num, ast.Bool) else None), t
+        if cls is ast.EInfixop:
+            a, t = self._eval(d.left, env, t)
+            b, t = self._eval(d.right, env, t)
+            op = _ARITH.get(d.op)
+            return (op(a, b) if op is not None and _known(a) and _known(b) else None), t
+        if cls is ast.EApp:
+            return self._call(d, env, t)
+        if cls is ast.EFuture:
+            future = _Future(0, None)
+            self.pending.add(future)
+            self.peak = max(self.peak, len(self.pending) + self.held)
+            future.value, future.finish = self._eval(d.expr, env, t)
+            self.finish = max(self.finish, future.finish)
+            return future, t
+        if cls is ast.EForce:
+            future, t = self._eval(d.expr, env, t)
+            if type(future) is not _Future:
+                return None, t
+            self.pending.discard(future)
+            return future.value, max(t, future.finish)
+        if cls is ast.EPar:
+            _, left = self._eval(d.left, env, t)
+            _, right = self._eval(d.right, env, t)
+            return None, max(left, right)
+        if cls is ast.EFunc:
+            return None, t
+        for child in ast.children(expr):
+            _, t = self._eval(child, env, t)
+        return None, t
+
+    def _call(self, d: ast.EApp, env: dict, t: int) -> typing.Tuple[typing.Any, int]:
+        _, t = self._eval(d.fn, env, t)
+        arg, t = self._eval(d.arg, env, t)
+        fn = d.fn.edesc
+        if type(fn) is not ast.EVar or type(fn.id) is not ast.Id or fn.id.name not in self.functions:
+            return None, t
+        if not _known(arg):
+            raise _Unbounded
+        key = (fn.id.name, int(arg))
+        if key not in self.costs:
+            raise _Need(key)
+        cost = self.costs[key]
+        if cost is None:
+            raise _Unbounded
+        self.work += cost.work
+        self.peak = max(self.peak, len(self.pending) + self.held + cost.live)
+        self.held += cost.pending
+        return None, t + cost.span
+
+    def _either(self, then: ast.Expr, els: typing.Optional[ast.Expr], env: dict,
+                t: int) -> typing.Tuple[typing.Any, int]:
+        """Both branches of an if whose condition is unknown, keeping the
+        larger of each counter."""
+        start = (self.work, set(self.pending), self.held, self.peak, self.finish)
+        value, t_then = self._eval(then, env, t)
+        after_then = (self.work, self.pending, self.held, self.peak, self.finish)
+        self.work, self.pending, self.held, self.peak, self.finish = start
+        if els is None:
+            other, t_els = None, t
+        else:
+            other, t_els = self._eval(els, env, t)
+        self.work = max(self.work, after_then[0])
+        self.pending |= after_then[1]
+        self.held = max(self.held, after_then[2])
+        self.peak = max(self.peak, after_then[3])
+        self.finish = max(self.finish, after_then[4])
+        return (value if value == other else None), max(t_then, t_els)
+
+
+"""
+ESTIMATES
+"""
+
+def estimate(
+    prog: ast.Prog,
+    sizes: typing.Iterable[int],
+    bindings: typing.Optional[typing.Mapping[str, int]] = None,
+    limit: typing.Optional[int] = None,
+) -> typing.Dict[str, Estimate]:
+    """Estimates for every function of ``prog`` at each of ``sizes``.
+
+    ``bindings`` gives values to names the functions use but do not define.
+    ``limit`` bounds how many calls deep the recursion may go; by default
+    twice the largest size, plus some slack for the base cases.
+    """
+    sizes = list(sizes)
+    if limit is None:
+        limit = 2 * max((abs(n) for n in sizes), default=0) + 64
+    table = _Table(prog, bindings or {}, limit)
+    estimates = {}
+    for name in table.functions:
+        # smallest first, so larger sizes find what they call already done
+        for n in sorted(set(sizes)):
+            table.cost(name, n)
+        costs = [table.costs[(name, n)] for n in sizes]
+        estimates[name] = Estimate(
+            name,
+            sizes,
+            [None if c is None else c.work for c in costs],
+            [None if c is None else c.span for c in costs],
+            [None if c is None else c.live for c in costs],
+        )
+    return estimates
+
+
+def read_program(path: str) -> ast.Prog:
+    """The program in ``path``: a .conv or .convb file, or a clang dump to
+    convert (skipping the functions the converter cannot handle)."""
+    name = jsonio.strip_compression(path)
+    if name.endswith(SUFFIXES["binary"]):
+        with jsonio.open_file(path, "rb") as f:
+            return ast.decode_program_binary(f.read())
+    if name.endswith(SUFFIXES["json"]):
+        return ast.decode_program(jsonio.load(path))
+    return convert_functions(read_file(path), skip_unsupported=True)
+
+
+"""
+COMMAND LINE
+"""
+
+def main() -> None:
+    cfg = parse_args()
+    out = sys.stdout if cfg.output is None else open(cfg.output, "w")
+    try:
+        for path in cfg.FILE:
+            for e in estimate(read_program(path), cfg.sizes, cfg.bindings, cfg.limit).values():
+                record = {"file": path, **e._asdict(), "parallelism": e.parallelism()}
+                out.write(json.dumps(record) + "\n")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+def _sizes(text: str) -> typing.List[int]:
+    sizes: typing.List[int] = []
+    for item in text.split(","):
+        if ":" in item:
+            sizes.extend(range(*(int(x) for x in item.split(":"))))
+        elif item:
+            sizes.append(int(item))
+    return sizes
+
+
+def _binding(text: str) -> typing.Tuple[str, int]:
+    name, sep, value = text.partition("=")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected NAME=VALUE, got {text!r}")
+    return name, int(value)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m pygml.workspan", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("FILE", nargs="+",
+                        help="Program to estimate: .conv, .convb, or a clang JSON dump")
+    parser.add_argument("--sizes", type=_sizes, default=[10, 20, 30],
+                        help="Comma-separated sizes, or START:STOP[:STEP] ranges. Default: 10,20,30")
+    parser.add_argument("--set", dest="bindings", type=_binding, action="append", default=[],
+                        metavar="NAME=VALUE", help="Value of a name the program leaves unknown; repeatable")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Deepest recursion to follow. Default: twice the largest size, plus 64")
+    parser.add_argument("-o", "--output", type=str, default=None,
+                        help="Write one JSON line per function here instead of stdout")
+    cfg = parser.parse_args()
+    cfg.bindings = dict(cfg.bindings)
+    return cfg
+
+
+if __name__ == "__main__":
+    main()
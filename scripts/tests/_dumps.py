@@ -0,0 +1,38 @@
+"""
+Helpers shared by the tests: synthetic dumps on disk and what the checker
+should read back from converting them.
+"""
+
+import json
+
+from pygml import ast, jsonio
+from pygml.bench import SHAPES, write_dump
+
+
+# shape -> size, small enough for json.dumps to encode without recursing too deep
+SMALL = {"tasks": 20, "block": 200, "chain": 200, "functions": 5, "headers": 20}
+
+
+def program(shape: str, size: int) -> ast.Prog:
+    return ast.convert_program(SHAPES[shape](size))
+
+
+def text(prog: ast.Prog) -> str:
+    return json.dumps(ast.encode_program(prog))
+
+
+def write(path, doc: dict) -> str:
+    with jsonio.open_file(str(path), "w") as f:
+        write_dump(doc, f)
+    return str(path)
+
+
+def expected(doc: dict) -> bytes:
+    """What the checker should get for ``doc``: the encoded program as
+    json.dumps writes it."""
+    return text(ast.convert_program(doc)).encode()
+
+
+def read(path: str) -> bytes:
+    with jsonio.open_file(path, "rb") as f:
+        return f.read()
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# the scripts directory, where convert_ast and pygml live
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from _dumps import SMALL, expected, program, write  # noqa: E402
+from pygml.bench import functions  # noqa: E402
+
+
+@pytest.fixture
+def dump(tmp_path):
+    """A small dump on disk, with the output it converts to."""
+    doc = functions(6)
+    return write(tmp_path / "unit.json", doc), expected(doc)
+
+
+@pytest.fixture(params=sorted(SMALL))
+def prog(request):
+    """A converted program of each synthetic shape."""
+    return program(request.param, SMALL[request.param])
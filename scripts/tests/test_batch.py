@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from pygml import jsonio
+from pygml.batch import OutputCollision, run_batch
+from pygml.bench import functions, tasks, write_dump
+
+
+def _write(path, doc: dict) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        write_dump(doc, f)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    root = tmp_path / "in"
+    _write(root / "a" / "k.json", functions(2))
+    _write(root / "b" / "k.json", tasks(2))
+    _write(root / "t.json", tasks(3))
+    return str(root)
+
+
+def test_out_dir_keeps_relative_paths(inputs, tmp_path):
+    out = tmp_path / "out"
+    counts = run_batch([inputs], jobs=1, out_dir=str(out))
+    assert counts["ok"] == 3
+    for name in ("a/k.json.conv", "b/k.json.conv", "t.json.conv"):
+        assert os.path.exists(out / name)
+    assert jsonio.load(str(out / "a" / "k.json.conv")) != jsonio.load(str(out / "b" / "k.json.conv"))
+
+
+def test_colliding_outputs_are_rejected(inputs, tmp_path):
+    out = tmp_path / "out"
+    files = [os.path.join(inputs, "a", "k.json"), os.path.join(inputs, "b", "k.json")]
+    with pytest.raises(OutputCollision):
+        run_batch(files, jobs=1, out_dir=str(out))
+    assert not os.path.exists(out)
+
+
+def test_resume_skips_only_matching_options(inputs, tmp_path):
+    out = str(tmp_path / "out")
+    assert run_batch([inputs], jobs=1, out_dir=out)["ok"] == 3
+    assert run_batch([inputs], jobs=1, out_dir=out)["skipped"] == 3
+    counts = run_batch([inputs], jobs=1, out_dir=out, skip_unsupported=True)
+    assert (counts["ok"], counts["skipped"]) == (3, 0)
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from _dumps import program, read, text
+from pygml import ast
+from pygml.convert import convert_file
+
+
+def test_binary_round_trip(prog):
+    data = ast.encode_program_binary(prog)
+    decoded = ast.decode_program_binary(data)
+    assert text(decoded) == text(prog)
+    assert ast.encode_program_binary(decoded) == data
+
+
+def test_binary_rejects_truncated_data(prog):
+    data = ast.encode_program_binary(prog)
+    with pytest.raises(ValueError):
+        ast.decode_program_binary(data[:-1])
+
+
+def test_deep_program_round_trips_without_recursion():
+    data = ast.encode_program_binary(program("chain", 20_000))
+    assert ast.encode_program_binary(ast.decode_program_binary(data)) == data
+
+
+def test_binary_output_decodes_to_the_program(dump, tmp_path):
+    src, want = dump
+    dst = str(tmp_path / "unit.json.convb")
+    convert_file(src, dst, fmt="binary")
+    prog = ast.decode_program_binary(read(dst))
+    assert json.dumps(ast.encode_program(prog)).encode() == want
@@ -0,0 +1,50 @@
+import json
+
+from _dumps import read, write
+from pygml.bench import functions
+from pygml.cache import ConversionCache
+from pygml.convert import convert_file
+
+
+def test_cache_serves_the_same_output(dump, tmp_path):
+    src, want = dump
+    cache = ConversionCache(str(tmp_path / "cache"))
+    first, second = str(tmp_path / "first.conv"), str(tmp_path / "second.conv")
+    assert not convert_file(src, first, cache=cache)
+    assert convert_file(src, second, cache=cache)
+    assert read(first) == read(second) == want
+
+
+def test_stores_walk_the_entries_only_when_over_the_cap(tmp_path, monkeypatch):
+    cache = ConversionCache(str(tmp_path / "cache"), max_size=1000)
+    cache.put("00first", b"x" * 100)
+    scans = []
+    scan = ConversionCache._scan
+    monkeypatch.setattr(ConversionCache, "_scan", lambda self: scans.append(1) or scan(self))
+    for n in range(1, 9):
+        cache.put(f"{n:02}", b"x" * 100)
+    assert not scans
+    # replacing an entry counts only the difference
+    cache.put("01", b"x" * 50)
+    cache.put("09", b"x" * 200)
+    assert len(scans) == 1
+    summary = cache.summary()
+    assert summary["size"] <= 1000
+    assert summary["size"] == json.loads((tmp_path / "cache" / "stats.json").read_text())["size"]
+    cache.clear()
+    assert cache.summary()["size"] == 0
+
+
+def test_hit_repeats_the_skip_warnings(tmp_path, capsys):
+    doc = functions(2)
+    doc["inner"].append({"kind": "FunctionDecl", "name": "bad", "loc": {},
+                         "inner": [{"kind": "CompoundStmt", "inner": [{"kind": "WhileStmt", "inner": []}]}]})
+    src = write(tmp_path / "unit.json", doc)
+    cache = ConversionCache(str(tmp_path / "cache"))
+    outputs = []
+    for n in range(2):
+        dst = str(tmp_path / f"{n}.conv")
+        assert convert_file(src, dst, cache=cache, skip_unsupported=True) == bool(n)
+        outputs.append((read(dst), capsys.readouterr().err))
+    assert outputs[0] == outputs[1]
+    assert "skipping function bad" in outputs[0][1]
@@ -0,0 +1,33 @@
+import json
+
+from _dumps import program
+from pygml import ast
+
+
+def _same(a, b) -> bool:
+    """``a == b`` for encoded programs too deep for the recursive ``==``."""
+    stack = [(a, b)]
+    while stack:
+        x, y = stack.pop()
+        if isinstance(x, list) and isinstance(y, list):
+            if len(x) != len(y):
+                return False
+            stack.extend(zip(x, y))
+        elif isinstance(x, dict) and isinstance(y, dict):
+            if x.keys() != y.keys():
+                return False
+            stack.extend((x[k], y[k]) for k in x)
+        elif type(x) is not type(y) or x != y:
+            return False
+    return True
+
+
+def test_json_round_trip(prog):
+    js = ast.encode_program(prog)
+    assert ast.encode_program(ast.decode_program(json.loads(json.dumps(js)))) == js
+
+
+def test_deep_program_round_trips_without_recursion():
+    prog = program("chain", 20_000)
+    js = ast.encode_program(prog)
+    assert _same(ast.encode_program(ast.decode_program(js)), js)
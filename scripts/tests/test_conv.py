@@ -0,0 +1,50 @@
+import gc
+import time
+
+from pygml import ast
+from pygml.bench import block
+
+
+def _best_time(data: dict, repeat: int = 3) -> float:
+    best = float("inf")
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            ast.convert(data)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return best
+
+
+def _let_chain_length(expr: ast.Expr) -> int:
+    n = 0
+    while isinstance(expr.edesc, ast.ELet):
+        n += 1
+        expr = expr.edesc.body
+    return n
+
+
+def test_compound_stmt_leaves_input_untouched():
+    data = block(10_000)
+    ast.convert(data)
+    # the synthetic dumps are deterministic, so a fresh one is the original
+    assert data == block(10_000)
+
+
+def test_compound_stmt_scales_linearly():
+    small, large = block(10_000), block(40_000)
+    ratio = _best_time(large) / _best_time(small)
+    # 4 for linear lowering, 16 for quadratic
+    assert ratio < 8, ratio
+
+
+def test_collapse_binds_every_statement():
+    body, = (node for node in block(10_000)["inner"] if node["kind"] == "CompoundStmt")
+    stmts = [node for node in body["inner"] if node["kind"] != "DeclStmt"]
+    compound = dict(body, inner=list(stmts))
+    expr = ast.collapse(compound)
+    assert compound["inner"] == stmts
+    assert _let_chain_length(expr) == len(stmts) - 1
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from _dumps import expected, read, write
+from pygml.bench import functions
+from pygml.cache import ConversionCache
+from pygml.convert import DRIVERS, convert_file
+from pygml.incremental import state_path
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"stream": False},
+    {"jobs": 2},
+    {"max_memory": 0},
+], ids=["stream", "whole", "jobs", "low"])
+def test_paths_write_the_same_output(dump, tmp_path, options):
+    src, want = dump
+    dst = str(tmp_path / "unit.json.conv")
+    convert_file(src, dst, **options)
+    assert read(dst) == want
+
+
+@pytest.mark.parametrize("options", [{}, {"max_memory": 0}, {"incremental": True}],
+                         ids=["stream", "low", "incremental"])
+def test_outputs_follow_the_umask(dump, tmp_path, options):
+    src, _ = dump
+    dst = str(tmp_path / "unit.json.conv")
+    old = os.umask(0o022)
+    try:
+        convert_file(src, dst, **options)
+    finally:
+        os.umask(old)
+    assert os.stat(dst).st_mode & 0o777 == 0o644
+    if options.get("incremental"):
+        assert os.stat(state_path(dst)).st_mode & 0o777 == 0o644
+
+
+def _function(name: str, params, body: list) -> dict:
+    inner = [{"kind": "ParmVarDecl", "name": p} for p in params]
+    return {"kind": "FunctionDecl", "name": name, "loc": {},
+            "inner": inner + [{"kind": "CompoundStmt", "inner": body}]}
+
+
+def test_skip_drivers_fails_on_unsupported_kernels(tmp_path):
+    driver = _function("main", ["argc", "argv"], [{"kind": "OMPParallelDirective", "inner": []}])
+    kernel = _function("bad", ["n"], [{"kind": "WhileStmt", "inner": []}])
+    doc = functions(1)
+    ok = write(tmp_path / "ok.json", dict(doc, inner=doc["inner"] + [driver]))
+    bad = write(tmp_path / "bad.json", dict(doc, inner=doc["inner"] + [driver, kernel]))
+    dst = str(tmp_path / "out.conv")
+
+    convert_file(ok, dst, skip_unsupported=DRIVERS)
+    assert read(dst) == expected(doc)
+    with pytest.raises(ValueError, match="WhileStmt"):
+        convert_file(bad, dst, skip_unsupported=DRIVERS)
+    convert_file(bad, dst, skip_unsupported=True)
+    assert read(dst) == expected(doc)
+
+
+def test_low_memory_fills_the_cache_without_reading_the_output(dump, tmp_path, monkeypatch):
+    src, want = dump
+    cache = ConversionCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(ConversionCache, "put", None)
+    convert_file(src, str(tmp_path / "first.conv"), cache=cache, max_memory=0)
+    second = str(tmp_path / "second.conv")
+    assert convert_file(src, second, cache=cache)
+    assert read(second) == want
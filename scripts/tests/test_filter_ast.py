@@ -0,0 +1,67 @@
+import io
+import json
+import sys
+
+import pytest
+
+import filter_ast
+from _dumps import SMALL, write
+from pygml.bench import SHAPES, functions
+
+
+EDGE_CASES = {
+    "empty": [{}, [], {"inner": [{}, []]}],
+    "floats": [{"value": [1.5, -0.0, 1e-07, 2.5e+20, 0.1, 3.0, -12345.678]}],
+    "non-ascii": [{"name": "f\u00fcr", "value": "\u03bb \U0001f600 \"quoted\" \\ \t"}],
+    "scalars": [1, "two", None, True, False, -3],
+    "forbidden": [{"id": 1, "loc": {"line": 2}, "inner": [{"type": {}, "name": "x"}]}],
+}
+
+
+def _filtered(docs: list, chunk_size: int) -> str:
+    out = io.StringIO()
+    text = "\n".join(json.dumps(doc, indent=1) for doc in docs)
+    assert filter_ast.filter_stream(io.StringIO(text), out, chunk_size) == len(docs)
+    return out.getvalue()
+
+
+def _expected(docs: list) -> str:
+    return "".join(json.dumps(filter_ast.filter_node(doc), indent=2) + "\n" for doc in docs)
+
+
+@pytest.mark.parametrize("chunk_size", [61, 1 << 16])
+@pytest.mark.parametrize("shape", sorted(SMALL))
+def test_stream_matches_filter_node_on_dumps(shape, chunk_size):
+    docs = [SHAPES[shape](SMALL[shape])]
+    assert _filtered(docs, chunk_size) == _expected(docs)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+@pytest.mark.parametrize("case", sorted(EDGE_CASES))
+def test_stream_matches_filter_node_on_edge_cases(case, chunk_size):
+    docs = EDGE_CASES[case]
+    assert _filtered(docs, chunk_size) == _expected(docs)
+
+
+def test_stream_matches_filter_node_on_several_documents():
+    docs = [SHAPES[shape](SMALL[shape]) for shape in sorted(SMALL)] + EDGE_CASES["empty"]
+    assert _filtered(docs, 1 << 10) == _expected(docs)
+
+
+def _filter_main(monkeypatch, *argv: str) -> None:
+    monkeypatch.setattr(sys, "argv", ["filter_ast.py", *argv])
+    filter_ast.main()
+
+
+def test_second_file_that_does_not_exist_is_the_output(tmp_path, monkeypatch, capsys):
+    doc = functions(2)
+    src = write(tmp_path / "in.json", doc)
+    dst = str(tmp_path / "out.json")
+    _filter_main(monkeypatch, src, dst)
+    assert capsys.readouterr().out == ""
+    with open(dst) as f:
+        assert f.read() == json.dumps(filter_ast.filter_node(doc), indent=2) + "\n"
+
+    # now that it exists, both are inputs
+    _filter_main(monkeypatch, src, dst)
+    assert capsys.readouterr().out.count("TranslationUnitDecl") == 2
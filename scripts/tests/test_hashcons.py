@@ -0,0 +1,14 @@
+from _dumps import text
+from pygml import ast
+
+
+def test_hashcons_round_trip(prog):
+    hashcons = ast.HashCons()
+    shared = ast.decode_program(ast.encode_program(prog), hashcons)
+    assert text(shared) == text(prog)
+    again = ast.decode_program(ast.encode_program(prog), hashcons)
+    # each Decl's expression comes back as the very same object
+    roots = [(a.ddesc.expr, b.ddesc.expr) for a, b in zip(shared, again)
+             if hasattr(a.ddesc, "expr")]
+    assert roots
+    assert all(hashcons.hash_of(a) is not None and a is b for a, b in roots)
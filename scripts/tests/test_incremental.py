@@ -0,0 +1,33 @@
+from _dumps import expected, read, write
+from pygml import ast, jsonio
+from pygml.bench import functions, tasks
+from pygml.convert import convert_file
+from pygml.incremental import dump_incremental, state_path
+
+
+def test_incremental_matches_full_conversion(tmp_path):
+    doc = functions(6)
+    src = write(tmp_path / "unit.json", doc)
+    dst = str(tmp_path / "unit.json.conv")
+    convert_file(src, dst, incremental=True)
+    assert read(dst) == expected(doc)
+
+    # one function changed, one added
+    doc["inner"][2] = tasks(3)
+    doc["inner"].append(functions(7)["inner"][-1])
+    write(src, doc)
+    convert_file(src, dst, incremental=True)
+    assert read(dst) == expected(doc)
+    state = jsonio.load(state_path(dst))
+    assert len(state["functions"]) == len(list(ast.function_decls(doc)))
+
+
+def test_incremental_reconverts_only_changed_functions(tmp_path):
+    doc = functions(6)
+    path = str(tmp_path / "unit.json.conv.functions")
+    first = dump_incremental(list(ast.function_decls(doc)), path)
+    assert (first.reused, first.converted) == (0, 6)
+    doc["inner"][2] = tasks(3)
+    second = dump_incremental(list(ast.function_decls(doc)), path)
+    assert (second.reused, second.converted) == (5, 1)
+    assert second.data == expected(doc)
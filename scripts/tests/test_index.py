@@ -0,0 +1,19 @@
+from _dumps import text
+from pygml import ast
+
+
+def _counts(index: ast.ProgIndex) -> dict:
+    return {key: index.count("kind", key) for key in index.keys("kind")}
+
+
+def test_index_counts_match_the_program(prog):
+    index = ast.ProgIndex(prog)
+    # every expression is encoded as ["Tag", ...]
+    assert _counts(index) == {key: text(prog).count(f'["{key}"') for key in index.keys("kind")}
+
+
+def test_appending_builds_the_same_index(prog):
+    index = ast.ProgIndex([])
+    for decl in prog:
+        index.append(decl)
+    assert _counts(index) == _counts(ast.ProgIndex(prog))
@@ -0,0 +1,29 @@
+from _dumps import read, write
+from pygml import jsonio
+from pygml.convert import convert_file
+
+
+def test_output_is_the_same_for_every_backend(dump, tmp_path, monkeypatch):
+    src, want = dump
+    for name in jsonio.BACKENDS:
+        monkeypatch.setenv(jsonio.JSON_BACKEND_ENV, name)
+        dst = str(tmp_path / f"{name}.conv")
+        convert_file(src, dst, stream=False)
+        assert read(dst) == want
+
+
+def test_compressed_input_and_output(dump, tmp_path):
+    src, want = dump
+    packed = write(tmp_path / "unit.json.gz", jsonio.load(src))
+    dst = str(tmp_path / "unit.json.conv.gz")
+    convert_file(packed, dst)
+    assert jsonio.compression(dst) == "gzip"
+    assert read(dst) == want
+
+
+def test_stdlib_reads_instead_of_mapping(dump, tmp_path, monkeypatch):
+    src, _ = dump
+    expected = {name: jsonio.load(src, jsonio.BACKENDS[name]) for name in jsonio.BACKENDS}
+    monkeypatch.setattr(jsonio, "mapped", None)
+    assert jsonio.load(src, jsonio.BACKENDS["stdlib"]) == expected["stdlib"]
+    assert all(doc == expected["stdlib"] for doc in expected.values())
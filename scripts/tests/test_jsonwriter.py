@@ -0,0 +1,30 @@
+import json
+
+from _dumps import program, read
+from pygml import ast, convert, jsonio
+from pygml.cache import ConversionCache
+
+
+def test_streamed_json_matches_json_dumps(prog):
+    style = jsonio.output_backend()
+    for decl in prog:
+        assert ast.decl_json(decl, style) == json.dumps(ast.encode_decl(decl))
+
+
+def test_deep_program_streams_without_recursion():
+    prog = program("chain", 20_000)
+    text = "".join(ast.decl_json(d, jsonio.output_backend()) for d in prog)
+    assert text.count('["EInfixop"') == 20_000
+
+
+def test_cached_conversion_streams_to_the_file(dump, tmp_path, monkeypatch):
+    src, want = dump
+    cache = ConversionCache(str(tmp_path / "cache"))
+    # the default path never holds the whole output
+    monkeypatch.setattr(ConversionCache, "put", None)
+    monkeypatch.setattr(convert, "dump_functions", None)
+    first = str(tmp_path / "first.conv")
+    assert not convert.convert_file(src, first, cache=cache)
+    second = str(tmp_path / "second.conv")
+    assert convert.convert_file(src, second, cache=cache)
+    assert read(first) == read(second) == want
@@ -0,0 +1,11 @@
+from _dumps import text
+from pygml import ast
+
+
+def test_lazy_round_trip(prog):
+    js = ast.encode_program(prog)
+    # untouched, then decoded in full
+    assert ast.encode_program(ast.decode_program(js, lazy=True)) == js
+    lazy = ast.decode_program(js, lazy=True)
+    assert text(lazy) == text(prog)
+    assert ast.encode_program(lazy) == js
@@ -0,0 +1,22 @@
+import io
+import subprocess
+
+import pytest
+
+from pygml.convert import read_file
+from pygml.pipeline import run_pipeline
+
+
+def test_pipeline_matches_convert_file(dump):
+    src, want = dump
+    out = io.BytesIO()
+    # "cat FILE" stands in for clang, writing the dump to the pipe
+    stats = run_pipeline(src, out, clang=("cat",))
+    assert out.getvalue() == want
+    assert stats.items["read"] == len(read_file(src))
+
+
+def test_pipeline_reports_a_failed_clang(dump):
+    src, _ = dump
+    with pytest.raises(subprocess.CalledProcessError):
+        run_pipeline(src, io.BytesIO(), clang=("false",))
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from pygml import ast, server
+from pygml.bench import functions, write_dump
+from pygml.convert import convert_file
+
+
+@pytest.fixture
+def sock(tmp_path):
+    path = str(tmp_path / "s.sock")
+    srv = server.Server(path, server.Converter())
+    thread = threading.Thread(target=srv.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    srv.shutdown()
+    srv.server_close()
+    thread.join()
+
+
+def test_reply_text_is_what_convert_ast_writes(sock, tmp_path):
+    src = str(tmp_path / "unit.json")
+    with open(src, "w") as f:
+        write_dump(functions(3), f)
+    dst = str(tmp_path / "unit.json.conv")
+    convert_file(src, dst)
+    with open(dst, "rb") as f:
+        expected = f.read()
+    # converted, then served from memory
+    assert server.convert_text(sock, src) == expected
+    assert server.convert_text(sock, src) == expected
+    assert server.request(sock, {"op": "stats"})["stats"]["hits"] == 1
+    prog = server.convert(sock, src)
+    assert ast.encode_program(prog) == ast.encode_program(ast.convert_program(functions(3)))
+
+
+def test_errors_are_reported(sock, tmp_path):
+    with pytest.raises(RuntimeError, match="FileNotFoundError"):
+        server.convert_text(sock, str(tmp_path / "missing.json"))
+    src = str(tmp_path / "unit.json")
+    with open(src, "w") as f:
+        write_dump(functions(1), f)
+    with pytest.raises(RuntimeError, match="skip_unsupported"):
+        server.request(sock, {"op": "convert", "path": src, "skip_unsupported": "some"})
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    paths = []
+    for n in range(3):
+        paths.append(str(tmp_path / f"{n}.json"))
+        with open(paths[-1], "w") as f:
+            write_dump(functions(2), f)
+    converter = server.Converter()
+    text, _ = converter.get(paths[0])
+    # room for two programs
+    converter.max_size = 2 * len(text)
+    converter.get(paths[1])
+    converter.get(paths[0])
+    converter.get(paths[2])
+    assert list(converter.cache) == [paths[0], paths[2]]
+    assert converter.size == sum(len(e.text) for e in converter.cache.values())
+    assert converter.stats["evictions"] == 1
@@ -0,0 +1,14 @@
+from _dumps import text
+from pygml import ast
+
+
+def test_rewrite_identity_keeps_program(prog):
+    rewritten = [ast.rewrite_decl(d, lambda e: e) for d in prog]
+    assert text(rewritten) == text(prog)
+
+
+def test_walk_visits_every_expression(prog):
+    index = ast.ProgIndex(prog)
+    total = sum(index.count("kind", key) for key in index.keys("kind"))
+    for order in ("pre", "post"):
+        assert sum(1 for d in prog for _ in ast.iter_exprs(d, order)) == total
@@ -0,0 +1,14 @@
+from pygml import ast, workspan
+from pygml.bench import functions
+
+
+def test_fib_follows_its_recurrence():
+    prog = ast.convert_program(functions(1))
+    sizes = list(range(11))
+    est, = workspan.estimate(prog, sizes).values()
+    step = est.work[2] - est.work[1] - est.work[0]
+    for n in range(3, 11):
+        assert est.work[n] == est.work[n - 1] + est.work[n - 2] + step
+        assert est.span[n - 1] < est.span[n] < est.work[n]
+        # one task outstanding per level of the leftmost chain
+        assert est.live[n] == n - 1
@@ -176,22 +176,118 @@ let print_timers out =
 
 let _ = Format.fprintf Format.std_formatter "\n"
 
-let parsed_program =
-  if Filename.check_suffix !fname ".ml" then begin
-    let chan = open_in !fname in
-    parse chan
-  end else begin
-    (* Handle c program *)
-    let dir = Filename.dirname !fname in
-    let base = Filename.basename !fname in
-    let stem = Filename.remove_extension base in
-    let json_file = !fname ^ ".json" in
-    (* Dump json *)
+(* Convert a clang JSON dump through a running pygml conversion server
+   (PYTHONPATH=scripts python3 -m pygml.server serve) instead of starting
+   python3 for every file. The program comes back over the socket. None if
+   there is no server to connect to, so the caller can run the converter
+   itself; a server that fails mid-request fails the conversion. *)
+let convert_via_server sock json_file =
+  let path =
+    if Filename.is_relative json_file
+    then Filename.concat (Sys.getcwd ()) json_file
+    else json_file
+  in
+  let fd = Unix.socket Unix.PF_UNIX Unix.SOCK_STREAM 0 in
+  match Unix.connect fd (Unix.ADDR_UNIX sock) with
+  | exception Unix.Unix_error (err, _, _) ->
+    Unix.close fd;
+    message (Printf.sprintf "No conversion server at %s (%s), converting without it"
+               sock (Unix.error_message err));
+    None
+  | () ->
+    let fail e =
+      prerr_endline ("Error: AST Convert failed: " ^ e);
+      exit 1
+    in
+    (* a server gone away should fail the conversion, not kill gml *)
+    Sys.set_signal Sys.sigpipe Sys.Signal_ignore;
+    let oc = Unix.out_channel_of_descr fd in
+    let ic = Unix.in_channel_of_descr fd in
+    let req = `Assoc [("op", `String "convert"); ("path", `String path);
+                      ("skip_unsupported", `String "drivers")] in
+    let reply =
+      try
+        output_string oc (Yojson.Safe.to_string req ^ "\n");
+        flush oc;
+        Unix.shutdown fd Unix.SHUTDOWN_SEND;
+        let reply = Yojson.Safe.from_channel ic in
+        close_in ic;
+        reply
+      with
+      | Unix.Unix_error (err, _, _) -> fail (Unix.error_message err)
+      | Sys_error e | Yojson.Json_error e -> fail e
+    in
+    match reply with
+    | `Assoc fields ->
+       (match List.assoc_opt "prog" fields, List.assoc_opt "error" fields with
+        | Some prog, _ -> Some prog
+        | None, Some (`String e) -> failwith ("AST Convert failed: " ^ e)
+        | None, _ -> failwith "AST Convert failed: malformed server reply")
+    | _ -> failwith "AST Convert failed: malformed server reply"
+
+(* Run clang and the converter in one pygml process
+   (PYTHONPATH=scripts python3 -m pygml.pipeline) and read the program off its
+   stdout, so neither the clang dump nor the .conv file is written to disk. *)
+let convert_via_pipeline c_file =
+  let cmd = Printf.sprintf
+    "PYTHONPATH=scripts python3 -m pygml.pipeline --skip-drivers %s" c_file in
+  message (Printf.sprintf "Running: %s" cmd);
+  let ic = Unix.open_process_in cmd in
+  (* Read everything before parsing: a failed run may have written part of
+     the program already, which is not worth parsing *)
+  let buf = Buffer.create 65536 in
+  let chunk = Bytes.create 65536 in
+  let rec read_all () =
+    let n = input ic chunk 0 (Bytes.length chunk) in
+    if n > 0 then (Buffer.add_subbytes buf chunk 0 n; read_all ())
+  in
+  read_all ();
+  match Unix.close_process_in ic with
+  | Unix.WEXITED 0 ->
+    (try Yojson.Safe.from_string (Buffer.contents buf)
+     with Yojson.Json_error e ->
+       prerr_endline ("Error: AST Convert failed: " ^ e);
+       exit 1)
+  | _ ->
+    prerr_endline "Error: AST Convert failed.";
+    exit 1
+
+(* The converter: the zipapp named by GML_CONVERT_BUNDLE if there is one
+   (PYTHONPATH=scripts python3 -m pygml.bundle builds it), which starts
+   faster, else the scripts *)
+let converter_command () =
+  match Sys.getenv_opt "GML_CONVERT_BUNDLE" with
+  | Some bundle when bundle <> "" -> "python3 " ^ Filename.quote bundle
+  | _ -> "PYTHONPATH=scripts python3 -m convert_ast"
+
+(* Convert json_file to json_file.conv with the converter and read it back *)
+let convert_with_command json_file =
+  let cmd = Printf.sprintf "%s --skip-drivers %s" (converter_command ()) json_file in
+  message (Printf.sprintf "Running: %s" cmd);
+
+  let exit_code = Sys.command cmd in
+  if exit_code <> 0 then begin
+    prerr_endline "Error: AST Convert failed.";
+    exit 1
+  end;
+
+  let conv_json = (json_file ^ ".conv") in
+  message (Printf.sprintf "Converted json: %s\n" conv_json);
+
+  Yojson.Safe.from_file conv_json
+
+(* Dump the clang AST of c_file to c_file.json and convert that file, with
+   the conversion server if there is one *)
+let convert_via_files c_file =
+    let json_file = c_file ^ ".json" in
+    (* Dump json for the whole translation unit; the converter keeps the
+       functions defined in this file and skips only drivers it cannot
+       handle, such as main; any other function it cannot handle fails *)
     let cmd = Printf.sprintf
       "clang -fopenmp -fno-color-diagnostics \
-       -Xclang -ast-dump=json -Xclang -ast-dump-filter=%s \
+       -Xclang -ast-dump=json \
        -fsyntax-only %s > %s"
-      stem !fname json_file
+      c_file json_file
     in
     message (Printf.sprintf "Running clang to generate AST JSON:\n%s\n%!" cmd);
 
@@ -202,19 +298,25 @@ let parsed_program =
     end;
 
     (*Convert to .ml AST*)
-    let cmd = Printf.sprintf "PYTHONPATH=scripts python3 -m convert_ast %s" json_file in
-    message (Printf.sprintf "Running: %s" cmd);
+    match Sys.getenv_opt "GML_CONVERT_SOCKET" with
+    | Some sock when sock <> "" ->
+      message (Printf.sprintf "Converting via server at %s" sock);
+      (match convert_via_server sock json_file with
+       | Some prog -> prog
+       | None -> convert_with_command json_file)
+    | _ -> convert_with_command json_file
 
-    let exit_code = Sys.command cmd in
-    if exit_code <> 0 then begin
-      prerr_endline "Error: AST Convert failed.";
-      exit 1
-    end;
-
-    let conv_json = (json_file ^ ".conv") in
-    message (Printf.sprintf "Converted json: %s\n" conv_json);
-  
-    let conv_prog = Yojson.Safe.from_file conv_json in
+let parsed_program =
+  if Filename.check_suffix !fname ".ml" then begin
+    let chan = open_in !fname in
+    parse chan
+  end else begin
+    (* Handle c program; GML_CONVERT_PIPELINE=1 skips the files in between *)
+    let conv_prog =
+      match Sys.getenv_opt "GML_CONVERT_PIPELINE" with
+      | Some v when v <> "" && v <> "0" -> convert_via_pipeline !fname
+      | _ -> convert_via_files !fname
+    in
     match p_prog_of_yojson conv_prog with
     | Ok prog ->
         message "Reloaded AST from JSON successfully.";
@@ -1,5 +1,8 @@
 dune build
 
+echo Running the converter tests in scripts/tests...
+python3 -m pytest -q scripts/tests
+
 echo This script runs all files in paper-examples and testcases with output sent to /dev/null
 
 for file in paper-examples/*.ml; do